@@ -0,0 +1,844 @@
+"""
+ESGTrader benchmark harness
+
+Seeds a local Postgres with a synthetic dataset and drives the web app's routes
+at a fixed concurrency, reporting latency percentiles and throughput per route.
+
+	python bench/bench.py seed --database-uri postgresql://localhost/esgtrader_bench --scale large
+	ESGTRADER_DATABASE_URI=postgresql://localhost/esgtrader_bench python server.py serve --workers 4
+	python bench/bench.py run --database-uri postgresql://localhost/esgtrader_bench --output before.json
+	python bench/bench.py compare before.json after.json
+
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import socket
+import itertools
+import threading
+import subprocess
+import collections
+import http.client
+import urllib.parse
+from decimal import Decimal, ROUND_HALF_UP
+from datetime import date, datetime, timedelta
+import click
+from sqlalchemy import create_engine, text, exc
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+
+#
+# Dataset.
+#
+# Everything is generated inside Postgres with generate_series, so seeding the
+# large scale (about 12.6M prices and 10M transactions) moves no rows through
+# Python. IDs follow the app's formats (S###, INV###, PORT###) and each investor
+# has one portfolio with the same number.
+#
+# Transactions are written before the triggers exist (`server.py migrate`
+# installs them afterwards), so holdings and portfolio values are aggregated from
+# the transactions directly, the same way the holdings trigger would have built
+# them: buys are averaged into the position, sells only reduce its count. Every
+# SELL_EVERY-th buy is followed one second later by a sell of half the units, so
+# no position ever goes negative.
+#
+SCALES = {
+	'small': dict(stocks=500, years=2, investors=2000, transactions=100000),
+	'medium': dict(stocks=2000, years=3, investors=20000, transactions=1000000),
+	'large': dict(stocks=10000, years=5, investors=100000, transactions=10000000),
+}
+SELL_EVERY = 5
+SECTORS = ['Technology', 'Healthcare', 'Financials', 'Energy', 'Utilities', 'Industrials',
+	'Materials', 'Consumer Staples', 'Consumer Discretionary', 'Real Estate', 'Communication Services']
+
+# Rows are generated this many stocks / investors per statement, to report progress and bound memory
+STOCK_CHUNK = 500
+INVESTOR_CHUNK = 5000
+
+
+def bench_engine(database_uri):
+	"""
+	Engine for the benchmark database
+	"""
+	if not database_uri:
+		raise click.UsageError("Pass --database-uri or set ESGTRADER_DATABASE_URI")
+	return create_engine(database_uri)
+
+
+def run_sql_file(engine, path):
+	"""
+	Run a .sql script through the DBAPI cursor, as `server.py migrate` does
+	"""
+	with open(path) as f:
+		script = f.read()
+	raw_conn = engine.raw_connection()
+	try:
+		cursor = raw_conn.cursor()
+		cursor.execute(script)
+		cursor.close()
+		raw_conn.commit()
+	finally:
+		raw_conn.close()
+
+
+def seed_step(conn, label, query, params, seed):
+	"""
+	Run one generating statement in its own transaction and report how long it took
+	"""
+	started = time.perf_counter()
+	# Reseeding per statement keeps a dataset reproducible however it is chunked
+	conn.execute(text("SELECT setseed(:seed)"), {"seed": seed})
+	rows = conn.execute(text(query), params).rowcount
+	conn.commit()
+	click.echo(f"  {label}: {rows:,} rows in {time.perf_counter() - started:.1f}s")
+	return rows
+
+
+def seed_rng(seed, *parts):
+	"""
+	setseed() value in [-1, 1] for one chunk of a seeded dataset
+	"""
+	return random.Random(f"{seed}:{':'.join(map(str, parts))}").uniform(-1, 1)
+
+
+def server_command(database_uri, *args):
+	"""
+	Run a `server.py` maintenance command against the benchmark database
+	"""
+	env = dict(os.environ, ESGTRADER_DATABASE_URI=database_uri)
+	click.echo(f"server.py {' '.join(args)}")
+	subprocess.run([sys.executable, os.path.join(REPO_DIR, 'server.py')] + list(args), env=env, check=True)
+
+
+def padded_id(prefix, number):
+	"""
+	SQL for an app-style ID: the prefix and the number, zero-padded to at least three digits
+	"""
+	number = f"CAST({number} AS TEXT)"
+	return f"'{prefix}' || lpad({number}, GREATEST(length({number}), 3), '0')"
+
+
+STOCKS_QUERY = f"""
+	INSERT INTO stock (stock_id, ticker, sector)
+	SELECT {padded_id('S', 'i')},
+	       'T' || i,
+	       (CAST(:sectors AS TEXT[]))[1 + i % cardinality(CAST(:sectors AS TEXT[]))]
+	FROM generate_series(1, :stocks) i
+"""
+
+# Geometric random walk per stock over weekdays, starting between 20 and 500
+PRICES_QUERY = f"""
+	INSERT INTO stock_price (stock_id, price_date, daily_price)
+	SELECT {padded_id('S', 's')},
+	       CAST(d AS DATE),
+	       ROUND(CAST((20 + (s * 7919) % 480) * exp(SUM((random() - 0.5) * 0.04)
+	             OVER (PARTITION BY s ORDER BY d)) AS NUMERIC), 2)
+	FROM generate_series(:first, :last) s,
+	     generate_series(CAST(:start AS DATE), CAST(:end AS DATE), INTERVAL '1 day') d
+	WHERE extract(isodow FROM d) < 6
+"""
+
+ESG_QUERY = f"""
+	INSERT INTO esg_score (stock_id, score_date, esg_score)
+	SELECT {padded_id('S', 's')},
+	       CAST(d AS DATE),
+	       ROUND(CAST(20 + random() * 70 AS NUMERIC), 2)
+	FROM generate_series(1, :stocks) s,
+	     generate_series(CAST(:start AS DATE), CAST(:end AS DATE), INTERVAL '3 months') d
+"""
+
+MACRO_QUERY = """
+	INSERT INTO daily_macro_data (macro_date, risk_free_rate, interest_rate)
+	SELECT macro_date, ROUND(CAST(rate AS NUMERIC), 4), ROUND(CAST(rate + 0.01 AS NUMERIC), 4)
+	FROM (
+	    SELECT CAST(d AS DATE) AS macro_date,
+	           GREATEST(0.03 + SUM((random() - 0.5) * 0.0005) OVER (ORDER BY d), 0) AS rate
+	    FROM generate_series(CAST(:start AS DATE), CAST(:end AS DATE), INTERVAL '1 day') d
+	) r
+"""
+
+INVESTORS_QUERY = f"""
+	INSERT INTO investor (investor_id, company_name)
+	SELECT {padded_id('INV', 'i')},
+	       (ARRAY['Blue', 'North', 'Green', 'Summit', 'Harbor', 'Atlas', 'Cedar', 'Silver'])[1 + i % 8]
+	       || ' ' || (ARRAY['Capital', 'Partners', 'Holdings', 'Advisors', 'Ventures'])[1 + (i / 8) % 5]
+	       || ' ' || i
+	FROM generate_series(1, :investors) i
+"""
+
+PORTFOLIOS_QUERY = f"""
+	INSERT INTO portfolio (portfolio_id, investor_id, total_value, creation_date)
+	SELECT {padded_id('PORT', 'i')},
+	       {padded_id('INV', 'i')},
+	       0,
+	       CAST(:start AS DATE) - CAST(floor(random() * 365) AS INTEGER)
+	FROM generate_series(1, :investors) i
+"""
+
+TRANSACTIONS_QUERY = f"""
+	WITH days AS (
+	    SELECT array_agg(CAST(d AS DATE) ORDER BY d) AS trading_days
+	    FROM generate_series(CAST(:start AS DATE), CAST(:end AS DATE), INTERVAL '1 day') d
+	    WHERE extract(isodow FROM d) < 6
+	),
+	trades AS (
+	    SELECT i, j,
+	           1 + CAST(floor(random() * :stocks) AS INTEGER) AS s,
+	           trading_days[1 + CAST(floor(random() * cardinality(trading_days)) AS INTEGER)] AS trade_date,
+	           1 + CAST(floor(random() * 500) AS INTEGER) AS units
+	    FROM days, generate_series(:first, :last) i, generate_series(1, :per_investor) j
+	),
+	priced AS (
+	    SELECT trades.*, {padded_id('S', 's')} AS stock_id
+	    FROM trades
+	)
+	INSERT INTO transaction (investor_id, stock_id, transaction_time, transaction_type, unit_price, unit_number)
+	SELECT {padded_id('INV', 't.i')},
+	       t.stock_id,
+	       t.trade_date + make_interval(hours => 10, secs => 2 * t.j + side.offset_seconds),
+	       side.transaction_type,
+	       p.daily_price,
+	       side.unit_number
+	FROM priced t
+	JOIN stock_price p ON p.stock_id = t.stock_id AND p.price_date = t.trade_date
+	CROSS JOIN LATERAL (VALUES ('buy', 0, t.units), ('sell', 1, t.units / 2)) AS side(transaction_type, offset_seconds, unit_number)
+	WHERE side.transaction_type = 'buy'
+	   OR (t.j % :sell_every = 0 AND side.unit_number > 0)
+"""
+
+HOLDINGS_QUERY = """
+	INSERT INTO holdings (stock_id, portfolio_id, average_price, holding_count)
+	SELECT t.stock_id, p.portfolio_id,
+	       SUM(t.unit_price * t.unit_number) FILTER (WHERE t.transaction_type = 'buy')
+	           / SUM(t.unit_number) FILTER (WHERE t.transaction_type = 'buy'),
+	       SUM(CASE WHEN t.transaction_type = 'buy' THEN t.unit_number ELSE -t.unit_number END)
+	FROM transaction t
+	JOIN portfolio p ON p.investor_id = t.investor_id
+	GROUP BY t.stock_id, p.portfolio_id
+	HAVING SUM(CASE WHEN t.transaction_type = 'buy' THEN t.unit_number ELSE -t.unit_number END) > 0
+"""
+
+PORTFOLIO_VALUES_QUERY = """
+	UPDATE portfolio p
+	SET total_value = v.total_value
+	FROM (
+	    SELECT investor_id,
+	           SUM(CASE WHEN transaction_type = 'buy' THEN 1 ELSE -1 END * unit_price * unit_number) AS total_value
+	    FROM transaction
+	    GROUP BY investor_id
+	) v
+	WHERE p.investor_id = v.investor_id
+"""
+
+
+#
+# Load generation.
+#
+# Each route is run on its own for --requests requests from --concurrency
+# threads, each thread holding one keep-alive HTTP connection, after a few
+# unrecorded warm-up requests. Requests are built from IDs sampled out of the
+# benchmark database, so lookups hit real rows and sells are covered by a
+# holding. A redirect counts as success unless it lands on an error
+# confirmation (e.g. a rejected transaction).
+#
+SAMPLE_SIZE = 1000
+
+
+def sample_ids(database_uri):
+	"""
+	Investor, stock and position IDs for building requests
+	"""
+	with bench_engine(database_uri).connect() as conn:
+		positions = conn.execute(text("""
+			SELECT p.investor_id, h.stock_id
+			FROM holdings h TABLESAMPLE SYSTEM (1)
+			JOIN portfolio p ON p.portfolio_id = h.portfolio_id
+			WHERE h.holding_count > 0
+			LIMIT :limit
+		"""), {"limit": SAMPLE_SIZE}).fetchall()
+		if len(positions) < SAMPLE_SIZE:
+			positions = conn.execute(text("""
+				SELECT p.investor_id, h.stock_id
+				FROM holdings h
+				JOIN portfolio p ON p.portfolio_id = h.portfolio_id
+				WHERE h.holding_count > 0
+				ORDER BY random()
+				LIMIT :limit
+			"""), {"limit": SAMPLE_SIZE}).fetchall()
+		stocks = conn.execute(text("""
+			SELECT s.stock_id, s.ticker
+			FROM stock s
+			WHERE EXISTS (SELECT 1 FROM stock_price sp WHERE sp.stock_id = s.stock_id)
+			ORDER BY random()
+			LIMIT :limit
+		"""), {"limit": SAMPLE_SIZE}).fetchall()
+		investors = conn.execute(text("""
+			SELECT investor_id, company_name FROM investor ORDER BY random() LIMIT :limit
+		"""), {"limit": SAMPLE_SIZE}).fetchall()
+	if not (positions and stocks and investors):
+		raise click.ClickException("The benchmark database has no holdings to sample; run `bench.py seed` first")
+	return {'positions': positions, 'stocks': stocks, 'investors': investors}
+
+
+def get(path, **params):
+	return 'GET', path + ('?' + urllib.parse.urlencode(params) if params else ''), None
+
+
+def post(path, **form):
+	return 'POST', path, urllib.parse.urlencode(form)
+
+
+# name -> function(ids, rng) returning (method, path, body)
+ROUTES = {
+	'index': lambda ids, rng: get('/'),
+	'stocks': lambda ids, rng: get('/stocks'),
+	'investors': lambda ids, rng: get('/investors'),
+	'transactions': lambda ids, rng: get('/transactions'),
+	'holdings': lambda ids, rng: get('/holdings'),
+	'portfolios': lambda ids, rng: get('/portfolios'),
+	'risk_metrics': lambda ids, rng: get('/risk_metrics'),
+	'macro_data': lambda ids, rng: get('/macro_data'),
+	'stock_prices': lambda ids, rng: get('/stock_prices'),
+	'esg_scores': lambda ids, rng: get('/esg_scores'),
+	'top_investors': lambda ids, rng: get('/top_investors'),
+	'esg_stocks': lambda ids, rng: get('/esg-stocks'),
+	'best_buys': lambda ids, rng: get('/best_buys'),
+	'new_investor': lambda ids, rng: get('/new_investor'),
+	'manage_investor': lambda ids, rng: get('/manage_investor', investor_id=rng.choice(ids['investors'])[0]),
+	'add_holdings': lambda ids, rng: get('/add_holdings', investor_id=rng.choice(ids['investors'])[0]),
+	'add_transactions': lambda ids, rng: get('/add_transactions'),
+	'check_holdings': lambda ids, rng: get('/check_holdings', **dict(zip(('investor_id', 'stock_id'), rng.choice(ids['positions'])))),
+	'search_investors': lambda ids, rng: get('/api/search/investors', q=rng.choice(ids['investors'])[1].split()[0][:3]),
+	'search_stocks': lambda ids, rng: get('/api/search/stocks', q=rng.choice(ids['stocks'])[1][:2]),
+	'submit_transaction': lambda ids, rng: submit_transaction_request(ids, rng),
+	'pool_stats': lambda ids, rng: get('/pool_stats'),
+	'metrics': lambda ids, rng: get('/metrics'),
+}
+
+
+def submit_transaction_request(ids, rng):
+	"""
+	Mostly small buys of random stocks, with one-share sells of sampled positions
+	"""
+	if rng.random() < 0.25:
+		investor_id, stock_id = rng.choice(ids['positions'])
+		return post('/submit_transaction', investor_id=investor_id, stock_id=stock_id, transaction_type='sell', unit_number=1)
+	return post('/submit_transaction', investor_id=rng.choice(ids['investors'])[0],
+		stock_id=rng.choice(ids['stocks'])[0], transaction_type='buy', unit_number=rng.randint(1, 100))
+
+
+class Client:
+	"""
+	One keep-alive HTTP connection, reopened after errors
+	"""
+
+	def __init__(self, url, timeout):
+		parts = urllib.parse.urlsplit(url)
+		self.host, self.port = parts.hostname, parts.port or 80
+		self.timeout = timeout
+		self.conn = None
+
+	def request(self, method, path, body):
+		"""
+		Send one request; returns (ok, elapsed seconds)
+		"""
+		headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body is not None else {}
+		started = time.perf_counter()
+		try:
+			if self.conn is None:
+				self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+			self.conn.request(method, path, body=body, headers=headers)
+			response = self.conn.getresponse()
+			response.read()
+			location = response.getheader('Location') or ''
+			ok = response.status < 300 or (response.status < 400 and 'confirmation=error' not in location)
+		except (OSError, http.client.HTTPException):
+			self.close()
+			ok = False
+		return ok, time.perf_counter() - started
+
+	def close(self):
+		if self.conn is not None:
+			self.conn.close()
+			self.conn = None
+
+
+def percentile(sorted_values, pct):
+	"""
+	Nearest-rank percentile of an already sorted list
+	"""
+	if not sorted_values:
+		return None
+	return sorted_values[max(math.ceil(pct / 100 * len(sorted_values)) - 1, 0)]
+
+
+def run_route(url, build, ids, concurrency, requests, warmup, timeout, seed):
+	"""
+	Drive one route and summarise its latencies
+	"""
+	counter = iter(range(requests))
+	counter_lock = threading.Lock()
+	latencies = []
+	errors = [0]
+	results_lock = threading.Lock()
+
+	def worker(number):
+		rng = random.Random(f"{seed}:{number}")
+		client = Client(url, timeout)
+		try:
+			for _ in range(warmup):
+				client.request(*build(ids, rng))
+			barrier.wait()
+			while True:
+				with counter_lock:
+					if next(counter, None) is None:
+						break
+				ok, elapsed = client.request(*build(ids, rng))
+				with results_lock:
+					latencies.append(elapsed)
+					if not ok:
+						errors[0] += 1
+		finally:
+			client.close()
+
+	# Warm-up requests finish on every thread before the clock starts
+	barrier = threading.Barrier(concurrency + 1)
+	threads = [threading.Thread(target=worker, args=(number,), daemon=True) for number in range(concurrency)]
+	for thread in threads:
+		thread.start()
+	barrier.wait()
+	started = time.perf_counter()
+	for thread in threads:
+		thread.join()
+	wall = time.perf_counter() - started
+
+	latencies.sort()
+	ms = lambda value: round(value * 1000, 2) if value is not None else None
+	return {
+		'requests': len(latencies),
+		'errors': errors[0],
+		'seconds': round(wall, 3),
+		'throughput_rps': round(len(latencies) / wall, 1) if wall else None,
+		'p50_ms': ms(percentile(latencies, 50)),
+		'p95_ms': ms(percentile(latencies, 95)),
+		'p99_ms': ms(percentile(latencies, 99)),
+		'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+		'max_ms': ms(latencies[-1] if latencies else None),
+	}
+
+
+def dataset_sizes(database_uri):
+	"""
+	Row counts of the seeded tables (planner estimates, so large tables are not
+	scanned); a partitioned table counts the rows of its partitions
+	"""
+	with bench_engine(database_uri).connect() as conn:
+		rows = conn.execute(text("""
+			SELECT c.relname, CAST(CASE
+				WHEN c.relkind = 'p' THEN (
+					SELECT COALESCE(SUM(GREATEST(p.reltuples, 0)), 0)
+					FROM pg_partition_tree(c.oid) t
+					JOIN pg_class p ON p.oid = t.relid
+					WHERE t.isleaf
+				)
+				ELSE GREATEST(c.reltuples, 0)
+			END AS BIGINT)
+			FROM pg_class c
+			WHERE c.relkind IN ('r', 'p')
+			  AND c.relname IN ('stock', 'stock_price', 'esg_score', 'daily_macro_data',
+			                    'investor', 'portfolio', 'holdings', 'transaction', 'risk_metrics')
+			ORDER BY c.relname
+		""")).fetchall()
+	return dict(rows)
+
+
+def git_revision():
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+			capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def format_row(name, result):
+	return (f"{name:<20} {result['requests']:>8,} {result['errors']:>7,} {result['throughput_rps']:>9,.1f}"
+		f" {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f}")
+
+
+#
+# Concurrency stress test.
+#
+# `stress` hammers a single position from many threads at once, the worst case
+# for the holdings trigger: every order locks the same holdings and portfolio
+# rows. It creates a throwaway investor with an empty portfolio, then each
+# thread places random buys at random prices (inserted directly, so each thread
+# pays its own prices), random sells through execute_transaction() (the path
+# /submit_transaction and the order API use) and, every BATCH_EVERY orders, a
+# buy and a sell in one INSERT (the batch path).
+#
+# The trigger applies orders in the order they get the position's row lock, not
+# in transaction_time order, so each thread numbers an order after its INSERT
+# and before its COMMIT, while it still holds the lock. Afterwards the log is
+# replayed in that order, as the trigger applies it, and the holding's share
+# count and average price must match the replay exactly (a lost update shows up
+# as a different average), the portfolio total must match the log, and sells
+# that were not covered must have been rejected, not failed.
+#
+STRESS_INVESTOR = 'INVSTRESS'
+STRESS_PORTFOLIO = 'PSTRESS'
+BATCH_EVERY = 5
+
+STRESS_ORDER_QUERY = """
+	SELECT status FROM execute_transaction(:investor_id, :stock_id, :transaction_type, :unit_number, :transaction_time)
+"""
+
+STRESS_BUY_QUERY = """
+	INSERT INTO transaction (investor_id, stock_id, transaction_time, transaction_type, unit_price, unit_number)
+	VALUES (:investor_id, :stock_id, :transaction_time, 'buy', :unit_price, :unit_number)
+"""
+
+STRESS_BATCH_QUERY = """
+	INSERT INTO transaction (investor_id, stock_id, transaction_time, transaction_type, unit_price, unit_number)
+	VALUES (:investor_id, :stock_id, :buy_time, 'buy', :buy_price, :buy_units),
+	       (:investor_id, :stock_id, :sell_time, 'sell', :sell_price, :sell_units)
+"""
+
+STRESS_CHECK_QUERY = """
+	SELECT COALESCE((SELECT holding_count FROM holdings WHERE portfolio_id = :portfolio_id AND stock_id = :stock_id), 0),
+	       (SELECT average_price FROM holdings WHERE portfolio_id = :portfolio_id AND stock_id = :stock_id),
+	       (SELECT total_value FROM portfolio WHERE portfolio_id = :portfolio_id),
+	       COALESCE(SUM(CASE WHEN transaction_type = 'buy' THEN 1 ELSE -1 END * unit_price * unit_number), 0)
+	FROM transaction
+	WHERE investor_id = :investor_id AND stock_id = :stock_id
+"""
+
+STRESS_LOG_QUERY = """
+	SELECT transaction_time, transaction_type, unit_price, unit_number
+	FROM transaction
+	WHERE investor_id = :investor_id AND stock_id = :stock_id
+"""
+
+CENT = Decimal('0.01')
+
+
+def remove_stress_investor(conn):
+	"""
+	Delete the stress test's investor with everything that references it
+	"""
+	params = {"investor_id": STRESS_INVESTOR, "portfolio_id": STRESS_PORTFOLIO}
+	conn.execute(text("DELETE FROM holdings WHERE portfolio_id = :portfolio_id"), params)
+	conn.execute(text("DELETE FROM risk_metrics WHERE portfolio_id = :portfolio_id"), params)
+	conn.execute(text("DELETE FROM transaction WHERE investor_id = :investor_id"), params)
+	conn.execute(text("DELETE FROM portfolio WHERE portfolio_id = :portfolio_id"), params)
+	conn.execute(text("DELETE FROM investor WHERE investor_id = :investor_id"), params)
+
+
+def stress_outcome(error):
+	"""
+	Name for a failed order: sells the trigger refused are 'rejected', anything
+	else (deadlocks, unique violations) is a concurrency failure
+	"""
+	code = getattr(error.orig, 'pgcode', None)
+	if code == 'P0001':
+		return 'rejected'
+	return {'40P01': 'deadlock', '23505': 'unique_violation', '40001': 'serialization_failure'}.get(code, type(error.orig).__name__)
+
+
+def stress_price(rng, price):
+	"""
+	A random trade price within 50% of price
+	"""
+	return (price * rng.randint(50, 150) / 100).quantize(CENT)
+
+
+def stress_worker(engine, stock_id, price, orders, rng, clock, sequence, applied, outcomes, outcomes_lock):
+	"""
+	Place random orders on the stress position from one connection, counting
+	outcomes and recording the sequence number each committed order was applied
+	at (applied[transaction_time])
+	"""
+	base = {"investor_id": STRESS_INVESTOR, "stock_id": stock_id}
+	with engine.connect() as conn:
+		for number in range(orders):
+			try:
+				if number % BATCH_EVERY == BATCH_EVERY - 1:
+					times = [next(clock), next(clock)]
+					conn.execute(text(STRESS_BATCH_QUERY), dict(base, buy_time=times[0], sell_time=times[1],
+						buy_price=stress_price(rng, price), buy_units=rng.randint(1, 10),
+						sell_price=price, sell_units=rng.randint(1, 10)))
+					outcome = 'ok'
+				elif rng.random() < 0.5:
+					times = [next(clock)]
+					conn.execute(text(STRESS_BUY_QUERY), dict(base, transaction_time=times[0],
+						unit_price=stress_price(rng, price), unit_number=rng.randint(1, 10)))
+					outcome = 'ok'
+				else:
+					times = [next(clock)]
+					outcome = conn.execute(text(STRESS_ORDER_QUERY), dict(base, transaction_time=times[0],
+						transaction_type='sell', unit_number=rng.randint(1, 10))).scalar()
+				if outcome == 'ok':
+					# The position is locked until the commit, so this numbers orders in the order they were applied
+					applied_at = next(sequence)
+					conn.commit()
+				else:
+					conn.rollback()
+			except exc.DBAPIError as e:
+				conn.rollback()
+				outcome = stress_outcome(e)
+			with outcomes_lock:
+				outcomes[outcome] += 1
+				if outcome == 'ok':
+					applied.update((transaction_time, applied_at) for transaction_time in times)
+
+
+def replay_position(trades):
+	"""
+	(holding_count, average_price, oversold) after applying trades
+	[(transaction_type, unit_price, unit_number)] in order the way the holdings
+	trigger does, average_price rounded to cents after every buy as the column
+	stores it
+	"""
+	count, average, oversold = 0, Decimal(0), False
+	for transaction_type, unit_price, unit_number in trades:
+		if transaction_type == 'buy':
+			average = ((average * count + unit_price * unit_number) / (count + unit_number)).quantize(CENT, ROUND_HALF_UP)
+			count += unit_number
+		else:
+			count -= unit_number
+			oversold = oversold or count < 0
+	return count, average, oversold
+
+
+#
+# Command line interface.
+#
+@click.group()
+def cli():
+	"""
+	ESGTrader benchmark harness: seed a database, load-test the app, compare runs
+	"""
+
+
+@cli.command()
+@click.option('--database-uri', envvar='ESGTRADER_DATABASE_URI', help='Database to seed (all its ESGTrader tables are dropped)')
+@click.option('--scale', type=click.Choice(list(SCALES)), default='small', show_default=True)
+@click.option('--stocks', type=click.IntRange(1), help='Override the scale\'s stock count')
+@click.option('--years', type=click.IntRange(1), help='Override the scale\'s years of daily prices')
+@click.option('--investors', type=click.IntRange(1), help='Override the scale\'s investor count')
+@click.option('--transactions', type=click.IntRange(1), help='Override the scale\'s transaction count (approximate)')
+@click.option('--seed', default=4111, show_default=True, help='Random seed; the same seed and sizes give the same dataset')
+@click.option('--end-date', type=click.DateTime(['%Y-%m-%d']), help='Last price date (default today)')
+@click.option('--risk/--no-risk', default=True, help='Fill risk_metrics with `server.py compute-risk` (needs numpy)')
+@click.option('--yes', is_flag=True, help='Do not ask before dropping the existing tables')
+def seed(database_uri, scale, stocks, years, investors, transactions, seed, end_date, risk, yes):
+	"""
+	Create the schema in a local database and fill it with a synthetic dataset
+	"""
+	sizes = dict(SCALES[scale])
+	for name, value in (('stocks', stocks), ('years', years), ('investors', investors), ('transactions', transactions)):
+		if value is not None:
+			sizes[name] = value
+	engine = bench_engine(database_uri)
+	if not yes:
+		click.confirm(f"Drop and re-create the ESGTrader tables in {engine.url!r}?", abort=True)
+
+	end = end_date.date() if end_date else date.today()
+	start = end - timedelta(days=365 * sizes['years'])
+	# Each buy is followed by a sell every SELL_EVERY trades
+	per_investor = max(round(sizes['transactions'] / sizes['investors'] / (1 + 1 / SELL_EVERY)), 1)
+	click.echo(f"Seeding {sizes['stocks']:,} stocks, {sizes['years']} years of prices ({start} to {end}), "
+		f"{sizes['investors']:,} investors with {per_investor} trades each")
+
+	started = time.perf_counter()
+	run_sql_file(engine, os.path.join(BENCH_DIR, 'schema.sql'))
+	with engine.connect() as conn:
+		dates = {"start": start, "end": end}
+		seed_step(conn, "stock", STOCKS_QUERY, {"stocks": sizes['stocks'], "sectors": SECTORS}, seed_rng(seed, 'stock'))
+		for first in range(1, sizes['stocks'] + 1, STOCK_CHUNK):
+			last = min(first + STOCK_CHUNK - 1, sizes['stocks'])
+			seed_step(conn, f"stock_price S{first:03d}-S{last:03d}", PRICES_QUERY,
+				dict(dates, first=first, last=last), seed_rng(seed, 'stock_price', first))
+		seed_step(conn, "esg_score", ESG_QUERY, dict(dates, stocks=sizes['stocks']), seed_rng(seed, 'esg_score'))
+		seed_step(conn, "daily_macro_data", MACRO_QUERY, dates, seed_rng(seed, 'daily_macro_data'))
+		seed_step(conn, "investor", INVESTORS_QUERY, {"investors": sizes['investors']}, seed_rng(seed, 'investor'))
+		seed_step(conn, "portfolio", PORTFOLIOS_QUERY, dict(dates, investors=sizes['investors']), seed_rng(seed, 'portfolio'))
+		for first in range(1, sizes['investors'] + 1, INVESTOR_CHUNK):
+			last = min(first + INVESTOR_CHUNK - 1, sizes['investors'])
+			seed_step(conn, f"transaction INV{first:03d}-INV{last:03d}", TRANSACTIONS_QUERY,
+				dict(dates, first=first, last=last, stocks=sizes['stocks'], per_investor=per_investor, sell_every=SELL_EVERY),
+				seed_rng(seed, 'transaction', first))
+		seed_step(conn, "holdings", HOLDINGS_QUERY, {}, seed_rng(seed, 'holdings'))
+		seed_step(conn, "portfolio values", PORTFOLIO_VALUES_QUERY, {}, seed_rng(seed, 'portfolio values'))
+	raw_conn = engine.raw_connection()
+	try:
+		raw_conn.set_isolation_level(0)
+		raw_conn.cursor().execute("VACUUM ANALYZE")
+	finally:
+		raw_conn.close()
+	engine.dispose()
+
+	# Triggers, P&L tables, indexes and views, built over the seeded rows
+	server_command(database_uri, 'migrate')
+	if risk:
+		try:
+			import numpy
+		except ImportError:
+			click.echo("numpy is not installed, skipping compute-risk (the ESG ranking will be empty)")
+		else:
+			server_command(database_uri, 'compute-risk', '--as-of', end.isoformat())
+	server_command(database_uri, 'refresh-rankings')
+	click.echo(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+
+@cli.command()
+@click.option('--url', default='http://localhost:8111', show_default=True, help='Base URL of the running app')
+@click.option('--database-uri', envvar='ESGTRADER_DATABASE_URI', help='The database the app serves, to sample IDs from')
+@click.option('--concurrency', '-c', default=8, show_default=True, type=click.IntRange(1))
+@click.option('--requests', '-n', default=500, show_default=True, type=click.IntRange(1), help='Recorded requests per route')
+@click.option('--warmup', default=5, show_default=True, type=click.IntRange(0), help='Unrecorded requests per thread and route')
+@click.option('--route', 'routes', multiple=True, type=click.Choice(list(ROUTES)), help='Only these routes (repeatable)')
+@click.option('--timeout', default=30.0, show_default=True, help='Seconds before a request counts as failed')
+@click.option('--seed', default=4111, show_default=True)
+@click.option('--output', '-o', type=click.Path(dir_okay=False, writable=True), help='Save the results as JSON')
+def run(url, database_uri, concurrency, requests, warmup, routes, timeout, seed, output):
+	"""
+	Load-test the running app route by route and report latency and throughput
+	"""
+	ids = sample_ids(database_uri)
+	results = {
+		'started_at': datetime.now().isoformat(timespec='seconds'),
+		'revision': git_revision(),
+		'host': socket.gethostname(),
+		'url': url,
+		'concurrency': concurrency,
+		'requests_per_route': requests,
+		'dataset': dataset_sizes(database_uri),
+		'routes': {},
+	}
+	click.echo(f"{'route':<20} {'requests':>8} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+	for name in routes or ROUTES:
+		result = run_route(url, ROUTES[name], ids, concurrency, requests, warmup, timeout, seed)
+		results['routes'][name] = result
+		click.echo(format_row(name, result))
+
+	if output:
+		with open(output, 'w') as f:
+			json.dump(results, f, indent=2)
+			f.write('\n')
+		click.echo(f"Saved {output}")
+
+
+@cli.command()
+@click.argument('BASELINE', type=click.File())
+@click.argument('CANDIDATE', type=click.File())
+def compare(baseline, candidate):
+	"""
+	Compare two saved runs route by route (changes are CANDIDATE relative to BASELINE)
+	"""
+	before, after = json.load(baseline), json.load(candidate)
+	click.echo(f"{before.get('revision')} ({before['started_at']}) -> {after.get('revision')} ({after['started_at']})")
+	if before.get('dataset') != after.get('dataset') or before['concurrency'] != after['concurrency']:
+		click.echo("Warning: the runs used different datasets or concurrency")
+
+	def change(old, new):
+		if not old or new is None:
+			return '       -'
+		return f"{(new - old) / old:>+8.1%}"
+
+	click.echo(f"{'route':<20} {'req/s':>9} {'':>8} {'p50 ms':>9} {'':>8} {'p95 ms':>9} {'':>8} {'p99 ms':>9}")
+	for name, new in after['routes'].items():
+		old = before['routes'].get(name)
+		if old is None:
+			continue
+		columns = [f"{new[key]:>9,.1f} {change(old[key], new[key])}" for key in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms')]
+		errors = f"  errors {old['errors']} -> {new['errors']}" if old['errors'] or new['errors'] else ''
+		click.echo(f"{name:<20} {' '.join(columns)}{errors}")
+
+
+@cli.command()
+@click.option('--database-uri', envvar='ESGTRADER_DATABASE_URI', help='Seeded benchmark database (a throwaway investor is added)')
+@click.option('--threads', '-c', default=32, show_default=True, type=click.IntRange(1), help='Concurrent connections')
+@click.option('--orders', '-n', default=200, show_default=True, type=click.IntRange(1), help='Orders per thread')
+@click.option('--stock-id', help='Stock to trade (default: the first stock with a price)')
+@click.option('--seed', default=4111, show_default=True)
+@click.option('--keep', is_flag=True, help='Keep the stress investor and its transactions afterwards')
+def stress(database_uri, threads, orders, stock_id, seed, keep):
+	"""
+	Hammer one position from many threads and check holdings against the transaction log
+	"""
+	engine = create_engine(bench_engine(database_uri).url, pool_size=threads, max_overflow=0)
+	with engine.connect() as conn:
+		if stock_id is None:
+			stock_id = conn.execute(text("SELECT stock_id FROM latest_stock_price ORDER BY stock_id LIMIT 1")).scalar()
+		if stock_id is None:
+			raise click.ClickException("No stock has a price; run `bench.py seed` first")
+		price = conn.execute(text("SELECT daily_price FROM latest_stock_price WHERE stock_id = :stock_id"), {"stock_id": stock_id}).scalar()
+		remove_stress_investor(conn)
+		conn.execute(text("INSERT INTO investor (investor_id, company_name) VALUES (:investor_id, 'Stress Test')"), {"investor_id": STRESS_INVESTOR})
+		conn.execute(text("""
+			INSERT INTO portfolio (portfolio_id, investor_id, total_value, creation_date)
+			VALUES (:portfolio_id, :investor_id, 0, CURRENT_DATE)
+		"""), {"portfolio_id": STRESS_PORTFOLIO, "investor_id": STRESS_INVESTOR})
+		conn.commit()
+
+	click.echo(f"{threads} threads x {orders} orders on {STRESS_INVESTOR}/{stock_id} around {price}")
+	# Unique transaction times across all threads (CPython's next() on a count is atomic)
+	start = datetime.now()
+	clock = (start + timedelta(microseconds=tick) for tick in itertools.count())
+	sequence = itertools.count()
+	applied = {}
+	outcomes = collections.Counter()
+	outcomes_lock = threading.Lock()
+	workers = [threading.Thread(target=stress_worker, args=(engine, stock_id, price, orders, random.Random(f"{seed}:{number}"),
+		clock, sequence, applied, outcomes, outcomes_lock)) for number in range(threads)]
+	started = time.perf_counter()
+	for worker in workers:
+		worker.start()
+	for worker in workers:
+		worker.join()
+	elapsed = time.perf_counter() - started
+	total = sum(outcomes.values())
+	click.echo(f"{total:,} orders in {elapsed:.2f}s ({total / elapsed:,.0f} orders/s): "
+		+ ', '.join(f"{name} {count:,}" for name, count in outcomes.most_common()))
+
+	params = {"investor_id": STRESS_INVESTOR, "portfolio_id": STRESS_PORTFOLIO, "stock_id": stock_id}
+	with engine.connect() as conn:
+		holding_count, average_price, total_value, logged_value = conn.execute(text(STRESS_CHECK_QUERY), params).one()
+		log = conn.execute(text(STRESS_LOG_QUERY), params).fetchall()
+		if not keep:
+			remove_stress_investor(conn)
+			conn.commit()
+	engine.dispose()
+
+	# In the order the orders were applied; a batch's trades in time order
+	logged_times = {row.transaction_time for row in log}
+	log.sort(key=lambda row: (applied.get(row.transaction_time, -1), row.transaction_time))
+	replayed_count, replayed_average, oversold = replay_position(
+		(row.transaction_type, row.unit_price, row.unit_number) for row in log)
+	average_price = average_price if holding_count else None
+	replayed_average = replayed_average if replayed_count else None
+
+	checks = [
+		(f"holding {holding_count} @ {average_price} = transaction log replayed in commit order {replayed_count} @ {replayed_average}",
+			(holding_count, average_price) == (replayed_count, replayed_average)),
+		(f"portfolio total_value {total_value} = value in the transaction log {logged_value}", total_value == logged_value),
+		("holding_count is not negative", holding_count >= 0),
+		("no sell in the replayed log exceeded the holding", not oversold),
+		(f"{len(log):,} transactions logged, {len(applied):,} recorded", logged_times == set(applied)),
+		("no orders failed other than rejected sells", set(outcomes) <= {'ok', 'rejected', 'no_price', 'not_owned', 'insufficient_shares'}),
+	]
+	for label, passed in checks:
+		click.echo(f"{'PASS' if passed else 'FAIL'}  {label}")
+	if not all(passed for label, passed in checks):
+		raise click.ClickException("holdings are inconsistent with the transaction log")
+
+
+if __name__ == "__main__":
+	cli()
@@ -0,0 +1,80 @@
+-- Benchmark Schema
+-- The base tables server.py and the scripts in sql/ expect, for seeding a local
+-- benchmark database with `python bench/bench.py seed`. The triggers, helper
+-- tables and views are installed afterwards by `python server.py migrate`.
+--
+-- Drops and recreates everything in the current schema's tables of these names,
+-- and forgets the applied migrations so migrate re-applies them to the new tables.
+
+DROP TABLE IF EXISTS
+    esg_score, stock_price, daily_macro_data, risk_metrics,
+    transaction, holdings, portfolio, investor, stock
+CASCADE;
+
+DROP TABLE IF EXISTS schema_migrations;
+
+CREATE TABLE stock (
+    stock_id VARCHAR(10) PRIMARY KEY,
+    ticker VARCHAR(10) NOT NULL,
+    sector VARCHAR(50)
+);
+
+CREATE TABLE investor (
+    investor_id VARCHAR(10) PRIMARY KEY,
+    company_name VARCHAR(100) NOT NULL
+);
+
+CREATE TABLE portfolio (
+    portfolio_id VARCHAR(10) PRIMARY KEY,
+    investor_id VARCHAR(10) NOT NULL REFERENCES investor,
+    total_value NUMERIC(15,2),
+    creation_date DATE
+);
+
+CREATE TABLE holdings (
+    stock_id VARCHAR(10) REFERENCES stock,
+    portfolio_id VARCHAR(10) REFERENCES portfolio,
+    average_price NUMERIC(10,2),
+    holding_count INTEGER,
+    PRIMARY KEY (stock_id, portfolio_id)
+);
+
+CREATE TABLE transaction (
+    investor_id VARCHAR(10) REFERENCES investor,
+    stock_id VARCHAR(10) REFERENCES stock,
+    transaction_time TIMESTAMP,
+    transaction_type VARCHAR(4) CHECK (transaction_type IN ('buy', 'sell')),
+    unit_price NUMERIC(10,2),
+    unit_number INTEGER,
+    PRIMARY KEY (investor_id, stock_id, transaction_time)
+);
+
+CREATE TABLE risk_metrics (
+    portfolio_id VARCHAR(10) REFERENCES portfolio,
+    metric_date DATE,
+    sharpe_ratio NUMERIC(10,4),
+    beta NUMERIC(10,4),
+    volatility NUMERIC(10,4),
+    var NUMERIC(10,4),
+    PRIMARY KEY (portfolio_id, metric_date)
+);
+
+CREATE TABLE daily_macro_data (
+    macro_date DATE PRIMARY KEY,
+    risk_free_rate NUMERIC(6,4),
+    interest_rate NUMERIC(6,4)
+);
+
+CREATE TABLE stock_price (
+    stock_id VARCHAR(10) REFERENCES stock,
+    price_date DATE,
+    daily_price NUMERIC(10,2),
+    PRIMARY KEY (stock_id, price_date)
+);
+
+CREATE TABLE esg_score (
+    stock_id VARCHAR(10) REFERENCES stock,
+    score_date DATE,
+    esg_score NUMERIC(5,2),
+    PRIMARY KEY (stock_id, score_date)
+);
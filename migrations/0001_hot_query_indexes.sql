@@ -0,0 +1,32 @@
+-- migrate: no-transaction
+--
+-- Indexes for the lookups the routes and triggers run on every request or trade.
+-- Built with CREATE INDEX CONCURRENTLY so writes to these tables are not blocked
+-- while they build, which is why this migration runs outside a transaction.
+--
+-- Where a table's primary key already leads with the same columns, the matching
+-- index here is redundant but harmless; IF NOT EXISTS keeps re-runs cheap.
+
+-- Latest price per stock (latest_stock_price triggers, price history pages)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS stock_price_stock_id_price_date_idx
+ON stock_price (stock_id, price_date DESC);
+
+-- An investor's portfolio, newest first (/add, /add_holdings, the transaction trigger)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS portfolio_investor_id_creation_date_idx
+ON portfolio (investor_id, creation_date DESC);
+
+-- A portfolio's holdings (/check_holdings, P&L and ESG ranking, deletes)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS holdings_portfolio_id_idx
+ON holdings (portfolio_id);
+
+-- An investor's transactions (deleting investors)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transaction_investor_id_idx
+ON transaction (investor_id);
+
+-- Buys versus sells (rebuild_pnl)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transaction_transaction_type_idx
+ON transaction (transaction_type);
+
+-- Latest ESG score per stock (esg_portfolio_ranking)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS esg_score_stock_id_score_date_idx
+ON esg_score (stock_id, score_date DESC);
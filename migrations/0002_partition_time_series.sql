@@ -0,0 +1,80 @@
+-- Range-partitions the time series tables on their date column: stock_price by
+-- month on price_date, daily_macro_data by year on macro_date. Queries bounded
+-- by date (compute-risk's lookback window, the latest price of a stock, the
+-- macro data up to a date) then only read the partitions in range, and old data
+-- is removed by detaching or dropping whole partitions (`python server.py
+-- partitions`) instead of a DELETE that leaves the table to vacuum.
+--
+-- Each table is renamed, re-created as a partitioned table with the same
+-- columns, filled from the original and the original dropped, all in this
+-- migration's transaction, so writes to the two tables wait until it commits.
+-- The primary keys already include the date column, as partitioned tables
+-- require; stock_price's primary key also serves latest-price lookups, so the
+-- (stock_id, price_date DESC) index from 0001 is not re-created. The triggers
+-- on stock_price are re-installed by the sql/ step of migrate.
+--
+-- There is no default partition: a row dated past the last partition is
+-- rejected instead of landing in a catch-all that later partitions would have
+-- to be carved out of, so `partitions` should run daily to stay ahead.
+
+-- Create the missing partitions of p_table covering p_from to p_until, one per
+-- p_period ('month' or 'year'), named <table>_pYYYY_MM or <table>_pYYYY
+CREATE OR REPLACE FUNCTION create_time_partitions(p_table TEXT, p_period TEXT, p_from DATE, p_until DATE)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    v_start DATE := date_trunc(p_period, p_from)::DATE;
+    v_end DATE;
+    v_name TEXT;
+BEGIN
+    IF p_period NOT IN ('month', 'year') THEN
+        RAISE EXCEPTION 'Unsupported partition period %', p_period;
+    END IF;
+
+    WHILE v_start <= p_until LOOP
+        v_end := (v_start + ('1 ' || p_period)::INTERVAL)::DATE;
+        v_name := p_table || '_p' || to_char(v_start, CASE p_period WHEN 'month' THEN 'YYYY_MM' ELSE 'YYYY' END);
+        IF to_regclass(quote_ident(v_name)) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)', v_name, p_table, v_start, v_end);
+            RETURN NEXT v_name;
+        END IF;
+        v_start := v_end;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    v_table RECORD;
+    v_original TEXT;
+    v_first DATE;
+    v_last DATE;
+BEGIN
+    FOR v_table IN
+        SELECT *
+        FROM (VALUES ('stock_price', 'price_date', 'month', 'stock_id, price_date'),
+                     ('daily_macro_data', 'macro_date', 'year', 'macro_date'))
+             AS t(name, date_column, period, primary_key)
+    LOOP
+        CONTINUE WHEN (SELECT relkind FROM pg_class WHERE oid = v_table.name::REGCLASS) = 'p';
+
+        v_original := v_table.name || '_unpartitioned';
+        EXECUTE format('ALTER TABLE %I RENAME TO %I', v_table.name, v_original);
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE (%I)',
+                       v_table.name, v_original, v_table.date_column);
+
+        -- Partitions for the existing rows through the current period
+        EXECUTE format('SELECT MIN(%I), MAX(%I) FROM %I', v_table.date_column, v_table.date_column, v_original)
+        INTO v_first, v_last;
+        PERFORM create_time_partitions(v_table.name, v_table.period,
+                                       LEAST(v_first, current_date), GREATEST(v_last, current_date));
+
+        EXECUTE format('INSERT INTO %I SELECT * FROM %I', v_table.name, v_original);
+        EXECUTE format('DROP TABLE %I', v_original);
+        -- Built after the copy, and named as the original was
+        EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (%s)', v_table.name, v_table.primary_key);
+        IF v_table.name = 'stock_price' THEN
+            ALTER TABLE stock_price ADD FOREIGN KEY (stock_id) REFERENCES stock;
+        END IF;
+    END LOOP;
+END;
+$$;
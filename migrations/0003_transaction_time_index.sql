@@ -0,0 +1,9 @@
+-- migrate: no-transaction
+--
+-- /transactions pages through the table in (transaction_time, investor_id,
+-- stock_id) order (TABLE_KEYS in server.py). The primary key leads with
+-- investor_id, so without this index every page is a full scan and sort; with
+-- it, each page is a range scan starting after the previous page's last key.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS transaction_time_investor_id_stock_id_idx
+ON transaction (transaction_time, investor_id, stock_id);
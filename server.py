@@ -9,11 +9,29 @@ A debugger such as "pdb" may be helpful for debugging.
 Read about it online.
 """
 import os
-from datetime import datetime, date
+import io
+import re
+import csv
+import codecs
+import json
+import base64
+import bisect
+import hashlib
+import heapq
+import itertools
+import queue
+import threading
+import time
+import functools
+from collections import OrderedDict, defaultdict
+from datetime import datetime, date, timedelta
 # accessible as a variable in index.html:
 from sqlalchemy import *
+from sqlalchemy import event, exc
 from sqlalchemy.pool import NullPool
-from flask import Flask, request, render_template, g, redirect, Response, abort
+import click
+from flask import Flask, request, render_template, stream_template, g, redirect, Response, abort, url_for, make_response
+from flask import has_request_context, before_render_template, template_rendered
 
 tmpl_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
 app = Flask(__name__, template_folder=tmpl_dir)
@@ -36,28 +54,151 @@ DATABASE_PASSWRD = "021024"
 DATABASE_HOST = "34.139.8.30"
 DATABASEURI = f"postgresql://{DATABASE_USERNAME}:{DATABASE_PASSWRD}@{DATABASE_HOST}/proj1part2"
 
+# ESGTRADER_DATABASE_URI points the app at another database, e.g. the local one
+# seeded by bench/bench.py
+DATABASEURI = os.environ.get('ESGTRADER_DATABASE_URI', DATABASEURI)
+
+
+#
+# Connection pool settings. Each can be overridden with an environment variable.
+#
+#   POOL_SIZE         connections kept open in the pool
+#   POOL_MAX_OVERFLOW extra connections opened when all pooled ones are checked out
+#   POOL_PRE_PING     test each connection with a lightweight ping on checkout
+#   POOL_RECYCLE      seconds after which a connection is replaced (-1 disables)
+#   POOL_TIMEOUT      seconds to wait for a free connection before giving up
+#
+POOL_SIZE = int(os.environ.get('ESGTRADER_POOL_SIZE', 5))
+POOL_MAX_OVERFLOW = int(os.environ.get('ESGTRADER_POOL_MAX_OVERFLOW', 10))
+POOL_PRE_PING = os.environ.get('ESGTRADER_POOL_PRE_PING', '1') == '1'
+POOL_RECYCLE = int(os.environ.get('ESGTRADER_POOL_RECYCLE', 1800))
+POOL_TIMEOUT = float(os.environ.get('ESGTRADER_POOL_TIMEOUT', 30))
+
 
 #
-# This line creates a database engine that knows how to connect to the URI above.
+# The database engine that knows how to connect to the URI above. It is created
+# the first time something needs the database rather than at import, so importing
+# (or forking) the app never opens a connection. Connections are kept in a
+# QueuePool and reused across requests.
 #
-engine = create_engine(DATABASEURI)
+engine = None
+engine_lock = threading.Lock()
+
+
+def get_engine():
+	"""
+	Return the process's engine, creating it on first use
+	"""
+	global engine
+	if engine is None:
+		with engine_lock:
+			if engine is None:
+				new_engine = create_engine(
+					DATABASEURI,
+					pool_size=POOL_SIZE,
+					max_overflow=POOL_MAX_OVERFLOW,
+					pool_pre_ping=POOL_PRE_PING,
+					pool_recycle=POOL_RECYCLE,
+					pool_timeout=POOL_TIMEOUT
+				)
+				event.listen(new_engine, 'checkout', count_checkout)
+				event.listen(new_engine, 'connect', count_connect)
+				event.listen(new_engine, 'before_cursor_execute', start_query_timer)
+				event.listen(new_engine, 'after_cursor_execute', record_query)
+				engine = new_engine
+	return engine
 
+
+#
+# Pool-level metrics, served by /pool_stats
 #
-# Example of running queries in your database
-# Note that this will probably not work if you already have a table named 'test' in your database, containing meaningful data. This is only an example showing you how to run queries in your database using SQLAlchemy.
+#   checkouts             connections handed out by the pool
+#   connects              new DBAPI connections opened
+#   overflow_connections  connections opened beyond POOL_SIZE
+#   waits                 checkouts that found every pooled and overflow connection busy
+#   wait_seconds          total time spent in those waits
+#   timeouts              checkouts that gave up after POOL_TIMEOUT
 #
-with engine.connect() as conn:
-	create_table_command = """
-	CREATE TABLE IF NOT EXISTS test (
-		id serial,
-		name text
+pool_stats = dict(checkouts=0, connects=0, overflow_connections=0, waits=0, wait_seconds=0.0, timeouts=0)
+pool_stats_lock = threading.Lock()
+
+
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+	with pool_stats_lock:
+		pool_stats['checkouts'] += 1
+
+
+def count_connect(dbapi_connection, connection_record):
+	with pool_stats_lock:
+		pool_stats['connects'] += 1
+		# overflow() is negative while the pool is still filling up to POOL_SIZE
+		if get_engine().pool.overflow() > 0:
+			pool_stats['overflow_connections'] += 1
+
+
+def checkout_connection():
+	"""
+	Check a connection out of the pool, recording waits and timeouts in pool_stats
+	"""
+	pool = get_engine().pool
+	saturated = pool.checkedout() >= pool.size() + POOL_MAX_OVERFLOW
+	start = time.perf_counter()
+	try:
+		conn = get_engine().connect()
+	except exc.TimeoutError:
+		with pool_stats_lock:
+			pool_stats['timeouts'] += 1
+		raise
+	if saturated:
+		with pool_stats_lock:
+			pool_stats['waits'] += 1
+			pool_stats['wait_seconds'] += time.perf_counter() - start
+	return conn
+
+
+def pool_snapshot():
+	"""
+	Pool settings, current usage and the pool_stats counters
+	"""
+	pool = get_engine().pool
+	with pool_stats_lock:
+		counters = dict(pool_stats)
+	return dict(
+		pool_size=pool.size(),
+		max_overflow=POOL_MAX_OVERFLOW,
+		checked_out=pool.checkedout(),
+		checked_in=pool.checkedin(),
+		overflow=max(pool.overflow(), 0),
+		**counters
 	)
+
+
+class LazyConnection(object):
 	"""
-	res = conn.execute(text(create_table_command))
-	insert_table_command = """INSERT INTO test(name) VALUES ('grace hopper'), ('alan turing'), ('ada lovelace')"""
-	res = conn.execute(text(insert_table_command))
-	# you need to commit for create, insert, update queries to reflect
-	conn.commit()
+	Stand-in for g.conn that checks a connection out of the pool the first time
+	a route uses it. Routes that never touch the database never wait on the pool.
+	"""
+
+	def __init__(self):
+		self._conn = None
+
+	@property
+	def checked_out(self):
+		return self._conn is not None
+
+	def __getattr__(self, name):
+		if self._conn is None:
+			try:
+				self._conn = checkout_connection()
+			except:
+				app.logger.exception("uh oh, problem connecting to database")
+				raise
+		return getattr(self._conn, name)
+
+	def close(self):
+		if self._conn is not None:
+			self._conn.close()
+			self._conn = None
 
 
 @app.before_request
@@ -66,807 +207,1177 @@ def before_request():
 	This function is run at the beginning of every web request 
 	(every time you enter an address in the web browser).
 	We use it to setup a database connection that can be used throughout the request.
+	The connection is only checked out of the pool when the route first uses g.conn.
 
 	The variable g is globally accessible.
 	"""
-	try:
-		g.conn = engine.connect()
-	except:
-		print("uh oh, problem connecting to database")
-		import traceback; traceback.print_exc()
-		g.conn = None
+	g.request_started = time.perf_counter()
+	g.query_count = 0
+	g.db_seconds = 0.0
+	g.template_seconds = 0.0
+	g.conn = LazyConnection()
+
+@app.after_request
+def after_request(response):
+	g.response_status = response.status_code
+	return response
 
 @app.teardown_request
 def teardown_request(exception):
 	"""
-	At the end of the web request, this makes sure to close the database connection.
-	If you don't, the database could run out of memory!
+	At the end of the web request, this makes sure to return the database connection
+	to the pool. If you don't, the pool will run out of connections!
 	"""
 	try:
 		g.conn.close()
 	except Exception as e:
 		pass
+	if 'request_started' in g:
+		record_request(exception)
 
 
 #
-# @app.route is a decorator around index() that means:
-#   run index() whenever the user tries to access the "/" path using a GET request
-#
-# If you wanted the user to go to, for example, localhost:8111/foobar/ with POST or GET then you could use:
+# Instrumentation.
 #
-#       @app.route("/foobar/", methods=["POST", "GET"])
+# Each request counts the queries it ran and times the database, template
+# rendering and the request as a whole. Totals per endpoint, method and status
+# are served in Prometheus text format at /metrics, together with the pool
+# counters. The numbers are per process: under `serve` each worker reports its own.
 #
-# PROTIP: (the trailing / in the path is important)
-# 
-# see for routing: https://flask.palletsprojects.com/en/1.1.x/quickstart/#routing
-# see for decorators: http://simeonfranklin.com/blog/2012/jul/1/python-decorators-in-12-steps/
+# Statements slower than SLOW_QUERY_MS are logged as warnings, and so are
+# requests that run more than MAX_QUERIES_PER_REQUEST queries, which usually
+# means a query inside a loop. Streamed pages (?stream=1) fetch rows and render
+# while the response is being sent, which counts toward the total time only.
 #
-@app.route('/')
-def index():
-	"""
-	request is a special object that Flask provides to access web request information:
+SLOW_QUERY_MS = float(os.environ.get('ESGTRADER_SLOW_QUERY_MS', 500))
+MAX_QUERIES_PER_REQUEST = int(os.environ.get('ESGTRADER_MAX_QUERIES_PER_REQUEST', 50))
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
 
-	request.method:   "GET" or "POST"
-	request.form:     if the browser submitted a form, this contains the data in the form
-	request.args:     dictionary of URL arguments, e.g., {a:1, b:2} for http://localhost?a=1&b=2
+# (endpoint, method, status) -> totals and request duration histogram
+request_metrics = {}
+request_metrics_lock = threading.Lock()
 
-	See its API: https://flask.palletsprojects.com/en/1.1.x/api/#incoming-request-data
+
+# The start time lives on the statement's execution context, which is discarded
+# with it, so a statement that raises (and never reaches record_query) leaves
+# nothing behind on the pooled connection
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+	context._query_started = time.perf_counter()
+
+
+def record_query(conn, cursor, statement, parameters, context, executemany):
+	elapsed = time.perf_counter() - context._query_started
+	in_request = has_request_context() and 'query_count' in g
+	if in_request:
+		g.query_count += 1
+		g.db_seconds += elapsed
+	if elapsed * 1000 >= SLOW_QUERY_MS:
+		where = f"{request.method} {request.path}" if in_request else "outside a request"
+		app.logger.warning("slow query (%.0f ms, %s): %s", elapsed * 1000, where, ' '.join(statement.split())[:500])
+
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+	if 'template_seconds' in g:
+		g.template_started = time.perf_counter()
+
+
+@template_rendered.connect_via(app)
+def record_template(sender, template, context, **extra):
+	if 'template_started' in g:
+		g.template_seconds += time.perf_counter() - g.pop('template_started')
+
+
+def record_request(exception):
 	"""
+	Add the finished request's counters to request_metrics
+	"""
+	elapsed = time.perf_counter() - g.request_started
+	# A streamed response that failed part way was still sent with its original status
+	status = g.get('response_status', 500)
+	key = (request.endpoint or 'unmatched', request.method, status)
+	with request_metrics_lock:
+		metrics = request_metrics.get(key)
+		if metrics is None:
+			metrics = request_metrics[key] = dict(
+				requests=0, seconds=0.0, db_queries=0, db_seconds=0.0, template_seconds=0.0,
+				buckets=[0] * len(REQUEST_BUCKETS)
+			)
+		metrics['requests'] += 1
+		metrics['seconds'] += elapsed
+		metrics['db_queries'] += g.query_count
+		metrics['db_seconds'] += g.db_seconds
+		metrics['template_seconds'] += g.template_seconds
+		# Counted in the smallest bucket that fits; prometheus_metrics makes them cumulative
+		bucket = bisect.bisect_left(REQUEST_BUCKETS, elapsed)
+		if bucket < len(REQUEST_BUCKETS):
+			metrics['buckets'][bucket] += 1
+	if g.query_count > MAX_QUERIES_PER_REQUEST:
+		app.logger.warning("%s %s ran %d queries (%.0f ms in the database)", request.method, request.path, g.query_count, g.db_seconds * 1000)
 
-	# DEBUG: this is debugging code to see what request looks like
-	print(request.args)
 
+def prometheus_labels(labels):
+	return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}' if labels else ''
 
-	#
-	# example of a database query
-	#
-	select_query = "SELECT name from test"
-	cursor = g.conn.execute(text(select_query))
-	names = []
-	for result in cursor:
-		names.append(result[0])
-	cursor.close()
 
-	#
-	# Flask uses Jinja templates, which is an extension to HTML where you can
-	# pass data to a template and dynamically generate HTML based on the data
-	# (you can think of it as simple PHP)
-	# documentation: https://realpython.com/primer-on-jinja-templating/
-	#
-	# You can see an example template in templates/index.html
-	#
-	# context are the variables that are passed to the template.
-	# for example, "data" key in the context variable defined below will be 
-	# accessible as a variable in index.html:
-	#
-	#     # will print: [u'grace hopper', u'alan turing', u'ada lovelace']
-	#     <div>{{data}}</div>
-	#     
-	#     # creates a <div> tag for each element in data
-	#     # will print: 
-	#     #
-	#     #   <div>grace hopper</div>
-	#     #   <div>alan turing</div>
-	#     #   <div>ada lovelace</div>
-	#     #
-	#     {% for n in data %}
-	#     <div>{{n}}</div>
-	#     {% endfor %}
-	#
-	context = dict(data = names)
+def prometheus_metrics():
+	"""
+	request_metrics and pool counters in the Prometheus text exposition format
+	"""
+	with request_metrics_lock:
+		snapshot = sorted((key, dict(value, buckets=list(value['buckets']))) for key, value in request_metrics.items())
+	labelled = [(dict(endpoint=endpoint, method=method, status=status), value) for (endpoint, method, status), value in snapshot]
+
+	# name -> (type, help, [(sample suffix, labels, value)])
+	families = {
+		'requests_total': ('counter', 'Requests handled', [('', labels, m['requests']) for labels, m in labelled]),
+		'request_duration_seconds': ('histogram', 'Time from request start to teardown', []),
+		'db_queries_total': ('counter', 'Queries executed by requests', [('', labels, m['db_queries']) for labels, m in labelled]),
+		'db_seconds_total': ('counter', 'Time requests spent executing queries', [('', labels, f"{m['db_seconds']:.6f}") for labels, m in labelled]),
+		'template_seconds_total': ('counter', 'Time requests spent rendering templates', [('', labels, f"{m['template_seconds']:.6f}") for labels, m in labelled]),
+	}
+	histogram = families['request_duration_seconds'][2]
+	for labels, m in labelled:
+		# Prometheus buckets are cumulative
+		for bound, count in zip(REQUEST_BUCKETS, itertools.accumulate(m['buckets'])):
+			histogram.append(('_bucket', dict(labels, le=bound), count))
+		histogram.append(('_bucket', dict(labels, le='+Inf'), m['requests']))
+		histogram.append(('_sum', labels, f"{m['seconds']:.6f}"))
+		histogram.append(('_count', labels, m['requests']))
+	for name, value in pool_snapshot().items():
+		help_text = f"Connection pool {name.replace('pool_', '').replace('_', ' ')}"
+		name = name if name.startswith('pool_') else f"pool_{name}"
+		if name[len('pool_'):] in pool_stats:
+			families[name + ('' if name.endswith('seconds') else '_total')] = ('counter', help_text, [('', {}, value)])
+		else:
+			families[name] = ('gauge', help_text, [('', {}, value)])
 
+	families.update({
+		'response_cache_hits_total': ('counter', 'Responses served from the response cache', [('', {}, response_cache.hits)]),
+		'response_cache_misses_total': ('counter', 'Cacheable responses that had to be rendered', [('', {}, response_cache.misses)]),
+		'response_cache_evictions_total': ('counter', 'Responses evicted to stay within the memory budget', [('', {}, response_cache.evictions)]),
+		'response_cache_bytes': ('gauge', 'Size of the cached response bodies', [('', {}, response_cache.size)]),
+	})
+	queries = query_snapshot()
+	families.update({
+		'query_executions_total': ('counter', 'Executions of each registered query', [('', {'query': name}, executions) for name, executions, _, _ in queries]),
+		'query_seconds_total': ('counter', 'Time spent executing each registered query', [('', {'query': name}, f"{seconds:.6f}") for name, _, seconds, _ in queries]),
+		'query_prepares_total': ('counter', 'Connections each registered query was prepared on', [('', {'query': name}, prepares) for name, _, _, prepares in queries]),
+	})
+
+	lines = []
+	for name, (kind, help_text, samples) in families.items():
+		lines.append(f"# HELP esgtrader_{name} {help_text}")
+		lines.append(f"# TYPE esgtrader_{name} {kind}")
+		for suffix, labels, value in samples:
+			lines.append(f"esgtrader_{name}{suffix}{prometheus_labels(labels)} {value}")
+	return '\n'.join(lines) + '\n'
 
-	#
-	# render_template looks in the templates/ folder for files.
-	# for example, the below file reads template/index.html
-	#
-	return render_template("index.html", **context)
 
 #
-# This is an example of a different path.  You can see it at:
-# 
-#     localhost:8111/another
+# Query registry.
 #
-# Notice that the function name is another() rather than index()
-# The functions for each app.route need to have different names
+# The fixed SQL the routes run is defined once, by name, in QUERIES and run with
+# run_query(conn, name, params). A pooled connection PREPAREs a query the first
+# time it runs it (as esgtrader_<name>, its :name parameters numbered $1, $2, ...
+# and their types inferred by Postgres) and afterwards only sends EXECUTE, so
+# Postgres skips parsing and analysis and, once it settles on a generic plan,
+# planning. Which queries a connection has prepared is kept in its info dict,
+# which lives and dies with the DBAPI connection, so a reconnect prepares again.
+# ESGTRADER_PREPARE_QUERIES=0 runs the plain SQL instead, e.g. behind PgBouncer
+# in transaction pooling mode, where server sessions are shared.
 #
-@app.route('/another')
-def another():
-	return render_template("another.html")
-
-
-@app.route('/new_investor')
-def new_investor():
+# Executions, time spent executing and prepares are counted per query and
+# served at /metrics. SQL assembled at run time (listing pages, exports, ID
+# allocation, the CLI commands) does not go through the registry.
+#
+PREPARE_QUERIES = os.environ.get('ESGTRADER_PREPARE_QUERIES', '1') == '1'
+
+QUERIES = {
+	# Prices
+	'latest_price': "SELECT daily_price FROM latest_stock_price WHERE stock_id = :stock_id",
+	'latest_prices_of': "SELECT stock_id, daily_price FROM latest_stock_price WHERE stock_id = ANY(:stock_ids)",
+	'price_series': """
+		SELECT price_date, daily_price
+		FROM stock_price
+		WHERE stock_id = :stock_id AND price_date BETWEEN :start AND :end
+		ORDER BY price_date
+	""",
+
+	# Reference data
+	# The whole lists, cached for the dropdowns and search indexes
+	'investor_options': "SELECT investor_id, company_name FROM investor ORDER BY investor_id -- check-queries: allow-seq-scan",
+	'stock_options': "SELECT stock_id, ticker, sector FROM stock ORDER BY ticker -- check-queries: allow-seq-scan",
+	'stock_exists': "SELECT 1 FROM stock WHERE stock_id = :stock_id",
+
+	# Investors and portfolios
+	'investor': "SELECT investor_id, company_name FROM investor WHERE investor_id = :investor_id",
+	'investor_portfolio_count': "SELECT COUNT(*) FROM portfolio WHERE investor_id = :investor_id",
+	'investor_portfolios': "SELECT portfolio_id, total_value, creation_date FROM portfolio WHERE investor_id = :investor_id ORDER BY portfolio_id",
+	# The portfolio orders and holdings are recorded against
+	'current_portfolio': """
+		SELECT portfolio_id
+		FROM portfolio
+		WHERE investor_id = :investor_id
+		ORDER BY creation_date DESC
+		LIMIT 1
+	""",
+	'insert_investor': "INSERT INTO investor(investor_id, company_name) VALUES (:investor_id, :company_name)",
+	'insert_portfolio': """
+		INSERT INTO portfolio(portfolio_id, investor_id, total_value, creation_date)
+		VALUES (:portfolio_id, :investor_id, :total_value, :creation_date)
+	""",
+	'rename_investor': "UPDATE investor SET company_name = :company_name WHERE investor_id = :investor_id",
+	'delete_investor_holdings': "DELETE FROM holdings WHERE portfolio_id IN (SELECT portfolio_id FROM portfolio WHERE investor_id = ANY(:investor_ids))",
+	'delete_investor_risk_metrics': "DELETE FROM risk_metrics WHERE portfolio_id IN (SELECT portfolio_id FROM portfolio WHERE investor_id = ANY(:investor_ids))",
+	'delete_investor_portfolios': "DELETE FROM portfolio WHERE investor_id = ANY(:investor_ids)",
+	'delete_investor_transactions': "DELETE FROM transaction WHERE investor_id = ANY(:investor_ids)",
+	'delete_investors': "DELETE FROM investor WHERE investor_id = ANY(:investor_ids)",
+
+	# Holdings and transactions
+	'holding': """
+		SELECT holding_count, average_price
+		FROM holdings
+		WHERE stock_id = :stock_id AND portfolio_id = :portfolio_id
+	""",
+	'insert_holding': """
+		INSERT INTO holdings(stock_id, portfolio_id, average_price, holding_count)
+		VALUES (:stock_id, :portfolio_id, :average_price, :holding_count)
+	""",
+	'add_portfolio_value': """
+		UPDATE portfolio
+		SET total_value = total_value + :value_to_add
+		WHERE portfolio_id = :portfolio_id
+	""",
+	# Price lookup, ownership check and insert in one round trip (sql/execute_transaction.sql)
+	'execute_transaction': """
+		SELECT status, unit_price, available
+		FROM execute_transaction(:investor_id, :stock_id, :transaction_type, :unit_number, :transaction_time)
+	""",
+	# Most recent portfolio and its holding count (None if not held) per (investor, stock) pair
+	'batch_positions': """
+		SELECT d.investor_id, d.stock_id, p.portfolio_id, h.holding_count
+		FROM unnest(CAST(:investor_ids AS TEXT[]), CAST(:stock_ids AS TEXT[])) AS d(investor_id, stock_id)
+		LEFT JOIN LATERAL (
+			SELECT portfolio_id FROM portfolio
+			WHERE investor_id = d.investor_id
+			ORDER BY creation_date DESC
+			LIMIT 1
+		) p ON true
+		LEFT JOIN holdings h ON h.portfolio_id = p.portfolio_id AND h.stock_id = d.stock_id
+	""",
+	'insert_transactions': """
+		INSERT INTO transaction(investor_id, stock_id, transaction_time, transaction_type, unit_price, unit_number)
+		SELECT * FROM unnest(
+			CAST(:investor_ids AS TEXT[]),
+			CAST(:stock_ids AS TEXT[]),
+			CAST(:transaction_times AS TIMESTAMP[]),
+			CAST(:transaction_types AS TEXT[]),
+			CAST(:unit_prices AS NUMERIC[]),
+			CAST(:unit_numbers AS INTEGER[])
+		)
+	""",
+
+	# Table pages, listing the whole table
+	'all_stocks': "SELECT * FROM stock -- check-queries: allow-seq-scan",
+	'all_investors': "SELECT * FROM investor -- check-queries: allow-seq-scan",
+	'all_portfolios': "SELECT * FROM portfolio -- check-queries: allow-seq-scan",
+	'all_risk_metrics': "SELECT * FROM risk_metrics -- check-queries: allow-seq-scan",
+
+	# Leaderboards
+	'top_investors': """
+		SELECT
+			i.investor_id,
+			i.company_name,
+			ip.total_pnl,
+			ip.num_holdings
+		FROM investor_pnl ip
+		JOIN investor i ON i.investor_id = ip.investor_id
+		ORDER BY ip.total_pnl DESC, ip.investor_id
+		LIMIT :limit
+	""",
+	'best_buys': """
+		SELECT
+			b.investor_id,
+			s.ticker,
+			b.unit_price AS purchase_price,
+			b.current_price,
+			b.unrealized_gain
+		FROM buy_pnl b
+		JOIN Stock s ON b.stock_id = s.stock_id
+		WHERE b.unrealized_gain IS NOT NULL
+		ORDER BY b.unrealized_gain DESC NULLS LAST
+		LIMIT :limit
+	""",
+	'esg_ranking': """
+		SELECT portfolio_id,
+			weighted_esg_score,
+			sharpe_ratio,
+			beta,
+			avg_esg_score,
+			metric_date
+		FROM esg_portfolio_ranking
+		WHERE weighted_esg_score IS NOT NULL
+		ORDER BY esg_rank
+		LIMIT :limit
+	""",
+	'esg_ranking_refreshed': "SELECT refreshed_at FROM materialized_view_refresh WHERE view_name = 'esg_portfolio_ranking'",
+}
+
+# The :name bind parameters of a text() statement, as SQLAlchemy finds them
+BIND_PARAMETER = re.compile(r'(?<![:\w\\]):(\w+)(?!:)')
+
+
+class RegisteredQuery:
 	"""
-	Page for creating new investor portfolios
+	A QUERIES entry compiled once: the plain statement, the PREPARE and EXECUTE
+	that stand in for it, and its counters
 	"""
-	# Get confirmation message if redirected from add
-	confirmation = request.args.get('confirmation', '')
-	investor_id = request.args.get('investor_id', '')
-	company_name = request.args.get('company_name', '')
-	portfolio_id = request.args.get('portfolio_id', '')
-	
-	context = dict(
-		confirmation=confirmation,
-		investor_id=investor_id,
-		company_name=company_name,
-		portfolio_id=portfolio_id
-	)
-	return render_template("new_investor.html", **context)
+	def __init__(self, name, sql):
+		self.name = name
+		self.statement = text(sql)
+		parameters = []
 
+		def number(match):
+			if match.group(1) not in parameters:
+				parameters.append(match.group(1))
+			return f"${parameters.index(match.group(1)) + 1}"
 
-@app.route('/manage_investor')
-def manage_investor():
+		# Run with exec_driver_sql, which hands psycopg2 parameters, so % is escaped
+		self.prepare = f"PREPARE esgtrader_{name} AS {BIND_PARAMETER.sub(number, sql)}".replace('%', '%%')
+		arguments = ', '.join(f':{parameter}' for parameter in parameters)
+		self.execute = text(f"EXECUTE esgtrader_{name}({arguments})" if parameters else f"EXECUTE esgtrader_{name}")
+		self.executions = 0
+		self.seconds = 0.0
+		self.prepares = 0
+
+
+registered_queries = {name: RegisteredQuery(name, sql) for name, sql in QUERIES.items()}
+registered_queries_lock = threading.Lock()
+
+
+def run_query(conn, name, params=None):
 	"""
-	Page for managing existing investor records - update or delete
+	Execute the registered query name on conn, as a prepared statement unless
+	PREPARE_QUERIES is off, and return its result
 	"""
-	# Get all investors for the dropdown
-	select_query = "SELECT investor_id, company_name FROM investor ORDER BY investor_id"
-	cursor = g.conn.execute(text(select_query))
-	investors_list = []
-	for result in cursor:
-		investors_list.append({'investor_id': result[0], 'company_name': result[1]})
-	cursor.close()
-	
-	# Get selected investor details if an investor_id is provided
-	selected_investor_id = request.args.get('investor_id', '')
-	selected_investor = None
-	portfolio_count = 0
-	
-	if selected_investor_id:
-		# Get investor details
-		investor_query = "SELECT investor_id, company_name FROM investor WHERE investor_id = :investor_id"
-		cursor = g.conn.execute(text(investor_query), {"investor_id": selected_investor_id})
-		result = cursor.fetchone()
-		if result:
-			selected_investor = {'investor_id': result[0], 'company_name': result[1]}
-		cursor.close()
-		
-		# Count portfolios for this investor
-		portfolio_query = "SELECT COUNT(*) FROM portfolio WHERE investor_id = :investor_id"
-		cursor = g.conn.execute(text(portfolio_query), {"investor_id": selected_investor_id})
-		portfolio_count = cursor.fetchone()[0]
-		cursor.close()
-	
-	# Get confirmation messages
-	confirmation = request.args.get('confirmation', '')
-	message = request.args.get('message', '')
-	
-	context = dict(
-		investors=investors_list,
-		selected_investor=selected_investor,
-		portfolio_count=portfolio_count,
-		confirmation=confirmation,
-		message=message
-	)
-	return render_template("manage_investor.html", **context)
+	query = registered_queries[name]
+	started = time.perf_counter()
+	prepared_now = False
+	if PREPARE_QUERIES:
+		prepared = conn.info.setdefault('prepared_queries', set())
+		if name not in prepared:
+			conn.exec_driver_sql(query.prepare)
+			prepared.add(name)
+			prepared_now = True
+		result = conn.execute(query.execute, params or {})
+	else:
+		result = conn.execute(query.statement, params or {})
+	elapsed = time.perf_counter() - started
+	with registered_queries_lock:
+		query.executions += 1
+		query.seconds += elapsed
+		query.prepares += prepared_now
+	return result
 
 
-@app.route('/add_holdings', methods=['GET'])
-def add_holdings():
+def query_snapshot():
 	"""
-	Page for adding new holdings to portfolios
+	[(name, executions, seconds, prepares)] for the registered queries
 	"""
-	# Get all investors for the first dropdown
-	investors_query = "SELECT investor_id, company_name FROM investor ORDER BY investor_id"
-	cursor = g.conn.execute(text(investors_query))
-	investors_list = []
-	for result in cursor:
-		investors_list.append({'investor_id': result[0], 'company_name': result[1]})
-	cursor.close()
-	
-	# Get selected investor if provided
-	selected_investor_id = request.args.get('investor_id', '')
-	
-	# Get portfolios for selected investor
-	portfolios_list = []
-	if selected_investor_id:
-		portfolios_query = "SELECT portfolio_id, total_value, creation_date FROM portfolio WHERE investor_id = :investor_id ORDER BY portfolio_id"
-		cursor = g.conn.execute(text(portfolios_query), {"investor_id": selected_investor_id})
-		for result in cursor:
-			portfolios_list.append({
-				'portfolio_id': result[0],
-				'total_value': result[1],
-				'creation_date': result[2]
-			})
-		cursor.close()
-	
-	# Get all stocks for the stock dropdown
-	stocks_query = "SELECT stock_id, ticker, sector FROM stock ORDER BY ticker"
-	cursor = g.conn.execute(text(stocks_query))
-	stocks_list = []
-	for result in cursor:
-		stocks_list.append({
-			'stock_id': result[0],
-			'ticker': result[1],
-			'sector': result[2]
-		})
-	cursor.close()
-	
-	# Get confirmation messages
-	confirmation = request.args.get('confirmation', '')
-	message = request.args.get('message', '')
-	
-	context = dict(
-		investors=investors_list,
-		portfolios=portfolios_list,
-		stocks=stocks_list,
-		selected_investor_id=selected_investor_id,
-		confirmation=confirmation,
-		message=message
-	)
-	return render_template("add_holdings.html", **context)
+	with registered_queries_lock:
+		return [(query.name, query.executions, query.seconds, query.prepares) for query in registered_queries.values()]
 
 
-# Route to display all stocks
-@app.route('/stocks')
-def stocks():
+#
+# Keyset pagination for the full-table listing routes.
+#
+# Instead of loading every row of a table into a list, the listing pages read one
+# page at a time, ordered by the table's natural key. The next page starts after
+# the last key of the current page (?after=<cursor>), so each page is an index
+# range scan no matter how deep into the table it is.
+#
+# ?page_size=N overrides PAGE_SIZE (capped at MAX_PAGE_SIZE).
+# ?stream=1 renders the remainder of the table in one response, streaming rows
+# from a server-side cursor STREAM_YIELD_PER at a time so memory stays flat.
+#
+PAGE_SIZE = int(os.environ.get('ESGTRADER_PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.environ.get('ESGTRADER_MAX_PAGE_SIZE', 1000))
+STREAM_YIELD_PER = int(os.environ.get('ESGTRADER_STREAM_YIELD_PER', 1000))
+
+# Natural (unique) key of each table, in sort order
+TABLE_KEYS = {
+	'stock_price': ('stock_id', 'price_date'),
+	'transaction': ('transaction_time', 'investor_id', 'stock_id'),
+	'holdings': ('stock_id', 'portfolio_id'),
+	'daily_macro_data': ('macro_date',),
+	'esg_score': ('stock_id', 'score_date'),
+	'risk_metrics': ('portfolio_id', 'metric_date'),
+}
+
+
+def encode_cursor(values):
 	"""
-	Display all stocks from the database
+	Encode the key values of the last row on a page into an opaque URL-safe cursor
 	"""
-	# Query to get all stocks
-	select_query = "SELECT * FROM stock"
-	cursor = g.conn.execute(text(select_query))
-	
-	stocks_list = []
-	for result in cursor:
-		stocks_list.append(result)
-	cursor.close()
-	
-	# Pass the stocks data to the template
-	context = dict(stocks=stocks_list)
-	return render_template("stocks.html", **context)
+	payload = json.dumps([str(value) for value in values])
+	return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
 
 
-# Route to display all investors
-@app.route('/investors')
-def investors():
+def decode_cursor(cursor, key_count):
 	"""
-	Display all investors from the database
+	Decode a cursor made by encode_cursor(), aborting with 400 if it is malformed
 	"""
-	# Query to get all investors
-	select_query = "SELECT * FROM investor"
-	cursor = g.conn.execute(text(select_query))
-	
-	investors_list = []
-	for result in cursor:
-		investors_list.append(result)
-	cursor.close()
-	
-	# Pass the investors data to the template
-	context = dict(investors=investors_list)
-	return render_template("investors.html", **context)
+	try:
+		padded = cursor + '=' * (-len(cursor) % 4)
+		values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+	except Exception:
+		abort(400)
+	if not isinstance(values, list) or len(values) != key_count:
+		abort(400)
+	return values
 
 
-# Route to display all transactions
-@app.route('/transactions')
-def transactions():
+def keyset_query(table):
 	"""
-	Display all transactions from the database
+	Build the SELECT for the current page of table from the request's ?after= cursor.
+	Returns the query string and its parameters.
 	"""
-	# Query to get all transactions
-	select_query = "SELECT * FROM transaction"
-	cursor = g.conn.execute(text(select_query))
-	
-	transactions_list = []
-	for result in cursor:
-		transactions_list.append(result)
-	cursor.close()
-	
-	# Pass the transactions data to the template
-	context = dict(transactions=transactions_list)
-	return render_template("transactions.html", **context)
+	keys = TABLE_KEYS[table]
+	key_list = ', '.join(keys)
+	select_query = f"SELECT * FROM {table}"
+	params = {}
 
+	cursor = request.args.get('after', '')
+	if cursor:
+		values = decode_cursor(cursor, len(keys))
+		placeholders = ', '.join(f':after_{i}' for i in range(len(keys)))
+		select_query += f" WHERE ({key_list}) > ({placeholders})"
+		for i, value in enumerate(values):
+			params[f'after_{i}'] = value
 
-# Route to display all holdings
-@app.route('/holdings')
-def holdings():
+	select_query += f" ORDER BY {key_list}"
+	return select_query, params
+
+
+def render_listing(template_name, rows_name, table):
 	"""
-	Display all holdings from the database
+	Render a listing template with one keyset page of table, or with the rest of
+	the table streamed from a server-side cursor when ?stream=1 is given.
 	"""
-	# Query to get all holdings
-	select_query = "SELECT * FROM holdings"
-	cursor = g.conn.execute(text(select_query))
-	
-	holdings_list = []
-	for result in cursor:
-		holdings_list.append(result)
+	select_query, params = keyset_query(table)
+
+	if request.args.get('stream'):
+		statement = text(select_query).execution_options(stream_results=True, yield_per=STREAM_YIELD_PER)
+		cursor = g.conn.execute(statement, params)
+		# Peek at the first row so the template's "no rows found" branch still works
+		first = cursor.fetchone()
+		rows = itertools.chain([first], cursor) if first is not None else []
+		context = {rows_name: rows, 'page': None}
+		# stream_template renders under stream_with_context, so g.conn stays
+		# checked out until the last row has been sent
+		return Response(stream_template(template_name, **context))
+
+	try:
+		page_size = int(request.args.get('page_size', PAGE_SIZE))
+	except ValueError:
+		abort(400)
+	page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+
+	# Fetch one extra row to find out whether there is a next page
+	cursor = g.conn.execute(text(select_query + " LIMIT :limit"), dict(params, limit=page_size + 1))
+	rows = cursor.fetchall()
 	cursor.close()
-	
-	# Pass the holdings data to the template
-	context = dict(holdings=holdings_list)
-	return render_template("holdings.html", **context)
 
+	next_url = None
+	if len(rows) > page_size:
+		rows = rows[:page_size]
+		last = rows[-1]._mapping
+		next_cursor = encode_cursor([last[key] for key in TABLE_KEYS[table]])
+		next_url = url_for(request.endpoint, after=next_cursor, page_size=page_size)
+
+	page = dict(
+		page_size=page_size,
+		next_url=next_url,
+		first_url=url_for(request.endpoint, page_size=page_size) if request.args.get('after') else None,
+		stream_url=url_for(request.endpoint, stream=1, after=request.args.get('after') or None)
+	)
+	context = {rows_name: rows, 'page': page}
+	return render_template(template_name, **context)
 
-# Route to display all portfolios
-@app.route('/portfolios')
-def portfolios():
+
+#
+# Latest stock prices.
+#
+# sql/latest_stock_price.sql keeps a latest_stock_price table (one row per stock)
+# up to date with triggers on stock_price. Analytics queries join that table
+# directly; single-stock lookups on the order entry path also go through an
+# in-process cache whose entries expire after LATEST_PRICE_TTL seconds. Writes
+# to stock_price reported with invalidate_responses() (ingest, partitions) drop
+# it along with the cached pages, in every worker when LISTEN/NOTIFY is on.
+#
+LATEST_PRICE_TTL = float(os.environ.get('ESGTRADER_LATEST_PRICE_TTL', 60))
+
+
+class ReadThroughCache(object):
 	"""
-	Display all portfolios from the database
+	Thread-safe in-process cache. Missing or expired keys are loaded with the
+	loader passed to get(); invalidate() drops one key or every key.
+
+	Every invalidation bumps version. A value whose load started before an
+	invalidation is returned to its caller but not stored, so a slow load can
+	never put data older than the invalidation back into the cache.
 	"""
-	# Query to get all portfolios
-	select_query = "SELECT * FROM portfolio"
-	cursor = g.conn.execute(text(select_query))
-	
-	portfolios_list = []
-	for result in cursor:
-		portfolios_list.append(result)
-	cursor.close()
-	
-	# Pass the portfolios data to the template
-	context = dict(portfolios=portfolios_list)
-	return render_template("portfolios.html", **context)
 
+	def __init__(self, ttl):
+		self.ttl = ttl
+		self.version = 0
+		self.hits = 0
+		self.misses = 0
+		self._entries = {}
+		self._lock = threading.Lock()
+
+	def get(self, key, loader):
+		now = time.monotonic()
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and entry[1] > now:
+				self.hits += 1
+				return entry[0]
+			self.misses += 1
+			version = self.version
+		value = loader()
+		with self._lock:
+			if self.version == version:
+				self._entries[key] = (value, now + self.ttl)
+		return value
+
+	def get_many(self, keys, loader):
+		"""
+		{key: value} for keys, loading the missing or expired ones with a single
+		loader(missing_keys) call that returns {key: value} (absent keys cache None)
+		"""
+		now = time.monotonic()
+		found = {}
+		with self._lock:
+			for key in keys:
+				entry = self._entries.get(key)
+				if entry is not None and entry[1] > now:
+					found[key] = entry[0]
+			missing = [key for key in keys if key not in found]
+			self.hits += len(found)
+			self.misses += len(missing)
+			version = self.version
+		if missing:
+			loaded = loader(missing)
+			with self._lock:
+				for key in missing:
+					found[key] = loaded.get(key)
+					if self.version == version:
+						self._entries[key] = (found[key], now + self.ttl)
+		return found
+
+	def invalidate(self, key=None):
+		with self._lock:
+			self.version += 1
+			if key is None:
+				self._entries.clear()
+			else:
+				self._entries.pop(key, None)
 
-# Route to display all risk metrics
-@app.route('/risk_metrics')
-def risk_metrics():
+
+latest_price_cache = ReadThroughCache(LATEST_PRICE_TTL)
+
+
+def latest_price(conn, stock_id):
 	"""
-	Display all risk metrics from the database
+	Most recent daily_price of stock_id as a float, or None if it has no prices
 	"""
-	# Query to get all risk metrics
-	select_query = "SELECT * FROM risk_metrics"
-	cursor = g.conn.execute(text(select_query))
-	
-	risk_metrics_list = []
-	for result in cursor:
-		risk_metrics_list.append(result)
-	cursor.close()
-	
-	# Pass the risk metrics data to the template
-	context = dict(risk_metrics=risk_metrics_list)
-	return render_template("risk_metrics.html", **context)
+	def load():
+		cursor = run_query(conn, 'latest_price', {"stock_id": stock_id})
+		result = cursor.fetchone()
+		cursor.close()
+		if not result or result[0] is None:
+			return None
+		return float(result[0])
 
+	return latest_price_cache.get(stock_id, load)
 
-# Route to display all macro data
-@app.route('/macro_data')
-def macro_data():
+
+def latest_prices(conn, stock_ids):
 	"""
-	Display all macro data from the database
+	Dict of stock_id to latest daily_price (None if it has no prices) for
+	stock_ids, with the uncached ones loaded in one query
 	"""
-	# Query to get all macro data
-	select_query = "SELECT * FROM daily_macro_data"
-	cursor = g.conn.execute(text(select_query))
-	
-	macro_data_list = []
-	for result in cursor:
-		macro_data_list.append(result)
-	cursor.close()
-	
-	# Pass the macro data to the template
-	context = dict(macro_data=macro_data_list)
-	return render_template("macro_data.html", **context)
+	def load(missing):
+		cursor = run_query(conn, 'latest_prices_of', {"stock_ids": missing})
+		prices = dict((result[0], float(result[1])) for result in cursor if result[1] is not None)
+		cursor.close()
+		return prices
 
+	return latest_price_cache.get_many(set(stock_ids), load)
 
-# Route to display all stock prices
-@app.route('/stock_prices')
-def stock_prices():
+
+def invalidate_latest_prices(stock_ids=None):
 	"""
-	Display all stock prices from the database
+	Drop cached latest prices after new prices were written (all stocks if stock_ids is None)
 	"""
-	# Query to get all stock prices
-	select_query = "SELECT * FROM stock_price"
-	cursor = g.conn.execute(text(select_query))
-	
-	stock_prices_list = []
-	for result in cursor:
-		stock_prices_list.append(result)
-	cursor.close()
-	
-	# Pass the stock prices data to the template
-	context = dict(stock_prices=stock_prices_list)
-	return render_template("stock_prices.html", **context)
+	if stock_ids is None:
+		latest_price_cache.invalidate()
+	else:
+		for stock_id in stock_ids:
+			latest_price_cache.invalidate(stock_id)
 
 
-# Route to display all ESG scores
-@app.route('/esg_scores')
-def esg_scores():
+#
+# Reference data for the investor and stock dropdowns.
+#
+# The lists change a few times a day, so they are cached in-process for up to
+# REFDATA_TTL seconds. Handlers that change investors call
+# invalidate_reference_data() after committing. With ESGTRADER_REFDATA_LISTEN=1
+# the invalidation is also broadcast with NOTIFY on REFDATA_CHANNEL, and every
+# worker process runs a LISTEN thread that drops its copy, so several workers
+# stay in sync without waiting for the TTL. The same thread also relays response
+# cache invalidations (RESPONSE_CHANNEL, see below).
+#
+REFDATA_TTL = float(os.environ.get('ESGTRADER_REFDATA_TTL', 300))
+REFDATA_LISTEN = os.environ.get('ESGTRADER_REFDATA_LISTEN', '0') == '1'
+REFDATA_CHANNEL = 'esgtrader_refdata'
+
+reference_cache = ReadThroughCache(REFDATA_TTL)
+refdata_listener_lock = threading.Lock()
+refdata_listener_pid = None
+
+
+def investor_options(conn):
 	"""
-	Display all ESG scores from the database
+	List of {'investor_id', 'company_name'} for every investor, ordered by investor_id
 	"""
-	# Query to get all ESG scores
-	select_query = "SELECT * FROM esg_score"
-	cursor = g.conn.execute(text(select_query))
-	
-	esg_scores_list = []
-	for result in cursor:
-		esg_scores_list.append(result)
-	cursor.close()
-	
-	# Pass the ESG scores data to the template
-	context = dict(esg_scores=esg_scores_list)
-	return render_template("esg_scores.html", **context)
+	def load():
+		cursor = run_query(conn, 'investor_options')
+		investors_list = []
+		for result in cursor:
+			investors_list.append({'investor_id': result[0], 'company_name': result[1]})
+		cursor.close()
+		return investors_list
 
+	start_refdata_listener()
+	return reference_cache.get('investors', load)
 
-# Route to display top investors by P&L
-@app.route('/top_investors')
-def top_investors():
+
+def stock_options(conn):
 	"""
-	Display investors ranked by profit/loss on their holdings
-	Calculates P&L as: (current_price - average_price) * holding_count
+	List of {'stock_id', 'ticker', 'sector'} for every stock, ordered by ticker
 	"""
-	# Query to calculate P&L for each investor
-	select_query = """
-		SELECT 
-			i.investor_id,
-			i.company_name,
-			COALESCE(SUM((latest_prices.daily_price - h.average_price) * h.holding_count), 0) as total_pnl,
-			COUNT(h.stock_id) as num_holdings
-		FROM investor i
-		LEFT JOIN portfolio p ON i.investor_id = p.investor_id
-		LEFT JOIN holdings h ON p.portfolio_id = h.portfolio_id
-		LEFT JOIN (
-			SELECT DISTINCT ON (stock_id) stock_id, daily_price
-			FROM stock_price
-			ORDER BY stock_id, price_date DESC
-		) latest_prices ON h.stock_id = latest_prices.stock_id
-		GROUP BY i.investor_id, i.company_name
-		ORDER BY total_pnl DESC
-	"""
-	cursor = g.conn.execute(text(select_query))
-	
-	investors_list = []
-	for result in cursor:
-		investors_list.append(result)
-	cursor.close()
-	
-	# Pass the investors data to the template
-	context = dict(investors=investors_list)
-	return render_template("top_investors.html", **context)
+	def load():
+		cursor = run_query(conn, 'stock_options')
+		stocks_list = []
+		for result in cursor:
+			stocks_list.append({
+				'stock_id': result[0],
+				'ticker': result[1],
+				'sector': result[2]
+			})
+		cursor.close()
+		return stocks_list
 
+	start_refdata_listener()
+	return reference_cache.get('stocks', load)
 
-# Route to display top ESG portfolios with risk metrics
-@app.route('/esg-stocks')
-def esg_stocks():
+
+def invalidate_reference_data(conn, *keys):
 	"""
-	Display portfolios ranked by average ESG score with risk metrics
-	Shows correlation between sustainability and risk-adjusted returns
+	Drop cached reference lists ('investors', 'stocks') after a committed change,
+	and tell the other worker processes when LISTEN/NOTIFY is enabled
 	"""
-	# Query joins Portfolio, Holdings, ESG_Score, and Risk_Metrics tables
-	select_query = """
-		SELECT p.portfolio_id,
-			ROUND(AVG(e.esg_score), 2) AS avg_esg_score,
-			r.sharpe_ratio,
-			r.beta
-		FROM Portfolio p
-		JOIN Holdings h ON p.portfolio_id = h.portfolio_id
-		JOIN ESG_Score e ON h.stock_id = e.stock_id
-		JOIN Risk_Metrics r ON p.portfolio_id = r.portfolio_id
-		GROUP BY p.portfolio_id, r.sharpe_ratio, r.beta
-		ORDER BY avg_esg_score DESC
-	"""
-	cursor = g.conn.execute(text(select_query))
-	
-	portfolios_list = []
-	for result in cursor:
-		portfolios_list.append(result)
-	cursor.close()
-	
-	# Pass the portfolios data to the template
-	context = dict(portfolios=portfolios_list)
-	return render_template("esg-stocks.html", **context)
+	for key in keys:
+		reference_cache.invalidate(key)
+	if REFDATA_LISTEN:
+		for key in keys:
+			conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": REFDATA_CHANNEL, "payload": key})
+		conn.commit()
 
 
-# Route to display best buy transactions by unrealized P&L
-@app.route('/best_buys')
-def best_buys():
+def listen_for_refdata_changes():
 	"""
-	Display buy transactions ranked by unrealized gain/loss
-	Calculates unrealized P&L as: (current_price - purchase_price) * unit_number
+	Body of the LISTEN thread: drop cached lists named in notifications on
+	REFDATA_CHANNEL and cached responses reading the tables named on
+	RESPONSE_CHANNEL, reconnecting after errors
 	"""
-	# Query joins Transaction, Stock, and Stock_Price tables
-	select_query = """
-		SELECT 
-			t.investor_id,
-			s.ticker,
-			t.unit_price AS purchase_price,
-			sp.daily_price AS current_price,
-			ROUND((sp.daily_price - t.unit_price) * t.unit_number, 2) AS unrealized_gain
-		FROM Transaction t
-		JOIN Stock s ON t.stock_id = s.stock_id
-		JOIN (
-			SELECT stock_id, daily_price
-			FROM stock_price
-			WHERE (stock_id, price_date) IN (
-				SELECT stock_id, MAX(price_date)
-				FROM stock_price
-				GROUP BY stock_id
-			)
-		) sp ON s.stock_id = sp.stock_id
-		WHERE t.transaction_type = 'buy'
-		ORDER BY unrealized_gain DESC
+	import select
+	db = get_engine()
+	cargs, cparams = db.dialect.create_connect_args(db.url)
+	while True:
+		try:
+			dbapi_conn = db.dialect.dbapi.connect(*cargs, **cparams)
+			dbapi_conn.autocommit = True
+			cursor = dbapi_conn.cursor()
+			cursor.execute(f"LISTEN {REFDATA_CHANNEL}; LISTEN {RESPONSE_CHANNEL}")
+			# Anything may have changed while we were not listening
+			reference_cache.invalidate()
+			drop_cached_tables()
+			while True:
+				if select.select([dbapi_conn], [], [], 60) == ([], [], []):
+					continue
+				dbapi_conn.poll()
+				while dbapi_conn.notifies:
+					notification = dbapi_conn.notifies.pop(0)
+					if notification.channel == RESPONSE_CHANNEL:
+						drop_cached_tables(*notification.payload.split(',') if notification.payload else ())
+					else:
+						reference_cache.invalidate(notification.payload or None)
+		except Exception:
+			app.logger.exception("uh oh, reference data listener lost its database connection")
+			time.sleep(5)
+
+
+def start_refdata_listener():
 	"""
-	cursor = g.conn.execute(text(select_query))
-	
-	transactions_list = []
-	for result in cursor:
-		transactions_list.append(result)
-	cursor.close()
-	
-	# Pass the transactions data to the template
-	context = dict(transactions=transactions_list)
-	return render_template("best_buys.html", **context)
+	Start the LISTEN thread once per process (again in each forked worker)
+	"""
+	global refdata_listener_pid
+	if not REFDATA_LISTEN or refdata_listener_pid == os.getpid():
+		return
+	with refdata_listener_lock:
+		if refdata_listener_pid == os.getpid():
+			return
+		refdata_listener_pid = os.getpid()
+		threading.Thread(target=listen_for_refdata_changes, name='refdata-listener', daemon=True).start()
 
 
-# Example of adding new data to the database
-@app.route('/add', methods=['POST'])
-def add():
-	# accessing form inputs from user
-	company_name = request.form.get('company_name', '').strip()
-	
-	# Validate that company name is not empty
-	if not company_name:
-		return redirect('/new_investor?confirmation=error&company_name=')
-	
-	# Query for all investor IDs to find the maximum numeric part
-	max_id_query = "SELECT investor_id FROM investor ORDER BY investor_id DESC LIMIT 1"
-	cursor = g.conn.execute(text(max_id_query))
-	result = cursor.fetchone()
-	cursor.close()
-	
-	# Extract numeric part from investor_id (format: INV###)
-	# Get the max number and add 1 (handle case where table is empty)
-	if result and result[0]:
-		# Extract numeric part from format like 'INV013'
-		numeric_part = int(result[0].replace('INV', ''))
-		new_number = numeric_part + 1
-	else:
-		new_number = 1
-	
-	# Format the new investor_id with leading zeros (e.g., INV014)
-	new_investor_id = f'INV{new_number:03d}'
-	
-	# Insert the new investor
-	params = {
-		"investor_id": new_investor_id,
-		"company_name": company_name
-	}
-	insert_query = "INSERT INTO investor(investor_id, company_name) VALUES (:investor_id, :company_name)"
-	g.conn.execute(text(insert_query), params)
-	
-	# Now create a portfolio for this investor
-	# Query for all portfolio IDs to find the maximum numeric part
-	max_portfolio_query = "SELECT portfolio_id FROM portfolio ORDER BY portfolio_id DESC LIMIT 1"
-	cursor = g.conn.execute(text(max_portfolio_query))
-	portfolio_result = cursor.fetchone()
-	cursor.close()
-	
-	# Extract numeric part from portfolio_id (format: PORT###)
-	# Get the max number and add 1 (handle case where table is empty)
-	if portfolio_result and portfolio_result[0]:
-		# Extract numeric part from format like 'PORT013'
-		portfolio_numeric = int(portfolio_result[0].replace('PORT', ''))
-		new_portfolio_number = portfolio_numeric + 1
-	else:
-		new_portfolio_number = 1
-	
-	# Format the new portfolio_id with leading zeros (e.g., PORT014)
-	new_portfolio_id = f'PORT{new_portfolio_number:03d}'
-	
-	# Get the current date from the system, or use default if not available
-	try:
-		creation_date = date.today().strftime('%Y-%m-%d')
-	except:
-		creation_date = '2025-11-12'
-	
-	# Insert the new portfolio with initial total_value of 0 and current date
-	insert_portfolio_query = """
-		INSERT INTO portfolio(portfolio_id, investor_id, total_value, creation_date) 
-		VALUES (:portfolio_id, :investor_id, :total_value, :creation_date)
+#
+# Response cache for the read-only analytics pages.
+#
+# The leaderboards and analytics listings only change when the tables behind
+# them are written, so their rendered bodies are kept in an in-process LRU of at
+# most RESPONSE_CACHE_MB megabytes, keyed by route and query arguments. A hit is
+# a dictionary lookup: no connection is checked out and no template rendered.
+# Each entry carries an ETag, and a request whose If-None-Match still matches
+# gets an empty 304 Not Modified.
+#
+# Each cached route declares the tables it reads (including the tables its
+# trigger-maintained tables are derived from). Write handlers call
+# invalidate_responses() with the tables they changed after committing; with
+# ESGTRADER_REFDATA_LISTEN=1 the invalidation is broadcast to the other workers
+# on RESPONSE_CHANNEL. Entries also expire after RESPONSE_CACHE_TTL seconds, for
+# changes made by other programs or commands while nobody listens.
+#
+RESPONSE_CACHE_MB = float(os.environ.get('ESGTRADER_RESPONSE_CACHE_MB', 64))
+RESPONSE_CACHE_TTL = float(os.environ.get('ESGTRADER_RESPONSE_CACHE_TTL', 300))
+RESPONSE_CHANNEL = 'esgtrader_responses'
+
+
+class ResponseCache(object):
 	"""
-	g.conn.execute(text(insert_portfolio_query), {
-		"portfolio_id": new_portfolio_id,
-		"investor_id": new_investor_id,
-		"total_value": 0,
-		"creation_date": creation_date
-	})
-	
-	g.conn.commit()
-	
-	# Redirect with confirmation message including portfolio info
-	return redirect(f'/new_investor?confirmation=success&investor_id={new_investor_id}&company_name={company_name}&portfolio_id={new_portfolio_id}')
+	Thread-safe LRU of rendered responses, bounded by the total size of their
+	bodies. Each entry is tagged with the tables it was rendered from, and
+	invalidate() drops the entries reading any of the given tables.
 
+	Like ReadThroughCache, every table has a version that invalidation bumps: a
+	body rendered while one of its tables was invalidated is not stored.
+	"""
 
-@app.route('/update_investor', methods=['POST'])
-def update_investor():
+	def __init__(self, max_bytes, ttl):
+		self.max_bytes = max_bytes
+		self.ttl = ttl
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._entries = OrderedDict()
+		self._versions = {}
+		self._lock = threading.Lock()
+
+	def get(self, key):
+		"""
+		(body, mimetype, etag) cached for key, or None
+		"""
+		now = time.monotonic()
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and entry['expires'] > now:
+				self._entries.move_to_end(key)
+				self.hits += 1
+				return entry['body'], entry['mimetype'], entry['etag']
+			if entry is not None:
+				self._remove(key)
+			self.misses += 1
+			return None
+
+	def versions(self, tables):
+		with self._lock:
+			return tuple(self._versions.get(table, 0) for table in tables)
+
+	def put(self, key, body, mimetype, tables, versions):
+		"""
+		Store a body rendered from tables at versions; returns its ETag
+		"""
+		etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+		if len(body) > self.max_bytes:
+			return etag
+		with self._lock:
+			if tuple(self._versions.get(table, 0) for table in tables) != versions:
+				return etag
+			if key in self._entries:
+				self._remove(key)
+			self._entries[key] = dict(body=body, mimetype=mimetype, etag=etag, tables=tables,
+				expires=time.monotonic() + self.ttl)
+			self.size += len(body)
+			# Evict least recently used entries until the budget holds again
+			while self.size > self.max_bytes:
+				self._remove(next(iter(self._entries)))
+				self.evictions += 1
+		return etag
+
+	def invalidate(self, *tables):
+		"""
+		Drop the entries reading any of tables (every entry if none are given)
+		"""
+		with self._lock:
+			if not tables:
+				tables = set(self._versions) | set(t for entry in self._entries.values() for t in entry['tables'])
+				for key in list(self._entries):
+					self._remove(key)
+			for table in tables:
+				self._versions[table] = self._versions.get(table, 0) + 1
+			stale = [key for key, entry in self._entries.items() if not set(entry['tables']).isdisjoint(tables)]
+			for key in stale:
+				self._remove(key)
+
+	def _remove(self, key):
+		self.size -= len(self._entries.pop(key)['body'])
+
+
+response_cache = ResponseCache(int(RESPONSE_CACHE_MB * 1024 * 1024), RESPONSE_CACHE_TTL)
+
+
+def cached_response(*tables):
 	"""
-	Update an investor's company name
+	Decorator for GET routes whose response only depends on their URL and
+	query arguments and the given tables
 	"""
-	investor_id = request.form.get('investor_id', '').strip()
-	new_company_name = request.form.get('company_name', '').strip()
-	
-	# Validate inputs
-	if not investor_id or not new_company_name:
-		return redirect('/manage_investor?confirmation=error&message=Invalid input')
-	
-	# Update the investor
-	update_query = "UPDATE investor SET company_name = :company_name WHERE investor_id = :investor_id"
-	params = {
-		"investor_id": investor_id,
-		"company_name": new_company_name
-	}
-	g.conn.execute(text(update_query), params)
-	g.conn.commit()
-	
-	# Redirect with success message
-	return redirect(f'/manage_investor?investor_id={investor_id}&confirmation=success&message=Company name updated successfully')
+	def decorator(view):
+		@functools.wraps(view)
+		def wrapper(*args, **kwargs):
+			if response_cache.max_bytes <= 0:
+				return view(*args, **kwargs)
+			key = (request.endpoint, tuple(sorted((request.view_args or {}).items())),
+				tuple(sorted(request.args.items(multi=True))))
+			cached = response_cache.get(key)
+			if cached is None:
+				versions = response_cache.versions(tables)
+				response = make_response(view(*args, **kwargs))
+				# Streamed and error responses are passed through
+				if response.status_code != 200 or response.is_streamed:
+					return response
+				body = response.get_data()
+				cached = body, response.mimetype, response_cache.put(key, body, response.mimetype, tables, versions)
+			body, mimetype, etag = cached
+			response = Response(body, mimetype=mimetype)
+			response.set_etag(etag)
+			# Browsers revalidate on every view, which costs a 304 when nothing changed
+			response.cache_control.no_cache = True
+			return response.make_conditional(request)
+		return wrapper
+	return decorator
+
+
+def drop_cached_tables(*tables):
+	"""
+	Drop this process's cached responses reading any of tables, and its cached
+	latest prices if stock_price is one of them (everything if none are given)
+	"""
+	response_cache.invalidate(*tables)
+	if not tables or 'stock_price' in tables:
+		invalidate_latest_prices()
 
 
-@app.route('/delete_investor', methods=['POST'])
-def delete_investor():
+def invalidate_responses(conn, *tables):
 	"""
-	Delete an investor and their associated portfolios
+	Drop cached responses (and latest prices) reading any of tables after a
+	committed write (everything if none are given), and tell the other worker
+	processes when LISTEN/NOTIFY is enabled
 	"""
-	investor_id = request.form.get('investor_id', '').strip()
-	
-	# Validate input
-	if not investor_id:
-		return redirect('/manage_investor?confirmation=error&message=Invalid investor ID')
-	
-	try:
-		# First, get all portfolio IDs for this investor
-		portfolio_query = "SELECT portfolio_id FROM portfolio WHERE investor_id = :investor_id"
-		cursor = g.conn.execute(text(portfolio_query), {"investor_id": investor_id})
-		portfolio_ids = [row[0] for row in cursor]
+	drop_cached_tables(*tables)
+	if REFDATA_LISTEN:
+		conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": RESPONSE_CHANNEL, "payload": ','.join(tables)})
+		conn.commit()
+
+
+#
+# Investor and portfolio IDs.
+#
+# IDs keep their INV###/PORT### format but their numbers come from the Postgres
+# sequences created by sql/id_sequences.sql, so allocation is a single nextval()
+# call that is safe under concurrent requests and does not depend on how the
+# existing IDs sort as strings.
+#
+class IdAllocator(object):
+	"""
+	Formats IDs as prefix + zero-padded sequence number. allocate() reserves a
+	whole block of IDs in one round trip for bulk onboarding.
+	"""
+
+	def __init__(self, prefix, sequence):
+		self.prefix = prefix
+		self.sequence = sequence
+
+	def format(self, number):
+		return f'{self.prefix}{number:03d}'
+
+	def allocate(self, conn, count=1):
+		"""
+		Reserve count new IDs and return them as a list
+		"""
+		select_query = f"SELECT nextval('{self.sequence}') FROM generate_series(1, :count)"
+		cursor = conn.execute(text(select_query), {"count": count})
+		ids = [self.format(row[0]) for row in cursor]
 		cursor.close()
-		
-		# Delete holdings for each portfolio
-		for portfolio_id in portfolio_ids:
-			delete_holdings_query = "DELETE FROM holdings WHERE portfolio_id = :portfolio_id"
-			g.conn.execute(text(delete_holdings_query), {"portfolio_id": portfolio_id})
-		
-		# Delete risk metrics for each portfolio
-		for portfolio_id in portfolio_ids:
-			delete_risk_query = "DELETE FROM risk_metrics WHERE portfolio_id = :portfolio_id"
-			g.conn.execute(text(delete_risk_query), {"portfolio_id": portfolio_id})
-		
-		# Delete portfolios for this investor
-		delete_portfolio_query = "DELETE FROM portfolio WHERE investor_id = :investor_id"
-		g.conn.execute(text(delete_portfolio_query), {"investor_id": investor_id})
-		
-		# Delete transactions for this investor
-		delete_transactions_query = "DELETE FROM transaction WHERE investor_id = :investor_id"
-		g.conn.execute(text(delete_transactions_query), {"investor_id": investor_id})
-		
-		# Finally, delete the investor
-		delete_investor_query = "DELETE FROM investor WHERE investor_id = :investor_id"
-		g.conn.execute(text(delete_investor_query), {"investor_id": investor_id})
-		
-		g.conn.commit()
-		
-		# Redirect with success message
-		return redirect('/manage_investor?confirmation=success&message=Investor and associated data deleted successfully')
-	
-	except Exception as e:
-		g.conn.rollback()
-		return redirect(f'/manage_investor?confirmation=error&message=Error deleting investor: {str(e)}')
+		return ids
 
+	def next_id(self, conn):
+		return self.allocate(conn, 1)[0]
 
-@app.route('/submit_holdings', methods=['POST'])
-def submit_holdings():
+
+investor_ids = IdAllocator('INV', 'investor_id_seq')
+portfolio_ids = IdAllocator('PORT', 'portfolio_id_seq')
+
+
+#
+# Typeahead search over the reference data.
+#
+# The add transaction and add holdings forms no longer embed every investor and
+# stock; they ask /api/search/investors and /api/search/stocks for candidates as
+# the user types. Searches run against a sorted in-memory prefix index built
+# from the cached reference lists, and rebuilt whenever those lists are reloaded.
+#
+SEARCH_LIMIT = int(os.environ.get('ESGTRADER_SEARCH_LIMIT', 10))
+MAX_SEARCH_LIMIT = 50
+
+
+class PrefixIndex(object):
 	"""
-	Add new holdings to a portfolio
+	Sorted list of (term, rank, position) over lowercased search terms, so a
+	prefix lookup is two binary searches. terms(item) returns the item's terms
+	in rank order, e.g. ticker before stock_id.
 	"""
-	investor_id = request.form.get('investor_id', '').strip()
-	portfolio_id = request.form.get('portfolio_id', '').strip()
-	stock_id = request.form.get('stock_id', '').strip()
-	average_price = request.form.get('average_price', '').strip()
-	holding_count = request.form.get('holding_count', '').strip()
-	
-	# Validate all required fields are present
-	if not all([investor_id, portfolio_id, stock_id, average_price, holding_count]):
-		return redirect(f'/add_holdings?investor_id={investor_id}&confirmation=error&message=All fields are required')
-	
-	# Validate and convert average_price to float
-	try:
-		average_price_float = float(average_price)
-	except ValueError:
-		return redirect(f'/add_holdings?investor_id={investor_id}&confirmation=error&message=Average price must be a numeric value')
-	
-	# Validate and convert holding_count to int (round down if float)
+
+	def __init__(self, items, terms):
+		entries = []
+		for position, item in enumerate(items):
+			for rank, term in enumerate(terms(item)):
+				if term:
+					entries.append((term.lower(), rank, position))
+		entries.sort()
+		self.items = items
+		self._entries = entries
+		self._terms = [entry[0] for entry in entries]
+
+	def search(self, query, limit):
+		"""
+		Items with a term starting with query, best first: exact matches, then
+		lower-ranked terms, then shorter terms
+		"""
+		query = query.strip().lower()
+		if not query:
+			return []
+		lo = bisect.bisect_left(self._terms, query)
+		hi = bisect.bisect_left(self._terms, query + '\uffff')
+
+		best = {}
+		for term, rank, position in self._entries[lo:hi]:
+			score = (term != query, rank, len(term), term)
+			if position not in best or score < best[position]:
+				best[position] = score
+		ranked = heapq.nsmallest(limit, best.items(), key=lambda entry: entry[1])
+		return [self.items[position] for position, _ in ranked]
+
+
+search_indexes = {}
+search_indexes_lock = threading.Lock()
+
+
+def search_index(key, items, terms):
+	"""
+	PrefixIndex over a cached reference list, rebuilt only when the list was reloaded
+	"""
+	with search_indexes_lock:
+		cached = search_indexes.get(key)
+		if cached is not None and cached[0] is items:
+			return cached[1]
+	index = PrefixIndex(items, terms)
+	with search_indexes_lock:
+		search_indexes[key] = (items, index)
+	return index
+
+
+def investor_terms(investor):
+	# Company name first, then the ID, then every later word of the name
+	words = investor['company_name'].split()
+	return [investor['company_name'], investor['investor_id']] + words[1:]
+
+
+def stock_terms(stock):
+	return [stock['ticker'], stock['stock_id']]
+
+
+def search_limit():
 	try:
-		holding_count_float = float(holding_count)
-		holding_count_int = int(holding_count_float)  # This rounds down automatically
+		limit = int(request.args.get('limit', SEARCH_LIMIT))
 	except ValueError:
-		return redirect(f'/add_holdings?investor_id={investor_id}&confirmation=error&message=Holding count must be a numeric value')
-	
-	# Check if this holding already exists (stock_id, portfolio_id is primary key)
-	check_query = "SELECT COUNT(*) FROM holdings WHERE stock_id = :stock_id AND portfolio_id = :portfolio_id"
-	cursor = g.conn.execute(text(check_query), {"stock_id": stock_id, "portfolio_id": portfolio_id})
-	exists = cursor.fetchone()[0] > 0
-	cursor.close()
-	
-	if exists:
-		return redirect(f'/add_holdings?investor_id={investor_id}&confirmation=error&message=This stock already exists in the selected portfolio')
-	
+		abort(400)
+	return max(1, min(limit, MAX_SEARCH_LIMIT))
+
+
+#
+# Application startup.
+#
+# Importing this module only builds the Flask app; nothing touches the database
+# until the first request (or command) needs it. Schema objects are installed
+# explicitly with `python server.py migrate`.
+#
+# A server that would rather pay the connection and cache-fill cost before it
+# takes traffic can warm up first (ESGTRADER_WARMUP=1, or --warmup on run/serve):
+# WARMUP_CONNECTIONS pool connections are opened and the reference data, latest
+# prices and search indexes are loaded.
+#
+WARMUP = os.environ.get('ESGTRADER_WARMUP', '0') == '1'
+WARMUP_CONNECTIONS = int(os.environ.get('ESGTRADER_WARMUP_CONNECTIONS', POOL_SIZE))
+
+
+def warm_up():
+	"""
+	Open pool connections and fill the in-process caches
+	"""
+	started = time.perf_counter()
+	# Hold the connections at once so the pool really opens that many
+	conns = []
 	try:
-		# Get the most current stock price for the selected stock
-		price_query = """
-			SELECT daily_price 
-			FROM stock_price 
-			WHERE stock_id = :stock_id 
-			ORDER BY price_date DESC 
-			LIMIT 1
-		"""
-		cursor = g.conn.execute(text(price_query), {"stock_id": stock_id})
-		price_result = cursor.fetchone()
-		cursor.close()
-		
-		if not price_result or price_result[0] is None:
-			return redirect(f'/add_holdings?investor_id={investor_id}&confirmation=error&message=No price data found for selected stock')
-		
-		current_stock_price = float(price_result[0])
-		
-		# Calculate the value to add to portfolio: holding_count * current_stock_price
-		value_to_add = holding_count_int * current_stock_price
-		
-		# Insert the new holding
-		insert_query = """
-			INSERT INTO holdings(stock_id, portfolio_id, average_price, holding_count) 
-			VALUES (:stock_id, :portfolio_id, :average_price, :holding_count)
-		"""
-		g.conn.execute(text(insert_query), {
-			"stock_id": stock_id,
-			"portfolio_id": portfolio_id,
-			"average_price": average_price_float,
-			"holding_count": holding_count_int
-		})
-		
-		# Update the portfolio's total_value by adding the new holding value
-		update_portfolio_query = """
-			UPDATE portfolio 
-			SET total_value = total_value + :value_to_add 
-			WHERE portfolio_id = :portfolio_id
-		"""
-		g.conn.execute(text(update_portfolio_query), {
-			"value_to_add": value_to_add,
-			"portfolio_id": portfolio_id
-		})
-		
-		g.conn.commit()
-		
-		# Redirect with success message including the added value
-		return redirect(f'/add_holdings?investor_id={investor_id}&confirmation=success&message=Holdings added successfully! Portfolio value increased by ${value_to_add:.2f}')
+		for _ in range(max(1, min(WARMUP_CONNECTIONS, POOL_SIZE))):
+			conns.append(checkout_connection())
+			conns[-1].execute(text("SELECT 1"))
+		search_index('investors', investor_options(conns[0]), investor_terms)
+		search_index('stocks', stock_options(conns[0]), stock_terms)
+		latest_prices(conns[0], [stock['stock_id'] for stock in stock_options(conns[0])])
+	finally:
+		for conn in conns:
+			conn.close()
+	print("warmed up %d connections and caches in %.0f ms" % (len(conns), (time.perf_counter() - started) * 1000))
+
+
+def create_app(database_uri=None, warmup=None):
+	"""
+	Configure and return the app, for WSGI servers: gunicorn 'server:create_app()'
+
+	database_uri overrides DATABASEURI (only before the engine exists);
+	warmup defaults to ESGTRADER_WARMUP.
+	"""
+	global DATABASEURI
+	if database_uri is not None:
+		if engine is not None:
+			raise RuntimeError("create_app(database_uri=...) after the engine was created")
+		DATABASEURI = database_uri
+	if WARMUP if warmup is None else warmup:
+		warm_up()
+	return app
+
+
+#
+# @app.route is a decorator around index() that means:
+#   run index() whenever the user tries to access the "/" path using a GET request
+#
+# If you wanted the user to go to, for example, localhost:8111/foobar/ with POST or GET then you could use:
+#
+#       @app.route("/foobar/", methods=["POST", "GET"])
+#
+# PROTIP: (the trailing / in the path is important)
+# 
+# see for routing: https://flask.palletsprojects.com/en/1.1.x/quickstart/#routing
+# see for decorators: http://simeonfranklin.com/blog/2012/jul/1/python-decorators-in-12-steps/
+#
+@app.route('/')
+def index():
+	"""
+	request is a special object that Flask provides to access web request information:
+
+	request.method:   "GET" or "POST"
+	request.form:     if the browser submitted a form, this contains the data in the form
+	request.args:     dictionary of URL arguments, e.g., {a:1, b:2} for http://localhost?a=1&b=2
+
+	See its API: https://flask.palletsprojects.com/en/1.1.x/api/#incoming-request-data
+	"""
+
+	#
+	# Flask uses Jinja templates, which is an extension to HTML where you can
+	# pass data to a template and dynamically generate HTML based on the data
+	# (you can think of it as simple PHP)
+	# documentation: https://realpython.com/primer-on-jinja-templating/
+	#
+	# You can see an example template in templates/index.html
+	#
+	# render_template looks in the templates/ folder for files.
+	# for example, the below file reads template/index.html
+	#
+	return render_template("index.html")
+
+#
+# This is an example of a different path.  You can see it at:
+# 
+#     localhost:8111/another
+#
+# Notice that the function name is another() rather than index()
+# The functions for each app.route need to have different names
+#
+@app.route('/another')
+def another():
+	return render_template("another.html")
+
+
+@app.route('/new_investor')
+def new_investor():
+	"""
+	Page for creating new investor portfolios
+	"""
+	# Get confirmation message if redirected from add
+	confirmation = request.args.get('confirmation', '')
+	investor_id = request.args.get('investor_id', '')
+	company_name = request.args.get('company_name', '')
+	portfolio_id = request.args.get('portfolio_id', '')
 	
-	except Exception as e:
-		g.conn.rollback()
-		return redirect(f'/add_holdings?investor_id={investor_id}&confirmation=error&message=Error adding holdings: {str(e)}')
+	context = dict(
+		confirmation=confirmation,
+		investor_id=investor_id,
+		company_name=company_name,
+		portfolio_id=portfolio_id
+	)
+	return render_template("new_investor.html", **context)
 
 
-@app.route('/add_transactions', methods=['GET'])
-def add_transactions():
+@app.route('/manage_investor')
+def manage_investor():
 	"""
-	Page for adding new transactions
+	Page for managing existing investor records - update or delete
 	"""
-	# Get all investors for the dropdown
-	investors_query = "SELECT investor_id, company_name FROM investor ORDER BY investor_id"
-	cursor = g.conn.execute(text(investors_query))
-	investors_list = []
-	for result in cursor:
-		investors_list.append({'investor_id': result[0], 'company_name': result[1]})
-	cursor.close()
+	# Get all investors for the dropdown (cached reference data)
+	investors_list = investor_options(g.conn)
 	
-	# Get all stocks with their latest prices for the dropdown
-	stocks_query = """
-		SELECT s.stock_id, s.ticker, s.sector, sp.daily_price as latest_price
-		FROM stock s
-		LEFT JOIN (
-			SELECT DISTINCT ON (stock_id) stock_id, daily_price
-			FROM stock_price
-			ORDER BY stock_id, price_date DESC
-		) sp ON s.stock_id = sp.stock_id
-		ORDER BY s.ticker
-	"""
-	cursor = g.conn.execute(text(stocks_query))
-	stocks_list = []
-	for result in cursor:
-		stocks_list.append({
-			'stock_id': result[0],
-			'ticker': result[1],
-			'sector': result[2],
-			'latest_price': result[3] if result[3] else 0.0
-		})
-	cursor.close()
+	# Get selected investor details if an investor_id is provided
+	selected_investor_id = request.args.get('investor_id', '')
+	selected_investor = None
+	portfolio_count = 0
+	
+	if selected_investor_id:
+		# Get investor details
+		cursor = run_query(g.conn, 'investor', {"investor_id": selected_investor_id})
+		result = cursor.fetchone()
+		if result:
+			selected_investor = {'investor_id': result[0], 'company_name': result[1]}
+		cursor.close()
+		
+		# Count portfolios for this investor
+		cursor = run_query(g.conn, 'investor_portfolio_count', {"investor_id": selected_investor_id})
+		portfolio_count = cursor.fetchone()[0]
+		cursor.close()
 	
 	# Get confirmation messages
 	confirmation = request.args.get('confirmation', '')
@@ -874,255 +1385,2637 @@ def add_transactions():
 	
 	context = dict(
 		investors=investors_list,
-		stocks=stocks_list,
+		selected_investor=selected_investor,
+		portfolio_count=portfolio_count,
 		confirmation=confirmation,
 		message=message
 	)
-	return render_template("add_transactions.html", **context)
+	return render_template("manage_investor.html", **context)
 
 
-@app.route('/check_holdings', methods=['GET'])
-def check_holdings():
+@app.route('/add_holdings', methods=['GET'])
+def add_holdings():
 	"""
-	API endpoint to check if an investor has holdings for a specific stock
-	Returns JSON with holdings information
+	Page for adding new holdings to portfolios
 	"""
-	investor_id = request.args.get('investor_id', '')
-	stock_id = request.args.get('stock_id', '')
-	
-	if not investor_id or not stock_id:
-		return {'has_holdings': False, 'holding_count': 0, 'average_price': 0}
+	# Get selected investor if provided (other investors are searched as the user types)
+	selected_investor_id = request.args.get('investor_id', '')
+	selected_investor = None
 	
-	try:
-		# Find the investor's portfolio
-		portfolio_query = """
-			SELECT portfolio_id 
-			FROM portfolio 
-			WHERE investor_id = :investor_id 
-			ORDER BY creation_date DESC 
-			LIMIT 1
-		"""
-		cursor = g.conn.execute(text(portfolio_query), {"investor_id": investor_id})
-		portfolio = cursor.fetchone()
+	# Get portfolios for selected investor
+	portfolios_list = []
+	if selected_investor_id:
+		cursor = run_query(g.conn, 'investor', {"investor_id": selected_investor_id})
+		result = cursor.fetchone()
+		if result:
+			selected_investor = {'investor_id': result[0], 'company_name': result[1]}
 		cursor.close()
 		
-		if not portfolio:
-			return {'has_holdings': False, 'holding_count': 0, 'average_price': 0}
-		
-		portfolio_id = portfolio[0]
-		
-		# Check holdings
-		holdings_query = """
-			SELECT holding_count, average_price 
-			FROM holdings 
-			WHERE stock_id = :stock_id AND portfolio_id = :portfolio_id
-		"""
-		cursor = g.conn.execute(text(holdings_query), {
-			"stock_id": stock_id,
-			"portfolio_id": portfolio_id
-		})
-		holding = cursor.fetchone()
+		cursor = run_query(g.conn, 'investor_portfolios', {"investor_id": selected_investor_id})
+		for result in cursor:
+			portfolios_list.append({
+				'portfolio_id': result[0],
+				'total_value': result[1],
+				'creation_date': result[2]
+			})
 		cursor.close()
-		
-		if holding and holding[0] > 0:
-			return {
-				'has_holdings': True,
-				'holding_count': holding[0],
-				'average_price': float(holding[1])
-			}
-		else:
-			return {'has_holdings': False, 'holding_count': 0, 'average_price': 0}
 	
-	except Exception as e:
-		print(f"Error checking holdings: {e}")
-		return {'has_holdings': False, 'holding_count': 0, 'average_price': 0}
+	# Get confirmation messages
+	confirmation = request.args.get('confirmation', '')
+	message = request.args.get('message', '')
+	
+	context = dict(
+		portfolios=portfolios_list,
+		selected_investor=selected_investor,
+		selected_investor_id=selected_investor_id,
+		confirmation=confirmation,
+		message=message
+	)
+	return render_template("add_holdings.html", **context)
 
 
-@app.route('/submit_transaction', methods=['POST'])
-def submit_transaction():
+# Route to display all stocks
+@app.route('/stocks')
+def stocks():
+	"""
+	Display all stocks from the database
+	"""
+	# Query to get all stocks
+	cursor = run_query(g.conn, 'all_stocks')
+	
+	stocks_list = []
+	for result in cursor:
+		stocks_list.append(result)
+	cursor.close()
+	
+	# Pass the stocks data to the template
+	context = dict(stocks=stocks_list)
+	return render_template("stocks.html", **context)
+
+
+# Route to display all investors
+@app.route('/investors')
+def investors():
+	"""
+	Display all investors from the database
+	"""
+	# Query to get all investors
+	cursor = run_query(g.conn, 'all_investors')
+	
+	investors_list = []
+	for result in cursor:
+		investors_list.append(result)
+	cursor.close()
+	
+	# Pass the investors data to the template
+	context = dict(investors=investors_list)
+	return render_template("investors.html", **context)
+
+
+# Route to display all transactions
+@app.route('/transactions')
+def transactions():
+	"""
+	Display all transactions from the database
+	"""
+	# Page through transactions by transaction_time instead of loading the whole table
+	return render_listing("transactions.html", "transactions", "transaction")
+
+
+# Route to display all holdings
+@app.route('/holdings')
+def holdings():
+	"""
+	Display all holdings from the database
+	"""
+	# Page through holdings by (stock_id, portfolio_id) instead of loading the whole table
+	return render_listing("holdings.html", "holdings", "holdings")
+
+
+# Route to display all portfolios
+@app.route('/portfolios')
+def portfolios():
+	"""
+	Display all portfolios from the database
+	"""
+	# Query to get all portfolios
+	cursor = run_query(g.conn, 'all_portfolios')
+	
+	portfolios_list = []
+	for result in cursor:
+		portfolios_list.append(result)
+	cursor.close()
+	
+	# Pass the portfolios data to the template
+	context = dict(portfolios=portfolios_list)
+	return render_template("portfolios.html", **context)
+
+
+# Route to display all risk metrics
+@app.route('/risk_metrics')
+@cached_response('risk_metrics')
+def risk_metrics():
+	"""
+	Display all risk metrics from the database
+	"""
+	# Query to get all risk metrics
+	cursor = run_query(g.conn, 'all_risk_metrics')
+	
+	risk_metrics_list = []
+	for result in cursor:
+		risk_metrics_list.append(result)
+	cursor.close()
+	
+	# Pass the risk metrics data to the template
+	context = dict(risk_metrics=risk_metrics_list)
+	return render_template("risk_metrics.html", **context)
+
+
+# Route to display all macro data
+@app.route('/macro_data')
+@cached_response('daily_macro_data')
+def macro_data():
+	"""
+	Display all macro data from the database
+	"""
+	# Page through macro data by macro_date instead of loading the whole table
+	return render_listing("macro_data.html", "macro_data", "daily_macro_data")
+
+
+# Route to display all stock prices
+@app.route('/stock_prices')
+def stock_prices():
+	"""
+	Display all stock prices from the database
+	"""
+	# Page through stock prices by (stock_id, price_date) instead of loading the whole table
+	return render_listing("stock_prices.html", "stock_prices", "stock_price")
+
+
+#
+# Price history series.
+#
+# /api/stock_prices/<stock_id>/series returns one stock's prices between ?start=
+# and ?end= (ISO dates, default: the whole history), reduced on the server to at
+# most ?points= points (default SERIES_POINTS), so a chart of ten years of daily
+# prices downloads about a thousand points instead of every row.
+#
+#   ?method=lttb  (default) the points Largest-Triangle-Three-Buckets keeps,
+#                 which preserve the shape of the line, first and last included
+#   ?method=ohlc  ?points= buckets of consecutive prices, each as its first date
+#                 with the open, high, low and close of the bucket
+#
+# Series no longer than ?points= are returned as they are. Responses go through
+# the response cache, keyed by stock and query string, and are dropped whenever
+# stock_price changes. Downsampling needs NumPy.
+#
+SERIES_POINTS = int(os.environ.get('ESGTRADER_SERIES_POINTS', 1000))
+MAX_SERIES_POINTS = int(os.environ.get('ESGTRADER_MAX_SERIES_POINTS', 10000))
+SERIES_COLUMNS = {
+	'lttb': ['date', 'price'],
+	'ohlc': ['date', 'open', 'high', 'low', 'close'],
+}
+
+
+def lttb_indices(np, x, y, threshold):
+	"""
+	Indices of the threshold points of (x, y) kept by Largest-Triangle-Three-Buckets
+	"""
+	n = len(x)
+	if threshold >= n or threshold < 3:
+		return np.arange(n)
+	# The points between the first and last split into threshold - 2 buckets
+	edges = np.arange(threshold - 1) * (n - 2) // (threshold - 2) + 1
+	counts = np.diff(edges)
+	mean_x = np.add.reduceat(x[:-1], edges[:-1]) / counts
+	mean_y = np.add.reduceat(y[:-1], edges[:-1]) / counts
+
+	selected = np.empty(threshold, dtype=int)
+	selected[0], selected[-1] = 0, n - 1
+	previous = 0
+	for bucket in range(threshold - 2):
+		start, end = edges[bucket], edges[bucket + 1]
+		# Third corner: the next bucket's average, or the last point
+		if bucket + 1 < threshold - 2:
+			next_x, next_y = mean_x[bucket + 1], mean_y[bucket + 1]
+		else:
+			next_x, next_y = x[-1], y[-1]
+		# Twice the area of the triangle each candidate forms with the previous pick
+		areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+			- (x[previous] - x[start:end]) * (next_y - y[previous]))
+		previous = start + int(np.argmax(areas))
+		selected[bucket + 1] = previous
+	return selected
+
+
+def ohlc_buckets(np, y, buckets):
+	"""
+	(first index, open, high, low, close) arrays for y split into buckets runs of consecutive points
+	"""
+	buckets = min(buckets, len(y))
+	edges = np.arange(buckets + 1) * len(y) // buckets
+	starts = edges[:-1]
+	return starts, y[starts], np.maximum.reduceat(y, starts), np.minimum.reduceat(y, starts), y[edges[1:] - 1]
+
+
+def series_argument(name, parse, default):
+	"""
+	Parse the ?name= query argument, aborting with 400 if it does not parse
+	"""
+	value = request.args.get(name)
+	if not value:
+		return default
+	try:
+		return parse(value)
+	except ValueError:
+		abort(400)
+
+
+@app.route('/api/stock_prices/<stock_id>/series', methods=['GET'])
+@cached_response('stock_price')
+def stock_price_series(stock_id):
+	"""
+	API endpoint for price charts: one stock's downsampled price history
+	Returns JSON with the columns and rows of the series
+	"""
+	start = series_argument('start', date.fromisoformat, date.min)
+	end = series_argument('end', date.fromisoformat, date.max)
+	points = max(3, min(series_argument('points', int, SERIES_POINTS), MAX_SERIES_POINTS))
+	method = request.args.get('method', 'lttb')
+	if method not in SERIES_COLUMNS:
+		abort(400)
+
+	# Bounded by date, so only the partitions in range are read
+	rows = run_query(g.conn, 'price_series', {"stock_id": stock_id, "start": start, "end": end}).fetchall()
+	if not rows and run_query(g.conn, 'stock_exists', {"stock_id": stock_id}).first() is None:
+		abort(404)
+
+	dates = [row[0] for row in rows]
+	prices = [float(row[1]) for row in rows]
+	if len(rows) <= points:
+		series = [[day.isoformat(), price] if method == 'lttb' else [day.isoformat(), price, price, price, price]
+			for day, price in zip(dates, prices)]
+	else:
+		try:
+			import numpy as np
+		except ImportError:
+			return {'error': "downsampling needs numpy (pip install numpy)"}, 501
+		y = np.array(prices)
+		if method == 'lttb':
+			x = np.array([day.toordinal() for day in dates], dtype=float)
+			series = [[dates[i].isoformat(), prices[i]] for i in lttb_indices(np, x, y, points).tolist()]
+		else:
+			starts, *bars = ohlc_buckets(np, y, points)
+			series = [[dates[i].isoformat(), *bar] for i, *bar in zip(starts.tolist(), *(bar.tolist() for bar in bars))]
+
+	return {
+		'stock_id': stock_id,
+		'method': method,
+		'source_points': len(rows),
+		'columns': SERIES_COLUMNS[method],
+		'points': series,
+	}
+
+
+# Route to display all ESG scores
+@app.route('/esg_scores')
+def esg_scores():
+	"""
+	Display all ESG scores from the database
+	"""
+	# Page through ESG scores by (stock_id, score_date) instead of loading the whole table
+	return render_listing("esg_scores.html", "esg_scores", "esg_score")
+
+
+#
+# The leaderboards read the first rows of the P&L tables maintained by
+# sql/pnl_engine.sql, so they cost the same however many trades there are.
+#
+LEADERBOARD_SIZE = int(os.environ.get('ESGTRADER_LEADERBOARD_SIZE', 100))
+MAX_LEADERBOARD_SIZE = 1000
+
+
+def leaderboard_size():
+	"""
+	Rows shown on the /top_investors and /best_buys leaderboards (?limit=)
+	"""
+	try:
+		limit = int(request.args.get('limit', LEADERBOARD_SIZE))
+	except ValueError:
+		abort(400)
+	return max(1, min(limit, MAX_LEADERBOARD_SIZE))
+
+
+# Route to display top investors by P&L
+@app.route('/top_investors')
+@cached_response('investor', 'holdings', 'stock_price')
+def top_investors():
+	"""
+	Display the top investors ranked by profit/loss on their holdings
+	P&L, (current_price - average_price) * holding_count summed over holdings,
+	is kept up to date in investor_pnl by sql/pnl_engine.sql
+	"""
+	cursor = run_query(g.conn, 'top_investors', {"limit": leaderboard_size()})
+	
+	investors_list = []
+	for result in cursor:
+		investors_list.append(result)
+	cursor.close()
+	
+	# Pass the investors data to the template
+	context = dict(investors=investors_list)
+	return render_template("top_investors.html", **context)
+
+
+# Route to display top ESG portfolios with risk metrics
+@app.route('/esg-stocks')
+@cached_response('esg_portfolio_ranking')
+def esg_stocks():
+	"""
+	Display portfolios ranked by holding-weighted ESG score with risk metrics
+	Shows correlation between sustainability and risk-adjusted returns
+	The ranking is precomputed in the esg_portfolio_ranking materialized view
+	(sql/esg_portfolio_ranking.sql) and refreshed by `refresh-rankings`
+	"""
+	cursor = run_query(g.conn, 'esg_ranking', {"limit": leaderboard_size()})
+	
+	portfolios_list = []
+	for result in cursor:
+		portfolios_list.append(result)
+	cursor.close()
+
+	# The page is cached, so the template shows the ranking's age client-side
+	refreshed_at = run_query(g.conn, 'esg_ranking_refreshed').scalar()
+	
+	# Pass the portfolios data to the template
+	context = dict(
+		portfolios=portfolios_list,
+		refreshed_at=refreshed_at
+	)
+	return render_template("esg-stocks.html", **context)
+
+
+# Route to display best buy transactions by unrealized P&L
+@app.route('/best_buys')
+@cached_response('transaction', 'stock_price', 'stock')
+def best_buys():
+	"""
+	Display the top buy transactions ranked by unrealized gain/loss
+	Unrealized P&L, (current_price - purchase_price) * unit_number, is kept up to
+	date in buy_pnl by sql/pnl_engine.sql
+	"""
+	cursor = run_query(g.conn, 'best_buys', {"limit": leaderboard_size()})
+	
+	transactions_list = []
+	for result in cursor:
+		transactions_list.append(result)
+	cursor.close()
+	
+	# Pass the transactions data to the template
+	context = dict(transactions=transactions_list)
+	return render_template("best_buys.html", **context)
+
+
+# Example of adding new data to the database
+@app.route('/add', methods=['POST'])
+def add():
+	# accessing form inputs from user
+	company_name = request.form.get('company_name', '').strip()
+	
+	# Validate that company name is not empty
+	if not company_name:
+		return redirect('/new_investor?confirmation=error&company_name=')
+	
+	# Allocate the new investor_id (format: INV###, e.g., INV014) from its sequence
+	new_investor_id = investor_ids.next_id(g.conn)
+	
+	# Insert the new investor
+	params = {
+		"investor_id": new_investor_id,
+		"company_name": company_name
+	}
+	run_query(g.conn, 'insert_investor', params)
+	
+	# Now create a portfolio for this investor
+	# Allocate the new portfolio_id (format: PORT###, e.g., PORT014) from its sequence
+	new_portfolio_id = portfolio_ids.next_id(g.conn)
+	
+	# Get the current date from the system, or use default if not available
+	try:
+		creation_date = date.today().strftime('%Y-%m-%d')
+	except:
+		creation_date = '2025-11-12'
+	
+	# Insert the new portfolio with initial total_value of 0 and current date
+	run_query(g.conn, 'insert_portfolio', {
+		"portfolio_id": new_portfolio_id,
+		"investor_id": new_investor_id,
+		"total_value": 0,
+		"creation_date": creation_date
+	})
+	
+	g.conn.commit()
+	invalidate_reference_data(g.conn, 'investors')
+	invalidate_responses(g.conn, 'investor', 'portfolio')
+	
+	# Redirect with confirmation message including portfolio info
+	return redirect(f'/new_investor?confirmation=success&investor_id={new_investor_id}&company_name={company_name}&portfolio_id={new_portfolio_id}')
+
+
+@app.route('/update_investor', methods=['POST'])
+def update_investor():
+	"""
+	Update an investor's company name
+	"""
+	investor_id = request.form.get('investor_id', '').strip()
+	new_company_name = request.form.get('company_name', '').strip()
+	
+	# Validate inputs
+	if not investor_id or not new_company_name:
+		return redirect('/manage_investor?confirmation=error&message=Invalid input')
+	
+	# Update the investor
+	params = {
+		"investor_id": investor_id,
+		"company_name": new_company_name
+	}
+	run_query(g.conn, 'rename_investor', params)
+	g.conn.commit()
+	invalidate_reference_data(g.conn, 'investors')
+	invalidate_responses(g.conn, 'investor')
+	
+	# Redirect with success message
+	return redirect(f'/manage_investor?investor_id={investor_id}&confirmation=success&message=Company name updated successfully')
+
+
+# Tables delete_investors() writes to
+INVESTOR_TABLES = ('holdings', 'risk_metrics', 'portfolio', 'transaction', 'investor')
+
+
+def delete_investors(conn, investor_ids):
+	"""
+	Delete investors and everything that references them (holdings, risk metrics,
+	portfolios, transactions) with five set-based statements, however many
+	investors and portfolios are involved. Does not commit.
+	Returns the number of investors deleted.
+	"""
+	params = {"investor_ids": list(investor_ids)}
+
+	# Delete holdings and risk metrics of all their portfolios
+	run_query(conn, 'delete_investor_holdings', params)
+	run_query(conn, 'delete_investor_risk_metrics', params)
+
+	# Delete their portfolios and transactions
+	run_query(conn, 'delete_investor_portfolios', params)
+	run_query(conn, 'delete_investor_transactions', params)
+
+	# Finally, delete the investors
+	return run_query(conn, 'delete_investors', params).rowcount
+
+
+@app.route('/delete_investor', methods=['POST'])
+def delete_investor():
+	"""
+	Delete an investor and their associated portfolios
+	Several investor_id fields may be posted to delete many investors at once
+	"""
+	investor_ids = [investor_id.strip() for investor_id in request.form.getlist('investor_id') if investor_id.strip()]
+	
+	# Validate input
+	if not investor_ids:
+		return redirect('/manage_investor?confirmation=error&message=Invalid investor ID')
+	
+	try:
+		deleted = delete_investors(g.conn, investor_ids)
+		g.conn.commit()
+		invalidate_reference_data(g.conn, 'investors')
+		invalidate_responses(g.conn, *INVESTOR_TABLES)
+		
+		# Redirect with success message
+		if len(investor_ids) > 1:
+			return redirect(f'/manage_investor?confirmation=success&message={deleted} investors and associated data deleted successfully')
+		return redirect('/manage_investor?confirmation=success&message=Investor and associated data deleted successfully')
+	
+	except Exception as e:
+		g.conn.rollback()
+		app.logger.exception("Error deleting investors %s", investor_ids)
+		return redirect(f'/manage_investor?confirmation=error&message=Error deleting investor: {str(e)}')
+
+
+@app.route('/submit_holdings', methods=['POST'])
+def submit_holdings():
+	"""
+	Add new holdings to a portfolio
+	"""
+	investor_id = request.form.get('investor_id', '').strip()
+	portfolio_id = request.form.get('portfolio_id', '').strip()
+	stock_id = request.form.get('stock_id', '').strip()
+	average_price = request.form.get('average_price', '').strip()
+	holding_count = request.form.get('holding_count', '').strip()
+	
+	# Validate all required fields are present
+	if not all([investor_id, portfolio_id, stock_id, average_price, holding_count]):
+		return redirect(f'/add_holdings?investor_id={investor_id}&confirmation=error&message=All fields are required')
+	
+	# Validate and convert average_price to float
+	try:
+		average_price_float = float(average_price)
+	except ValueError:
+		return redirect(f'/add_holdings?investor_id={investor_id}&confirmation=error&message=Average price must be a numeric value')
+	
+	# Validate and convert holding_count to int (round down if float)
+	try:
+		holding_count_float = float(holding_count)
+		holding_count_int = int(holding_count_float)  # This rounds down automatically
+	except ValueError:
+		return redirect(f'/add_holdings?investor_id={investor_id}&confirmation=error&message=Holding count must be a numeric value')
+	
+	# Check if this holding already exists (stock_id, portfolio_id is primary key)
+	exists = run_query(g.conn, 'holding', {"stock_id": stock_id, "portfolio_id": portfolio_id}).first() is not None
+	
+	if exists:
+		return redirect(f'/add_holdings?investor_id={investor_id}&confirmation=error&message=This stock already exists in the selected portfolio')
+	
+	try:
+		# Get the most current stock price for the selected stock
+		current_stock_price = latest_price(g.conn, stock_id)
+		
+		if current_stock_price is None:
+			return redirect(f'/add_holdings?investor_id={investor_id}&confirmation=error&message=No price data found for selected stock')
+		
+		# Calculate the value to add to portfolio: holding_count * current_stock_price
+		value_to_add = holding_count_int * current_stock_price
+		
+		# Insert the new holding
+		run_query(g.conn, 'insert_holding', {
+			"stock_id": stock_id,
+			"portfolio_id": portfolio_id,
+			"average_price": average_price_float,
+			"holding_count": holding_count_int
+		})
+		
+		# Update the portfolio's total_value by adding the new holding value
+		run_query(g.conn, 'add_portfolio_value', {
+			"value_to_add": value_to_add,
+			"portfolio_id": portfolio_id
+		})
+		
+		g.conn.commit()
+		invalidate_responses(g.conn, 'holdings', 'portfolio')
+		
+		# Redirect with success message including the added value
+		return redirect(f'/add_holdings?investor_id={investor_id}&confirmation=success&message=Holdings added successfully! Portfolio value increased by ${value_to_add:.2f}')
+	
+	except Exception as e:
+		g.conn.rollback()
+		app.logger.exception("Error adding holdings for %s", investor_id)
+		return redirect(f'/add_holdings?investor_id={investor_id}&confirmation=error&message=Error adding holdings: {str(e)}')
+
+
+@app.route('/add_transactions', methods=['GET'])
+def add_transactions():
+	"""
+	Page for adding new transactions
+	"""
+	# Investors and stocks are searched as the user types (/api/search/...)
+	
+	# Get confirmation messages
+	confirmation = request.args.get('confirmation', '')
+	message = request.args.get('message', '')
+	
+	context = dict(
+		confirmation=confirmation,
+		message=message
+	)
+	return render_template("add_transactions.html", **context)
+
+
+@app.route('/check_holdings', methods=['GET'])
+def check_holdings():
+	"""
+	API endpoint to check if an investor has holdings for a specific stock
+	Returns JSON with holdings information
+	"""
+	investor_id = request.args.get('investor_id', '')
+	stock_id = request.args.get('stock_id', '')
+	
+	if not investor_id or not stock_id:
+		return {'has_holdings': False, 'holding_count': 0, 'average_price': 0}
+	
+	try:
+		# Find the investor's portfolio
+		cursor = run_query(g.conn, 'current_portfolio', {"investor_id": investor_id})
+		portfolio = cursor.fetchone()
+		cursor.close()
+		
+		if not portfolio:
+			return {'has_holdings': False, 'holding_count': 0, 'average_price': 0}
+		
+		portfolio_id = portfolio[0]
+		
+		# Check holdings
+		cursor = run_query(g.conn, 'holding', {
+			"stock_id": stock_id,
+			"portfolio_id": portfolio_id
+		})
+		holding = cursor.fetchone()
+		cursor.close()
+		
+		if holding and holding[0] > 0:
+			return {
+				'has_holdings': True,
+				'holding_count': holding[0],
+				'average_price': float(holding[1])
+			}
+		else:
+			return {'has_holdings': False, 'holding_count': 0, 'average_price': 0}
+	
+	except Exception as e:
+		app.logger.exception("Error checking holdings")
+		return {'has_holdings': False, 'holding_count': 0, 'average_price': 0}
+
+
+@app.route('/api/search/investors', methods=['GET'])
+def search_investors():
+	"""
+	API endpoint for investor typeahead: prefix search on company name (any word) and investor ID
+	Returns JSON with up to ?limit= ranked results
+	"""
+	index = search_index('investors', investor_options(g.conn), investor_terms)
+	results = index.search(request.args.get('q', ''), search_limit())
+	return {'results': results}
+
+
+@app.route('/api/search/stocks', methods=['GET'])
+def search_stocks():
+	"""
+	API endpoint for stock typeahead: prefix search on ticker and stock ID
+	Returns JSON with up to ?limit= ranked results, each with its latest price
+	"""
+	index = search_index('stocks', stock_options(g.conn), stock_terms)
+	results = index.search(request.args.get('q', ''), search_limit())
+	if results:
+		prices = latest_prices(g.conn, [stock['stock_id'] for stock in results])
+		results = [dict(stock, latest_price=prices[stock['stock_id']] or 0.0) for stock in results]
+	return {'results': results}
+
+
+@app.route('/pool_stats', methods=['GET'])
+def pool_stats_route():
+	"""
+	API endpoint reporting connection pool settings, current usage and counters
+	Returns JSON
+	"""
+	return pool_snapshot()
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+	"""
+	Per-endpoint request, query and template timings plus pool counters
+	Returns Prometheus text format
+	"""
+	return Response(prometheus_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+# Messages for the statuses execute_transaction() reports instead of recording an order
+TRANSACTION_STATUS_MESSAGES = {
+	'no_price': "No price data found for selected stock",
+	'no_portfolio': "This investor does not have a portfolio. Please create a portfolio first.",
+	'not_owned': "Cannot sell {stock_id} - You don't own this stock in your portfolio.",
+	'insufficient_shares': "Cannot sell {unit_number} shares - You only have {available} shares available",
+}
+
+
+@app.route('/submit_transaction', methods=['POST'])
+def submit_transaction():
+	"""
+	Submit a new transaction to the database
+	"""
+	investor_id = request.form.get('investor_id', '').strip()
+	stock_id = request.form.get('stock_id', '').strip()
+	transaction_type = request.form.get('transaction_type', '').strip()
+	unit_number = request.form.get('unit_number', '').strip()
+	
+	# Validate all required fields are present
+	if not all([investor_id, stock_id, transaction_type, unit_number]):
+		return redirect('/add_transactions?confirmation=error&message=All fields are required')
+	
+	# Validate transaction type is either 'buy' or 'sell'
+	if transaction_type not in ['buy', 'sell']:
+		return redirect('/add_transactions?confirmation=error&message=Transaction type must be buy or sell')
+	
+	# Validate and convert unit_number to int
+	try:
+		# First check if it's a valid number
+		unit_number_float = float(unit_number)
+		unit_number_int = int(unit_number_float)
+		
+		# Check if the original value was actually an integer (no decimal part)
+		if unit_number_float != unit_number_int:
+			return redirect('/add_transactions?confirmation=error&message=Unit number must be a whole number (no decimals)')
+		
+		if unit_number_int < 1:
+			raise ValueError("Unit number must be positive")
+		if unit_number_int > 1000000:
+			raise ValueError("Unit number exceeds maximum")
+	except ValueError as ve:
+		if "exceeds maximum" in str(ve):
+			return redirect('/add_transactions?confirmation=error&message=Unit number cannot exceed 1,000,000 shares per transaction')
+		elif "invalid literal" in str(ve) or "could not convert" in str(ve):
+			return redirect('/add_transactions?confirmation=error&message=Unit number must be a valid number')
+		else:
+			return redirect('/add_transactions?confirmation=error&message=Unit number must be a positive integer between 1 and 1,000,000')
+	
+	# Get current timestamp, or use fallback date
+	try:
+		transaction_time = datetime.now()
+	except:
+		# Fallback to Nov 19, 2025 8:15 PM
+		transaction_time = datetime(2025, 11, 19, 20, 15, 0)
+	
+	try:
+		# Price lookup, ownership check and insert in one round trip (sql/execute_transaction.sql)
+		status, unit_price, available = run_query(g.conn, 'execute_transaction', {
+			"investor_id": investor_id,
+			"stock_id": stock_id,
+			"transaction_type": transaction_type,
+			"unit_number": unit_number_int,
+			"transaction_time": transaction_time
+		}).one()
+		
+		if status != 'ok':
+			g.conn.rollback()
+			error_message = TRANSACTION_STATUS_MESSAGES[status].format(
+				stock_id=stock_id, unit_number=unit_number_int, available=available)
+			return redirect(f'/add_transactions?confirmation=error&code={status}&message={error_message}')
+		
+		g.conn.commit()
+		invalidate_responses(g.conn, *TRANSACTION_TABLES)
+		
+		# Calculate transaction value
+		unit_price = float(unit_price)
+		transaction_value = unit_price * unit_number_int
+		
+		# Redirect with success message
+		return redirect(f'/add_transactions?confirmation=success&message=Transaction recorded successfully! {transaction_type.upper()} {unit_number_int} shares at ${unit_price:.2f} (Total: ${transaction_value:.2f})')
+	
+	except Exception as e:
+		g.conn.rollback()
+		app.logger.exception("Error recording transaction for %s", investor_id)
+		return redirect(f'/add_transactions?confirmation=error&message=Transaction failed: {str(e)}')
+
+
+#
+# Batch transaction submission.
+#
+# Batches are JSON lines (one object per line) or CSV with a header row, with the
+# fields investor_id, stock_id, transaction_type, unit_number and optionally
+# unit_price (defaults to the latest price) and transaction_time (ISO 8601,
+# defaults to now). Records are validated and inserted TRANSACTION_BATCH_ROWS at
+# a time, each chunk with one INSERT ... SELECT FROM unnest(...) statement, so
+# the statement-level trigger in sql/transaction_trigger.sql updates holdings
+# and portfolio totals once per chunk. A batch is all-or-nothing: if any record
+# is invalid or any sell is not covered, nothing is recorded. Sells are checked
+# against the holdings and the batch's earlier trades before inserting, so the
+# offending line is reported; the trigger's own check only catches trades made
+# by others in the meantime.
+#
+TRANSACTION_BATCH_ROWS = int(os.environ.get('ESGTRADER_TRANSACTION_BATCH_ROWS', 10000))
+MAX_UNITS_PER_TRANSACTION = 1000000
+
+# Tables a recorded transaction writes to, directly or through the holdings trigger
+TRANSACTION_TABLES = ('transaction', 'holdings', 'portfolio')
+
+
+def read_transaction_records(lines, fmt):
+	"""
+	Yield (line_number, record) for each record of a JSON lines or CSV batch.
+	record is None when a JSON line cannot be parsed.
+	"""
+	if fmt == 'csv':
+		reader = csv.DictReader(lines)
+		for record in reader:
+			yield reader.line_num, record
+		return
+
+	for line_number, line in enumerate(lines, 1):
+		line = line.strip()
+		if not line:
+			continue
+		try:
+			record = json.loads(line)
+		except ValueError:
+			record = None
+		yield line_number, record
+
+
+def parse_transaction_record(record, default_time):
+	"""
+	Check one batch record with the same rules as /submit_transaction.
+	Returns (row, None) where row is
+	(investor_id, stock_id, transaction_time, transaction_type, unit_price, unit_number)
+	with unit_price None when it should be the latest price, or (None, error message).
+	"""
+	if not isinstance(record, dict):
+		return None, "Record is not a valid JSON object"
+
+	investor_id = str(record.get('investor_id') or '').strip()
+	stock_id = str(record.get('stock_id') or '').strip()
+	transaction_type = str(record.get('transaction_type') or '').strip()
+	if not investor_id or not stock_id:
+		return None, "investor_id and stock_id are required"
+	if transaction_type not in ['buy', 'sell']:
+		return None, "Transaction type must be buy or sell"
+
+	try:
+		unit_number_float = float(record.get('unit_number'))
+	except (TypeError, ValueError):
+		return None, "Unit number must be a valid number"
+	unit_number = int(unit_number_float)
+	if unit_number_float != unit_number or unit_number < 1 or unit_number > MAX_UNITS_PER_TRANSACTION:
+		return None, "Unit number must be a positive integer between 1 and 1,000,000"
+
+	unit_price = record.get('unit_price')
+	if unit_price in (None, ''):
+		unit_price = None
+	else:
+		try:
+			unit_price = float(unit_price)
+		except (TypeError, ValueError):
+			return None, "Unit price must be a numeric value"
+		if unit_price <= 0:
+			return None, "Unit price must be positive"
+
+	transaction_time = record.get('transaction_time')
+	if transaction_time in (None, ''):
+		transaction_time = default_time
+	else:
+		try:
+			transaction_time = datetime.fromisoformat(str(transaction_time))
+		except ValueError:
+			return None, "Transaction time must be an ISO 8601 timestamp"
+
+	return (investor_id, stock_id, transaction_time, transaction_type, unit_price, unit_number), None
+
+
+def existing_ids(conn, table, column, ids):
+	"""
+	Return the subset of ids present in table.column, in one query
+	"""
+	select_query = f"SELECT {column} FROM {table} WHERE {column} = ANY(:ids)"
+	cursor = conn.execute(text(select_query), {"ids": list(ids)})
+	found = set(row[0] for row in cursor)
+	cursor.close()
+	return found
+
+
+def insert_transaction_chunk(conn, rows):
+	"""
+	Insert validated rows with a single statement
+	"""
+	columns = list(zip(*rows))
+	run_query(conn, 'insert_transactions', {
+		"investor_ids": list(columns[0]),
+		"stock_ids": list(columns[1]),
+		"transaction_times": list(columns[2]),
+		"transaction_types": list(columns[3]),
+		"unit_prices": list(columns[4]),
+		"unit_numbers": list(columns[5])
+	})
+
+
+def process_transaction_chunk(conn, chunk, apply, positions):
+	"""
+	Validate a chunk of (line_number, row) pairs against the database and, when
+	apply is set and the chunk is valid, insert it. positions maps each
+	(investor_id, stock_id) seen so far in the batch to
+	[portfolio_id, holding_count, shares after the batch's trades], and is
+	updated with this chunk's. Returns a list of errors.
+	"""
+	errors = []
+	investors = existing_ids(conn, 'investor', 'investor_id', set(row[0] for _, row in chunk))
+	stocks = existing_ids(conn, 'stock', 'stock_id', set(row[1] for _, row in chunk))
+
+	# Fill in the latest price where none was given, with one lookup for the chunk
+	unpriced = set(row[1] for _, row in chunk if row[4] is None)
+	prices = {}
+	if unpriced:
+		cursor = run_query(conn, 'latest_prices_of', {"stock_ids": list(unpriced)})
+		prices = dict((row[0], float(row[1])) for row in cursor if row[1] is not None)
+		cursor.close()
+
+	rows = []
+	for line_number, row in chunk:
+		investor_id, stock_id, transaction_time, transaction_type, unit_price, unit_number = row
+		if investor_id not in investors:
+			errors.append({'line': line_number, 'message': f"Unknown investor {investor_id}"})
+		elif stock_id not in stocks:
+			errors.append({'line': line_number, 'message': f"Unknown stock {stock_id}"})
+		elif unit_price is None and stock_id not in prices:
+			errors.append({'line': line_number, 'message': f"No price data found for {stock_id}"})
+		else:
+			if unit_price is None:
+				unit_price = prices[stock_id]
+			rows.append((line_number, (investor_id, stock_id, transaction_time, transaction_type, unit_price, unit_number)))
+
+	# Look up the positions the batch has not touched yet, with one query for the chunk
+	new_positions = list(dict.fromkeys((row[0], row[1]) for _, row in rows if (row[0], row[1]) not in positions))
+	if new_positions:
+		cursor = run_query(conn, 'batch_positions', {
+			"investor_ids": [investor_id for investor_id, _ in new_positions],
+			"stock_ids": [stock_id for _, stock_id in new_positions]
+		})
+		for investor_id, stock_id, portfolio_id, holding_count in cursor:
+			positions[(investor_id, stock_id)] = [portfolio_id, holding_count, holding_count or 0]
+		cursor.close()
+
+	# Walk the trades in time order, as the holdings trigger applies them
+	# (Postgres stores transaction_time without its UTC offset)
+	for line_number, row in sorted(rows, key=lambda item: item[1][2].replace(tzinfo=None)):
+		investor_id, stock_id, transaction_time, transaction_type, unit_price, unit_number = row
+		position = positions[(investor_id, stock_id)]
+		portfolio_id, holding_count, shares = position
+		if portfolio_id is None:
+			message = TRANSACTION_STATUS_MESSAGES['no_portfolio']
+		elif transaction_type == 'buy':
+			position[2] = shares + unit_number
+			continue
+		elif holding_count is None and shares == 0:
+			message = TRANSACTION_STATUS_MESSAGES['not_owned'].format(stock_id=stock_id)
+		elif shares < unit_number:
+			message = TRANSACTION_STATUS_MESSAGES['insufficient_shares'].format(unit_number=unit_number, available=shares)
+		else:
+			position[2] = shares - unit_number
+			continue
+		errors.append({'line': line_number, 'message': message})
+
+	if apply and not errors and rows:
+		insert_transaction_chunk(conn, [row for _, row in rows])
+	return errors
+
+
+def process_transaction_batch(conn, records, chunk_rows=TRANSACTION_BATCH_ROWS):
+	"""
+	Validate and insert a stream of (line_number, record) pairs in one pass.
+	Returns (accepted, errors). Once an error is found the remaining records are
+	still validated but nothing more is inserted; the caller should then roll back.
+	Does not commit.
+	"""
+	# Records without a transaction_time get distinct, increasing timestamps
+	started = datetime.now()
+	accepted = 0
+	errors = []
+	chunk = []
+	positions = {}
+
+	def flush():
+		chunk_errors = process_transaction_chunk(conn, chunk, apply=not errors, positions=positions)
+		errors.extend(chunk_errors)
+		return len(chunk) if not chunk_errors else 0
+
+	for index, (line_number, record) in enumerate(records):
+		row, error = parse_transaction_record(record, started + timedelta(microseconds=index))
+		if error:
+			errors.append({'line': line_number, 'message': error})
+			continue
+		chunk.append((line_number, row))
+		if len(chunk) >= chunk_rows:
+			accepted += flush()
+			chunk = []
+	if chunk:
+		accepted += flush()
+
+	errors.sort(key=lambda error: error['line'])
+	return (0 if errors else accepted), errors
+
+
+@app.route('/submit_transactions_batch', methods=['POST'])
+def submit_transactions_batch():
+	"""
+	API endpoint to record many transactions at once
+	Accepts JSON lines or CSV (Content-Type: text/csv, or a .csv upload in the "file" field)
+	Returns JSON with the number of accepted transactions and any errors
+	"""
+	upload = request.files.get('file')
+	if upload:
+		fmt = 'csv' if upload.filename.lower().endswith('.csv') else 'jsonl'
+		stream = upload.stream
+	else:
+		fmt = 'csv' if 'csv' in (request.content_type or '') else 'jsonl'
+		stream = request.stream
+	if isinstance(stream, io.IOBase):
+		lines = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+	else:
+		# gunicorn hands the request body over as is, without the io interface
+		lines = codecs.getreader('utf-8')(stream)
+
+	try:
+		accepted, errors = process_transaction_batch(g.conn, read_transaction_records(lines, fmt))
+		if errors:
+			g.conn.rollback()
+			return {'accepted': 0, 'errors': errors}, 400
+		g.conn.commit()
+		invalidate_responses(g.conn, *TRANSACTION_TABLES)
+		return {'accepted': accepted, 'errors': []}
+	except exc.DBAPIError as e:
+		# Raised by the holdings trigger, e.g. a sell a concurrent trade left uncovered
+		g.conn.rollback()
+		return {'accepted': 0, 'errors': [{'line': None, 'message': str(e.orig).split('\n')[0]}]}, 400
+
+
+@app.route('/login')
+def login():
+	abort(401)
+	# Your IDE may highlight this as a problem - because no such function exists (intentionally).
+	# This code is never executed because of abort().
+	this_is_never_executed()
+
+
+#
+# Command line interface.
+#
+# `python server.py` (optionally with --debug/--threaded HOST PORT) still starts
+# the development server and `python server.py serve` the production one; the
+# other commands are maintenance tasks run against the same database, e.g.
+# `python server.py ingest stock_price prices.csv`.
+#
+class DefaultCommandGroup(click.Group):
+	"""
+	Click group that falls back to the `run` command when no subcommand is named
+	"""
+
+	def parse_args(self, ctx, args):
+		if not args or (args[0] not in self.commands and args[0] != '--help'):
+			args = ['run'] + list(args)
+		return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultCommandGroup)
+def cli():
+	"""
+	ESGTrader web server and maintenance commands
+	"""
+
+
+@cli.command()
+@click.option('--debug', is_flag=True)
+@click.option('--threaded', is_flag=True)
+@click.option('--warmup/--no-warmup', default=WARMUP, help='Open pool connections and fill caches before serving')
+@click.argument('HOST', default='0.0.0.0')
+@click.argument('PORT', default=8111, type=int)
+def run(debug, threaded, warmup, host, port):
+	"""
+	This function handles command line parameters.
+	Run the server using:
+
+		python server.py
+
+	Show the help text using:
+
+		python server.py run --help
+
+	"""
+
+	HOST, PORT = host, port
+	create_app(warmup=warmup)
+	print("running on %s:%d" % (HOST, PORT))
+	app.run(host=HOST, port=PORT, debug=debug, threaded=threaded)
+
+
+#
+# Production serving.
+#
+# `python server.py serve` runs the app under gunicorn (pip install gunicorn)
+# with several worker processes, each handling requests on a pool of threads.
+# The app is imported once in the master and forked into the workers, so every
+# worker drops the pool connections it inherited and opens its own; sharing a
+# socket between processes would interleave their protocol traffic.
+#
+# Send the master SIGHUP to reload: new workers are started and old ones finish
+# their in-flight requests (up to --graceful-timeout seconds) before exiting.
+#
+def post_fork(server, worker):
+	"""
+	Give a freshly forked worker its own connection pool and metrics
+	"""
+	# close=False leaves the parent's sockets alone; the worker just forgets them
+	if engine is not None:
+		engine.dispose(close=False)
+	with pool_stats_lock:
+		for name in pool_stats:
+			pool_stats[name] = 0
+	start_refdata_listener()
+
+
+@cli.command()
+@click.argument('HOST', default='0.0.0.0')
+@click.argument('PORT', default=8111, type=int)
+@click.option('--workers', default=(os.cpu_count() or 1) * 2 + 1, show_default='2 x CPUs + 1', help='Worker processes')
+@click.option('--threads', default=4, show_default=True, help='Request threads per worker')
+@click.option('--keep-alive', default=5, show_default=True, help='Seconds to hold an idle keep-alive connection open')
+@click.option('--timeout', default=30, show_default=True, help='Seconds a worker may spend on one request before it is restarted')
+@click.option('--graceful-timeout', default=30, show_default=True, help='Seconds old workers get to finish their requests on reload or shutdown')
+@click.option('--max-requests', default=0, show_default=True, help='Recycle a worker after this many requests (0 disables)')
+@click.option('--max-requests-jitter', default=0, show_default=True, help='Random extra requests added to --max-requests per worker')
+@click.option('--warmup/--no-warmup', default=WARMUP, help='Have each worker open pool connections and fill caches before taking requests')
+def serve(host, port, workers, threads, keep_alive, timeout, graceful_timeout, max_requests, max_requests_jitter, warmup):
+	"""
+	Run the server with multiple worker processes under gunicorn
+	"""
+	try:
+		from gunicorn.app.base import BaseApplication
+	except ImportError:
+		raise click.UsageError("serve needs gunicorn: pip install gunicorn")
+
+	options = {
+		'bind': f"{host}:{port}",
+		'workers': workers,
+		'threads': threads,
+		'worker_class': 'gthread' if threads > 1 else 'sync',
+		'keepalive': keep_alive,
+		'timeout': timeout,
+		'graceful_timeout': graceful_timeout,
+		'max_requests': max_requests,
+		'max_requests_jitter': max_requests_jitter,
+		'post_fork': post_fork,
+	}
+	if warmup:
+		# Runs in each worker after it has loaded the app and before it accepts connections
+		options['post_worker_init'] = lambda worker: warm_up()
+
+	class ESGTraderApplication(BaseApplication):
+		def load_config(self):
+			for key, value in options.items():
+				self.cfg.set(key, value)
+
+		def load(self):
+			return create_app(warmup=False)
+
+	if threads > POOL_SIZE + POOL_MAX_OVERFLOW:
+		print(f"warning: {threads} threads per worker but only {POOL_SIZE + POOL_MAX_OVERFLOW} pooled connections; raise ESGTRADER_POOL_SIZE")
+	print("serving on %s:%d with %d workers x %d threads" % (host, port, workers, threads))
+	ESGTraderApplication().run()
+
+
+#
+# Async order API.
+#
+# `python server.py serve-orders` runs a JSON order entry API for automated
+# clients on asyncio (pip install aiohttp asyncpg), separately from the Flask
+# app. One event loop serves thousands of concurrent connections, and each order
+# holds a database connection from an asyncpg pool only while it runs queries,
+# so in-flight orders beyond ORDER_API_POOL_SIZE wait for a connection rather
+# than a thread.
+#
+#     POST /api/orders
+#     {"orders": [{"investor_id": "INV001", "stock_id": "S001", "transaction_type": "buy", "unit_number": 10}, ...]}
+#
+# (a single leg may also be posted on its own). Legs follow the /submit_transaction
+# rules and execute at the latest price. An order is all-or-nothing: the price,
+# portfolio and holding of every position it touches are looked up concurrently
+# first, so a rejected order reports every failing leg without taking any locks,
+# then the legs are recorded in one transaction through execute_transaction(),
+# which re-checks each sell under a row lock. Every leg gets a status: 'ok' or
+# one of the execute_transaction() codes, or 'invalid' for a malformed leg.
+# The response status is 200 (executed), 400 (invalid legs), 422 (rejected),
+# 503 (no database connection within ORDER_API_ACQUIRE_TIMEOUT seconds) or 500
+# (a database error).
+#
+ORDER_API_POOL_SIZE = int(os.environ.get('ESGTRADER_ORDER_API_POOL_SIZE', 20))
+ORDER_API_ACQUIRE_TIMEOUT = float(os.environ.get('ESGTRADER_ORDER_API_ACQUIRE_TIMEOUT', 10))
+ORDER_API_MAX_LEGS = 100
+
+
+def parse_order(payload, order_time):
+	"""
+	Legs of a posted order as (leg dicts, any invalid). Each leg's transaction_time
+	is order_time plus its index in microseconds, so legs on the same position
+	keep distinct keys.
+	"""
+	records = payload.get('orders') if isinstance(payload, dict) and 'orders' in payload else [payload]
+	if not isinstance(records, list) or not records:
+		return [dict(status='invalid', message="orders must be a non-empty list")], True
+	if len(records) > ORDER_API_MAX_LEGS:
+		return [dict(status='invalid', message=f"An order has at most {ORDER_API_MAX_LEGS} legs")], True
+
+	legs = []
+	for index, record in enumerate(records):
+		row, error = parse_transaction_record(record, order_time + timedelta(microseconds=index))
+		if error is None and (record.get('unit_price') not in (None, '') or record.get('transaction_time') not in (None, '')):
+			error = "Orders execute at the latest price and the current time"
+		if error is not None:
+			legs.append(dict(status='invalid', message=error))
+			continue
+		investor_id, stock_id, transaction_time, transaction_type, unit_price, unit_number = row
+		legs.append(dict(investor_id=investor_id, stock_id=stock_id, transaction_type=transaction_type,
+			unit_number=unit_number, transaction_time=transaction_time, status='ok'))
+	return legs, any(leg['status'] == 'invalid' for leg in legs)
+
+
+async def lookup_position(pool, investor_id, stock_id):
+	"""
+	(latest price, most recent portfolio_id, holding count) for one position; any may be None
+	"""
+	position_query = """
+		SELECT lp.daily_price, p.portfolio_id, h.holding_count
+		FROM (SELECT 1) one
+		LEFT JOIN latest_stock_price lp ON lp.stock_id = $2
+		LEFT JOIN LATERAL (
+			SELECT portfolio_id FROM portfolio
+			WHERE investor_id = $1
+			ORDER BY creation_date DESC
+			LIMIT 1
+		) p ON true
+		LEFT JOIN holdings h ON h.portfolio_id = p.portfolio_id AND h.stock_id = $2
+	"""
+	async with pool.acquire(timeout=ORDER_API_ACQUIRE_TIMEOUT) as conn:
+		return tuple(await conn.fetchrow(position_query, investor_id, stock_id))
+
+
+async def check_order(pool, legs):
+	"""
+	Look up every position the order touches concurrently and set each leg's
+	status as execute_transaction() would, counting earlier sells of the same
+	position in the order. Returns True if every leg can execute.
+	"""
+	import asyncio
+	keys = list(dict.fromkeys((leg['investor_id'], leg['stock_id']) for leg in legs))
+	positions = dict(zip(keys, await asyncio.gather(*(lookup_position(pool, *key) for key in keys))))
+
+	available = {}
+	for leg in legs:
+		key = (leg['investor_id'], leg['stock_id'])
+		price, portfolio_id, holding_count = positions[key]
+		shares = available.setdefault(key, holding_count or 0)
+		if price is None:
+			leg['status'] = 'no_price'
+		elif portfolio_id is None:
+			leg['status'] = 'no_portfolio'
+		elif leg['transaction_type'] == 'buy':
+			available[key] = shares + leg['unit_number']
+		elif holding_count is None and shares == 0:
+			leg['status'] = 'not_owned'
+		elif shares < leg['unit_number']:
+			leg['status'], leg['available'] = 'insufficient_shares', shares
+		else:
+			available[key] = shares - leg['unit_number']
+		if price is not None:
+			leg['unit_price'] = float(price)
+	return all(leg['status'] == 'ok' for leg in legs)
+
+
+async def execute_order(pool, legs):
+	"""
+	Record every leg in one transaction. Returns True if all were recorded; otherwise
+	nothing is, and the first leg that failed its locked re-check has its status set.
+	"""
+	execute_query = "SELECT status, unit_price, available FROM execute_transaction($1, $2, $3, $4, $5)"
+	async with pool.acquire(timeout=ORDER_API_ACQUIRE_TIMEOUT) as conn:
+		transaction = conn.transaction()
+		await transaction.start()
+		try:
+			for leg in legs:
+				status, unit_price, available = await conn.fetchrow(execute_query, leg['investor_id'],
+					leg['stock_id'], leg['transaction_type'], leg['unit_number'], leg['transaction_time'])
+				leg['status'] = status
+				if status != 'ok':
+					leg['available'] = available
+					await transaction.rollback()
+					return False
+				leg['unit_price'] = float(unit_price)
+			if REFDATA_LISTEN:
+				# Delivered on commit: the Flask workers drop their cached pages
+				await conn.execute("SELECT pg_notify($1, $2)", RESPONSE_CHANNEL, ','.join(TRANSACTION_TABLES))
+		except:
+			await transaction.rollback()
+			raise
+		await transaction.commit()
+	return True
+
+
+def order_result(legs, executed=False):
+	"""
+	JSON-ready legs: messages for failed legs, values for executed ones
+	"""
+	results = []
+	for leg in legs:
+		result = {key: value for key, value in leg.items() if key != 'transaction_time'}
+		if leg['status'] in TRANSACTION_STATUS_MESSAGES:
+			result['message'] = TRANSACTION_STATUS_MESSAGES[leg['status']].format(
+				stock_id=leg['stock_id'], unit_number=leg['unit_number'], available=leg.get('available'))
+		elif executed:
+			result['value'] = round(leg['unit_price'] * leg['unit_number'], 2)
+		results.append(result)
+	return results
+
+
+def order_api(web, asyncpg, database_uri, pool_size):
+	"""
+	aiohttp application serving POST /api/orders from an asyncpg pool
+	"""
+	import asyncio
+
+	async def open_pool(application):
+		application['pool'] = await asyncpg.create_pool(database_uri, min_size=min(pool_size, 5), max_size=pool_size)
+
+	async def close_pool(application):
+		await application['pool'].close()
+
+	async def post_orders(request):
+		try:
+			payload = await request.json()
+		except ValueError:
+			return web.json_response({'status': 'invalid', 'legs': [dict(status='invalid', message="Body is not valid JSON")]}, status=400)
+		legs, invalid = parse_order(payload, datetime.now())
+		if invalid:
+			return web.json_response({'status': 'invalid', 'legs': legs}, status=400)
+
+		pool = request.app['pool']
+		try:
+			executed = await check_order(pool, legs) and await execute_order(pool, legs)
+		except asyncio.TimeoutError:
+			return web.json_response({'status': 'unavailable', 'legs': order_result(legs)}, status=503)
+		except asyncpg.PostgresError as e:
+			app.logger.exception("Error executing order")
+			return web.json_response({'status': 'error', 'message': str(e).split('\n')[0], 'legs': order_result(legs)}, status=500)
+		if not executed:
+			return web.json_response({'status': 'rejected', 'legs': order_result(legs)}, status=422)
+		return web.json_response({'status': 'executed', 'legs': order_result(legs, executed=True)})
+
+	application = web.Application(client_max_size=1024 * 1024)
+	application.router.add_post('/api/orders', post_orders)
+	application.on_startup.append(open_pool)
+	application.on_cleanup.append(close_pool)
+	return application
+
+
+@cli.command('serve-orders')
+@click.option('--pool-size', default=ORDER_API_POOL_SIZE, show_default=True, type=click.IntRange(1), help='Database connections shared by all in-flight orders')
+@click.option('--backlog', default=2048, show_default=True, help='Pending TCP connections queued by the kernel')
+@click.argument('HOST', default='0.0.0.0')
+@click.argument('PORT', default=8112, type=int)
+def serve_orders(pool_size, backlog, host, port):
+	"""
+	Run the async JSON order API (POST /api/orders)
+	"""
+	try:
+		from aiohttp import web
+		import asyncpg
+	except ImportError:
+		raise click.UsageError("serve-orders needs aiohttp and asyncpg: pip install aiohttp asyncpg")
+
+	# asyncpg takes a plain libpq URI, without SQLAlchemy's +driver suffix
+	database_uri = make_url(DATABASEURI).set(drivername='postgresql').render_as_string(hide_password=False)
+	print("serving orders on %s:%d with %d connections" % (host, port, pool_size))
+	web.run_app(order_api(web, asyncpg, database_uri, pool_size), host=host, port=port, backlog=backlog, print=None)
+
+
+#
+# Schema setup.
+#
+# `python server.py migrate` brings the database up to date in two steps:
+#
+#   1. Versioned migrations in migrations/, named NNNN_description.sql, are each
+#      applied once, in version order, and recorded in schema_migrations. A file
+#      whose first line is `-- migrate: no-transaction` (needed for CREATE INDEX
+#      CONCURRENTLY) is run one statement at a time in autocommit mode, split on
+#      semicolons that end a line, so it must not contain function bodies.
+#      Everything else runs in one transaction together with its bookkeeping row.
+#   2. The triggers, helper tables, views and sequences in sql/ are re-applied
+#      in MIGRATIONS order, each script in its own transaction. Every one of
+#      those scripts is safe to re-run.
+#
+SQL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sql')
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+MIGRATIONS = [
+	'transaction_trigger.sql',
+	'latest_stock_price.sql',
+	'execute_transaction.sql',
+	'id_sequences.sql',
+	'pnl_engine.sql',
+	'esg_portfolio_ranking.sql',
+]
+NO_TRANSACTION_MARKER = '-- migrate: no-transaction'
+
+
+def versioned_migrations():
+	"""
+	[(version, filename)] for migrations/NNNN_*.sql, in version order
+	"""
+	found = []
+	for filename in os.listdir(MIGRATIONS_DIR) if os.path.isdir(MIGRATIONS_DIR) else []:
+		version, _, rest = filename.partition('_')
+		if filename.endswith('.sql') and version.isdigit() and rest:
+			found.append((int(version), filename))
+	return sorted(found)
+
+
+def applied_migrations(conn):
+	"""
+	{version: applied_at} from schema_migrations, creating the table if needed
+	"""
+	conn.execute(text("""
+		CREATE TABLE IF NOT EXISTS schema_migrations (
+			version INTEGER PRIMARY KEY,
+			filename TEXT NOT NULL,
+			applied_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+			duration_ms NUMERIC
+		)
+	"""))
+	conn.commit()
+	applied = dict(conn.execute(text("SELECT version, applied_at FROM schema_migrations")).fetchall())
+	conn.rollback()
+	return applied
+
+
+def apply_versioned_migration(conn, version, filename):
 	"""
-	Submit a new transaction to the database
+	Run one migrations/ file and record it in schema_migrations
 	"""
-	investor_id = request.form.get('investor_id', '').strip()
-	stock_id = request.form.get('stock_id', '').strip()
-	transaction_type = request.form.get('transaction_type', '').strip()
-	unit_number = request.form.get('unit_number', '').strip()
-	
-	# Validate all required fields are present
-	if not all([investor_id, stock_id, transaction_type, unit_number]):
-		return redirect('/add_transactions?confirmation=error&message=All fields are required')
-	
-	# Validate transaction type is either 'buy' or 'sell'
-	if transaction_type not in ['buy', 'sell']:
-		return redirect('/add_transactions?confirmation=error&message=Transaction type must be buy or sell')
-	
-	# Validate and convert unit_number to int
+	with open(os.path.join(MIGRATIONS_DIR, filename)) as f:
+		script = f.read()
+	record = text("INSERT INTO schema_migrations (version, filename, duration_ms) VALUES (:version, :filename, :duration_ms)")
+	started = time.perf_counter()
+
+	# The SQL goes to psycopg2 as is, so colons and $$ bodies are left alone
+	if script.lstrip().startswith(NO_TRANSACTION_MARKER):
+		# A connection of its own, since the pool resets the isolation level when it is returned
+		with get_engine().connect() as autocommit:
+			autocommit.execution_options(isolation_level='AUTOCOMMIT')
+			for statement in script.split(';\n'):
+				if any(line.strip() and not line.strip().startswith('--') for line in statement.splitlines()):
+					autocommit.exec_driver_sql(statement)
+			# A failed CONCURRENTLY build leaves an invalid index that IF NOT EXISTS would then skip
+			invalid = autocommit.execute(text("SELECT indexrelid::regclass::text FROM pg_index WHERE NOT indisvalid")).scalars().all()
+			if invalid:
+				raise click.ClickException(f"{filename} left invalid indexes {', '.join(invalid)}; drop them and run migrate again")
+			autocommit.execute(record, {"version": version, "filename": filename, "duration_ms": round((time.perf_counter() - started) * 1000, 1)})
+	else:
+		with conn.begin():
+			# Without parameters psycopg2 leaves the % of format() calls alone too
+			cursor = conn.connection.cursor()
+			cursor.execute(script)
+			cursor.close()
+			conn.execute(record, {"version": version, "filename": filename, "duration_ms": round((time.perf_counter() - started) * 1000, 1)})
+	return time.perf_counter() - started
+
+
+@cli.command()
+@click.argument('SCRIPTS', nargs=-1, type=click.Choice(MIGRATIONS))
+@click.option('--status', is_flag=True, help='List versioned migrations and whether they have been applied, then exit')
+def migrate(scripts, status):
+	"""
+	Apply pending migrations/ and re-install the database objects from sql/
+	(only the named sql/ SCRIPTS if any are given)
+	"""
+	if not scripts:
+		with get_engine().connect() as conn:
+			applied = applied_migrations(conn)
+			for version, filename in versioned_migrations():
+				if status:
+					state = f"applied {applied[version]:%Y-%m-%d %H:%M}" if version in applied else "pending"
+					click.echo(f"{filename}: {state}")
+				elif version not in applied:
+					elapsed = apply_versioned_migration(conn, version, filename)
+					click.echo(f"{filename}: applied in {elapsed:.2f}s")
+		if status:
+			return
+
+	for name in scripts or MIGRATIONS:
+		with open(os.path.join(SQL_DIR, name)) as f:
+			script = f.read()
+		started = time.perf_counter()
+		# Run through the DBAPI cursor so the script's colons and $$ bodies reach Postgres untouched
+		raw_conn = get_engine().raw_connection()
+		try:
+			cursor = raw_conn.cursor()
+			cursor.execute(script)
+			cursor.close()
+			raw_conn.commit()
+		except:
+			raw_conn.rollback()
+			raise
+		finally:
+			raw_conn.close()
+		click.echo(f"{name}: applied in {time.perf_counter() - started:.2f}s")
+
+
+#
+# Time series partitions.
+#
+# migrations/0002 range-partitions stock_price by month and daily_macro_data by
+# year. `python server.py partitions`, run daily (e.g. from cron), creates the
+# partitions for the next --ahead periods, since rows dated past the last
+# partition are rejected; --from DATE also creates the missing partitions back
+# to DATE, for loading history. `ingest` creates the partitions its files need
+# before loading them. With --retain-months it also retires the partitions
+# holding only data from before the current month and the --retain-months
+# before it: detached and kept as standalone tables (re-attachable) by default,
+# written to --archive-dir as CSV and dropped, or just dropped with --drop.
+# latest_stock_price is left alone, so a stock keeps its last known price.
+#
+# table: (date column, period of a partition)
+PARTITIONED_TABLES = {
+	'stock_price': ('price_date', 'month'),
+	'daily_macro_data': ('macro_date', 'year'),
+}
+
+
+def add_months(day, months):
+	"""
+	The first day of the month months after day's month (before it if negative)
+	"""
+	index = day.year * 12 + day.month - 1 + months
+	return date(index // 12, index % 12 + 1, 1)
+
+
+def time_partitions(cursor, table):
+	"""
+	[(name, start, end)] for the partitions of table, oldest first
+	"""
+	cursor.execute("""
+		SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+		FROM pg_inherits i
+		JOIN pg_class c ON c.oid = i.inhrelid
+		WHERE i.inhparent = %s::regclass
+	""", (table,))
+	found = []
+	for name, bound in cursor.fetchall():
+		# FOR VALUES FROM ('2025-01-01') TO ('2025-02-01')
+		start, end = re.findall(r"'([^']*)'", bound)
+		found.append((name, date.fromisoformat(start), date.fromisoformat(end)))
+	return sorted(found, key=lambda partition: partition[1])
+
+
+def is_partitioned(cursor, table):
+	"""
+	Whether table has been partitioned by migrations/0002
+	"""
+	cursor.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass", (table,))
+	return cursor.fetchone()[0] == 'p'
+
+
+@cli.command()
+@click.option('--from', 'from_date', type=click.DateTime(formats=['%Y-%m-%d']), help='Also create the missing partitions back to this date')
+@click.option('--ahead', default=3, show_default=True, type=click.IntRange(min=0), help='Future months (years for daily_macro_data) to create partitions for')
+@click.option('--retain-months', type=click.IntRange(min=0), help='Retire partitions older than the current month and this many before it')
+@click.option('--archive-dir', type=click.Path(file_okay=False), help='Write retired partitions here as CSV, then drop them')
+@click.option('--drop', is_flag=True, help='Drop retired partitions instead of keeping them detached')
+@click.option('--dry-run', is_flag=True, help='Print what would be created and retired without changing anything')
+def partitions(from_date, ahead, retain_months, archive_dir, drop, dry_run):
+	"""
+	Create upcoming stock_price and daily_macro_data partitions and retire old ones
+	"""
+	if (archive_dir or drop) and retain_months is None:
+		raise click.UsageError("--archive-dir and --drop need --retain-months")
+	if archive_dir and not dry_run:
+		os.makedirs(archive_dir, exist_ok=True)
+
+	today = date.today()
+	cutoff = add_months(today, -retain_months) if retain_months is not None else None
+	retired = []
+	raw_conn = get_engine().raw_connection()
 	try:
-		# First check if it's a valid number
-		unit_number_float = float(unit_number)
-		unit_number_int = int(unit_number_float)
-		
-		# Check if the original value was actually an integer (no decimal part)
-		if unit_number_float != unit_number_int:
-			return redirect('/add_transactions?confirmation=error&message=Unit number must be a whole number (no decimals)')
-		
-		if unit_number_int < 1:
-			raise ValueError("Unit number must be positive")
-		if unit_number_int > 1000000:
-			raise ValueError("Unit number exceeds maximum")
-	except ValueError as ve:
-		if "exceeds maximum" in str(ve):
-			return redirect('/add_transactions?confirmation=error&message=Unit number cannot exceed 1,000,000 shares per transaction')
-		elif "invalid literal" in str(ve) or "could not convert" in str(ve):
-			return redirect('/add_transactions?confirmation=error&message=Unit number must be a valid number')
-		else:
-			return redirect('/add_transactions?confirmation=error&message=Unit number must be a positive integer between 1 and 1,000,000')
-	
+		cursor = raw_conn.cursor()
+		for table, (_, period) in PARTITIONED_TABLES.items():
+			if not is_partitioned(cursor, table):
+				raise click.ClickException(f"{table} is not partitioned; run `python server.py migrate` first")
+
+			start = min(from_date.date(), today) if from_date else today
+			until = add_months(today, ahead if period == 'month' else 12 * ahead)
+			cursor.execute("SELECT create_time_partitions(%s, %s, %s, %s)", (table, period, start, until))
+			for (name,) in cursor.fetchall():
+				click.echo(f"{table}: {'would create' if dry_run else 'created'} {name}")
+			if dry_run:
+				raw_conn.rollback()
+			else:
+				raw_conn.commit()
+
+			if cutoff is None:
+				continue
+			for name, start, end in time_partitions(cursor, table):
+				if end > cutoff:
+					break
+				action = 'archived to ' + os.path.join(archive_dir, name + '.csv') if archive_dir else 'dropped' if drop else 'detached'
+				if dry_run:
+					click.echo(f"{table}: would retire {name} ({start} to {end}), {action}")
+					continue
+				# Each partition in a transaction of its own, so the parent is only locked briefly
+				cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+				if archive_dir:
+					with open(os.path.join(archive_dir, name + '.csv'), 'w', newline='') as f:
+						cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+				if archive_dir or drop:
+					cursor.execute(f"DROP TABLE {name}")
+				raw_conn.commit()
+				retired.append(table)
+				click.echo(f"{table}: retired {name} ({start} to {end}), {action}")
+		cursor.close()
+	except:
+		raw_conn.rollback()
+		raise
+	finally:
+		raw_conn.close()
+
+	if retired:
+		with get_engine().connect() as conn:
+			invalidate_responses(conn, *sorted(set(retired)))
+
+
+#
+# Query plan checks.
+#
+# `python server.py check-queries` finds every SQL string literal in this file,
+# asks Postgres for its generic plan (EXPLAIN (GENERIC_PLAN), Postgres 16+, so
+# :name parameters need no values) and reports sequential scans of tables with
+# more than --min-rows rows. The partitions a plan scans count towards their
+# partitioned table, so scanning many small partitions is flagged like scanning
+# one large table. It exits non-zero when it finds any, so it can gate changes
+# in CI. Queries assembled with f-strings are not checked.
+#
+# A query that is meant to read a whole table (a dropdown list, a full listing)
+# carries ALLOW_SEQ_SCAN as a trailing SQL comment. It is still EXPLAINed, so it
+# must still parse, but its sequential scans are not flagged.
+#
+SQL_KEYWORDS = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+ALLOW_SEQ_SCAN = '-- check-queries: allow-seq-scan'
+
+
+def source_queries():
+	"""
+	[(line, sql)] for the SQL string literals in this module
+	"""
+	import ast
+	with open(os.path.abspath(__file__)) as f:
+		tree = ast.parse(f.read())
+	queries = []
+	for node in ast.walk(tree):
+		if isinstance(node, ast.JoinedStr):
+			# Skip f-strings wholesale, including their literal pieces
+			for value in node.values:
+				value._skip = True
+		elif isinstance(node, ast.Constant) and isinstance(node.value, str) and not getattr(node, '_skip', False):
+			words = node.value.split()
+			if len(words) > 1 and words[0] in SQL_KEYWORDS:
+				queries.append((node.lineno, node.value.strip()))
+	return sorted(queries)
+
+
+def generic_sql(sql):
+	"""
+	sql with its :name (SQLAlchemy) and %s (psycopg2) parameters numbered $1, $2, ...
+	"""
+	numbers = {}
+	def number(match):
+		# Every %s is a separate parameter; a repeated :name reuses its number
+		key = match.group(1) or len(numbers)
+		numbers.setdefault(key, len(numbers) + 1)
+		return f"${numbers[key]}"
+	# The lookbehind leaves ::casts alone
+	return re.sub(r"(?<![:\w]):([A-Za-z_]\w*)|%s", number, sql)
+
+
+def seq_scans(plan):
+	"""
+	Yield the relation names of the Seq Scan nodes in an EXPLAIN (FORMAT JSON) plan tree
+	"""
+	if plan.get('Node Type') == 'Seq Scan':
+		yield plan['Relation Name']
+	for child in plan.get('Plans', []):
+		yield from seq_scans(child)
+
+
+@cli.command('check-queries')
+@click.option('--min-rows', default=10000, show_default=True, help='Only flag sequential scans of tables estimated to be larger than this')
+@click.option('--verbose', is_flag=True, help='Also list the queries that passed')
+def check_queries(min_rows, verbose):
+	"""
+	EXPLAIN every query in server.py and flag sequential scans on large tables
+	"""
+	problems = 0
+	with get_engine().connect() as conn:
+		# Rows of every table, and the partitioned table each partition belongs to
+		table_rows = {}
+		table_roots = {}
+		for name, root, rows in conn.execute(text("""
+			SELECT c.relname, COALESCE(pg_partition_root(c.oid), c.oid)::regclass::text, GREATEST(c.reltuples, 0)
+			FROM pg_class c
+			JOIN pg_namespace n ON n.oid = c.relnamespace
+			WHERE c.relkind IN ('r', 'm') AND n.nspname = current_schema()
+		""")):
+			table_rows[name] = rows
+			table_roots[name] = root
+		for line, sql in source_queries():
+			generic = generic_sql(sql)
+			summary = ' '.join(sql.split())[:70]
+			try:
+				with conn.begin_nested():
+					plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON, GENERIC_PLAN) {generic}").scalar()
+			except exc.DBAPIError as e:
+				problems += 1
+				click.echo(f"server.py:{line}: EXPLAIN failed: {str(e.orig).strip().splitlines()[0]}\n    {summary}")
+				continue
+			if isinstance(plan, str):
+				plan = json.loads(plan)
+			scanned = defaultdict(set)
+			for table in seq_scans(plan[0]['Plan']):
+				scanned[table_roots.get(table, table)].add(table)
+			large = sorted(
+				root if tables == {root} else f"{root} ({len(tables)} partitions)"
+				for root, tables in scanned.items()
+				if sum(table_rows.get(table, 0) for table in tables) > min_rows
+			)
+			if large and ALLOW_SEQ_SCAN in sql:
+				if verbose:
+					click.echo(f"server.py:{line}: allowed sequential scan on {', '.join(large)}\n    {summary}")
+			elif large:
+				problems += 1
+				click.echo(f"server.py:{line}: sequential scan on {', '.join(large)}\n    {summary}")
+			elif verbose:
+				click.echo(f"server.py:{line}: ok\n    {summary}")
+		conn.rollback()
+	if problems:
+		raise click.ClickException(f"{problems} queries need attention")
+	click.echo("no sequential scans on large tables")
+
+
+@cli.command('rebuild-pnl')
+def rebuild_pnl():
+	"""
+	Recompute the P&L tables behind /top_investors and /best_buys from scratch
+	"""
+	started = time.perf_counter()
+	with get_engine().connect() as conn:
+		conn.execute(text("SELECT rebuild_pnl()"))
+		conn.commit()
+		invalidate_responses(conn, 'holdings', 'transaction')
+	click.echo(f"rebuilt P&L in {time.perf_counter() - started:.2f}s")
+
+
+#
+# Materialized views.
+#
+# `python server.py refresh-rankings` refreshes the precomputed rankings with
+# REFRESH MATERIALIZED VIEW CONCURRENTLY, so pages keep reading the previous
+# contents while the new ones are built, and records when each refresh finished.
+# With --every it keeps refreshing on that interval; run it from cron or as a
+# long-lived process. A session-level advisory lock per view makes overlapping
+# refreshers skip a round instead of queueing behind each other.
+#
+MATERIALIZED_VIEWS = ['esg_portfolio_ranking']
+
+
+def refresh_materialized_view(conn, view_name):
+	"""
+	Refresh view_name concurrently and record it in materialized_view_refresh.
+	Returns the duration in seconds, or None if another session is refreshing it.
+	"""
+	locked = conn.execute(text("SELECT pg_try_advisory_lock(hashtext(:name))"), {"name": view_name}).scalar()
+	conn.commit()
+	if not locked:
+		return None
 	try:
-		# Get the latest stock price for the selected stock
-		price_query = """
-			SELECT daily_price 
-			FROM stock_price 
-			WHERE stock_id = :stock_id 
-			ORDER BY price_date DESC 
-			LIMIT 1
-		"""
-		cursor = g.conn.execute(text(price_query), {"stock_id": stock_id})
-		price_result = cursor.fetchone()
+		started = time.perf_counter()
+		conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view_name}"))
+		duration = time.perf_counter() - started
+		conn.execute(text("""
+			INSERT INTO materialized_view_refresh (view_name, refreshed_at, duration_ms)
+			VALUES (:name, now(), :duration_ms)
+			ON CONFLICT (view_name) DO UPDATE
+			SET refreshed_at = EXCLUDED.refreshed_at,
+				duration_ms = EXCLUDED.duration_ms
+		"""), {"name": view_name, "duration_ms": round(duration * 1000, 1)})
+		conn.commit()
+		return duration
+	finally:
+		conn.execute(text("SELECT pg_advisory_unlock(hashtext(:name))"), {"name": view_name})
+		conn.commit()
+
+
+@cli.command('refresh-rankings')
+@click.argument('VIEWS', nargs=-1, type=click.Choice(MATERIALIZED_VIEWS))
+@click.option('--every', type=float, help='Keep refreshing, every this many seconds')
+def refresh_rankings(views, every):
+	"""
+	Refresh the precomputed ranking views (all of them unless VIEWS are named)
+	"""
+	while True:
+		started = time.perf_counter()
+		with get_engine().connect() as conn:
+			for view_name in views or MATERIALIZED_VIEWS:
+				duration = refresh_materialized_view(conn, view_name)
+				if duration is None:
+					click.echo(f"{view_name}: already being refreshed, skipped")
+				else:
+					invalidate_responses(conn, view_name)
+					click.echo(f"{view_name}: refreshed in {duration:.2f}s")
+		if every is None:
+			return
+		time.sleep(max(every - (time.perf_counter() - started), 0))
+
+
+#
+# Bulk ingestion.
+#
+# Files are streamed into Postgres with COPY FROM STDIN, chunk_rows rows at a
+# time, so memory use is bounded by the chunk size rather than the file size.
+# CSV files need a header row naming the columns; Parquet files (which need
+# pyarrow) use their column names. Each file is loaded in one transaction.
+#
+# With --upsert each chunk is copied into a temporary staging table and merged
+# with INSERT ... ON CONFLICT, so reloading a day of data updates it in place.
+#
+# Files for the partitioned tables are read once up front for their dates, and
+# the partitions they need are created and committed before the load starts:
+# creating a partition locks the whole table, which must not be held for the
+# length of a load.
+#
+INGEST_TABLES = {
+	'stock_price': ('stock_id', 'price_date', 'daily_price'),
+	'esg_score': ('stock_id', 'score_date', 'esg_score'),
+	'daily_macro_data': ('macro_date', 'risk_free_rate', 'interest_rate'),
+	'risk_metrics': ('portfolio_id', 'metric_date', 'sharpe_ratio', 'beta', 'volatility', 'var'),
+}
+
+
+def csv_chunks(path, chunk_rows):
+	"""
+	Yield (columns, buffer, row_count) for each chunk of a CSV file, buffer
+	holding up to chunk_rows rows re-encoded as CSV without a header
+	"""
+	with open(path, newline='') as f:
+		reader = csv.reader(f)
+		columns = [column.strip() for column in next(reader)]
+		while True:
+			buffer = io.StringIO()
+			writer = csv.writer(buffer)
+			count = 0
+			for row in itertools.islice(reader, chunk_rows):
+				writer.writerow(row)
+				count += 1
+			if not count:
+				return
+			buffer.seek(0)
+			yield columns, buffer, count
+
+
+def parquet_chunks(path, chunk_rows):
+	"""
+	Yield (columns, buffer, row_count) for each record batch of a Parquet file,
+	buffer holding the batch encoded as CSV without a header
+	"""
+	try:
+		import pyarrow.csv
+		import pyarrow.parquet
+	except ImportError:
+		raise click.UsageError("Reading Parquet files needs pyarrow (pip install pyarrow)")
+
+	parquet_file = pyarrow.parquet.ParquetFile(path)
+	options = pyarrow.csv.WriteOptions(include_header=False)
+	for batch in parquet_file.iter_batches(batch_size=chunk_rows):
+		buffer = io.BytesIO()
+		pyarrow.csv.write_csv(batch, buffer, options)
+		buffer.seek(0)
+		yield batch.schema.names, buffer, batch.num_rows
+
+
+def file_dates(path, fmt, column):
+	"""
+	The distinct values of column in a CSV or Parquet file, empty if it has no
+	such column
+	"""
+	if fmt == 'parquet':
+		try:
+			import pyarrow.parquet
+		except ImportError:
+			raise click.UsageError("Reading Parquet files needs pyarrow (pip install pyarrow)")
+		parquet_file = pyarrow.parquet.ParquetFile(path)
+		if column not in parquet_file.schema_arrow.names:
+			return set()
+		values = set()
+		for batch in parquet_file.iter_batches(columns=[column]):
+			values.update(batch.column(0).unique().to_pylist())
+		values.discard(None)
+		return values
+
+	with open(path, newline='') as f:
+		reader = csv.reader(f)
+		columns = [column.strip() for column in next(reader)]
+		if column not in columns:
+			return set()
+		index = columns.index(column)
+		return {row[index] for row in reader if row}
+
+
+def create_ingest_partitions(table, dates):
+	"""
+	Create and commit the missing partitions of table covering dates, and
+	return their names
+	"""
+	_, period = PARTITIONED_TABLES[table]
+	raw_conn = get_engine().raw_connection()
+	try:
+		cursor = raw_conn.cursor()
+		if not is_partitioned(cursor, table):
+			return []
+		# Postgres parses the dates, so any format COPY accepts works
+		cursor.execute("""
+			SELECT create_time_partitions(%s, %s, first, last)
+			FROM (SELECT MIN(d) AS first, MAX(d) AS last FROM unnest(%s::date[]) AS d) r
+			WHERE first IS NOT NULL
+		""", (table, period, [str(value) for value in dates]))
+		created = [name for (name,) in cursor.fetchall()]
 		cursor.close()
-		
-		if not price_result or price_result[0] is None:
-			return redirect('/add_transactions?confirmation=error&message=No price data found for selected stock')
-		
-		unit_price = float(price_result[0])
-		
-		# Get current timestamp, or use fallback date
+		raw_conn.commit()
+		return created
+	except:
+		raw_conn.rollback()
+		raise
+	finally:
+		raw_conn.close()
+
+
+def copy_chunks(cursor, table, chunks, upsert):
+	"""
+	COPY each chunk into table (or merge it in through a staging table when
+	upsert is set) and return the number of rows loaded
+	"""
+	keys = TABLE_KEYS[table]
+	total = 0
+	staging_ready = False
+	for columns, buffer, count in chunks:
+		unknown = set(columns) - set(INGEST_TABLES[table])
+		if unknown or not set(keys) <= set(columns):
+			raise click.UsageError(f"{table} files need the columns {', '.join(INGEST_TABLES[table])} (got {', '.join(columns)})")
+		column_list = ', '.join(columns)
+
+		if not upsert:
+			cursor.copy_expert(f"COPY {table} ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+			total += count
+			continue
+
+		if not staging_ready:
+			cursor.execute(f"CREATE TEMP TABLE ingest_staging (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+			staging_ready = True
+		cursor.copy_expert(f"COPY ingest_staging ({column_list}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+		key_list = ', '.join(keys)
+		updates = [f"{column} = EXCLUDED.{column}" for column in columns if column not in keys]
+		conflict_action = f"DO UPDATE SET {', '.join(updates)}" if updates else "DO NOTHING"
+		# DISTINCT ON keeps the last row of the chunk when a key repeats
+		cursor.execute(f"""
+			INSERT INTO {table} ({column_list})
+			SELECT DISTINCT ON ({key_list}) {column_list}
+			FROM ingest_staging
+			ORDER BY {key_list}, ctid DESC
+			ON CONFLICT ({key_list}) {conflict_action}
+		""")
+		cursor.execute("TRUNCATE ingest_staging")
+		total += count
+	return total
+
+
+@cli.command()
+@click.argument('TABLE', type=click.Choice(sorted(INGEST_TABLES)))
+@click.argument('PATHS', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'parquet']), help='Input format (default: from the file extension)')
+@click.option('--chunk-rows', default=50000, show_default=True, help='Rows per COPY batch')
+@click.option('--upsert', is_flag=True, help='Update rows whose key already exists instead of failing')
+def ingest(table, paths, file_format, chunk_rows, upsert):
+	"""
+	Bulk load CSV or Parquet files into stock_price, esg_score, daily_macro_data or risk_metrics
+	"""
+	grand_total = 0
+	started = time.perf_counter()
+	for path in paths:
+		fmt = file_format or ('parquet' if path.endswith(('.parquet', '.pq')) else 'csv')
+		chunks = parquet_chunks(path, chunk_rows) if fmt == 'parquet' else csv_chunks(path, chunk_rows)
+
+		if table in PARTITIONED_TABLES:
+			for name in create_ingest_partitions(table, file_dates(path, fmt, PARTITIONED_TABLES[table][0])):
+				click.echo(f"{path}: created partition {name}")
+
+		file_started = time.perf_counter()
+		raw_conn = get_engine().raw_connection()
 		try:
-			transaction_time = datetime.now()
-		except:
-			# Fallback to Nov 19, 2025 8:15 PM
-			transaction_time = datetime(2025, 11, 19, 20, 15, 0)
-		
-		# Additional validation for SELL transactions
-		if transaction_type == 'sell':
-			# Find the investor's portfolio
-			portfolio_query = """
-				SELECT portfolio_id 
-				FROM portfolio 
-				WHERE investor_id = :investor_id 
-				ORDER BY creation_date DESC 
-				LIMIT 1
-			"""
-			cursor = g.conn.execute(text(portfolio_query), {"investor_id": investor_id})
-			portfolio_result = cursor.fetchone()
-			cursor.close()
-			
-			if not portfolio_result:
-				return redirect('/add_transactions?confirmation=error&message=Cannot sell - No portfolio found for this investor')
-			
-			portfolio_id = portfolio_result[0]
-			
-			# Check current holdings
-			holdings_query = """
-				SELECT holding_count 
-				FROM holdings 
-				WHERE stock_id = :stock_id AND portfolio_id = :portfolio_id
-			"""
-			cursor = g.conn.execute(text(holdings_query), {
-				"stock_id": stock_id,
-				"portfolio_id": portfolio_id
-			})
-			holdings_result = cursor.fetchone()
+			cursor = raw_conn.cursor()
+			rows = copy_chunks(cursor, table, chunks, upsert)
 			cursor.close()
-			
-			if not holdings_result or holdings_result[0] is None:
-				return redirect(f'/add_transactions?confirmation=error&message=Cannot sell {stock_id} - You do not own this stock')
-			
-			current_holdings = holdings_result[0]
-			if current_holdings < unit_number_int:
-				return redirect(f'/add_transactions?confirmation=error&message=Cannot sell {unit_number_int} shares - You only have {current_holdings} shares available')
-		
-		# Insert the new transaction
-		insert_query = """
-			INSERT INTO transaction(investor_id, stock_id, transaction_time, transaction_type, unit_price, unit_number) 
-			VALUES (:investor_id, :stock_id, :transaction_time, :transaction_type, :unit_price, :unit_number)
-		"""
-		g.conn.execute(text(insert_query), {
-			"investor_id": investor_id,
-			"stock_id": stock_id,
-			"transaction_time": transaction_time,
-			"transaction_type": transaction_type,
-			"unit_price": unit_price,
-			"unit_number": unit_number_int
-		})
-		
-		g.conn.commit()
-		
-		# Calculate transaction value
-		transaction_value = unit_price * unit_number_int
-		
-		# Redirect with success message
-		return redirect(f'/add_transactions?confirmation=success&message=Transaction recorded successfully! {transaction_type.upper()} {unit_number_int} shares at ${unit_price:.2f} (Total: ${transaction_value:.2f})')
-	
-	except Exception as e:
-		g.conn.rollback()
-		# Parse trigger error messages to show user-friendly errors
-		error_message = str(e)
-		
-		# Extract meaningful error from PostgreSQL exception
-		if "No portfolio found for investor" in error_message:
-			error_message = "This investor does not have a portfolio. Please create a portfolio first."
-		elif "Cannot sell stock" in error_message or "no holdings found" in error_message:
-			error_message = f"Cannot sell {stock_id} - You don't own this stock in your portfolio."
-		elif "Insufficient shares to sell" in error_message:
-			# Try to extract the available shares count
-			if "Available:" in error_message:
+			raw_conn.commit()
+		except:
+			raw_conn.rollback()
+			raise
+		finally:
+			raw_conn.close()
+
+		elapsed = time.perf_counter() - file_started
+		grand_total += rows
+		click.echo(f"{path}: {rows:,} rows in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)")
+
+	with get_engine().connect() as conn:
+		invalidate_responses(conn, table)
+
+	elapsed = time.perf_counter() - started
+	click.echo(f"{table}: {grand_total:,} rows in {elapsed:.2f}s ({grand_total / max(elapsed, 1e-9):,.0f} rows/s)")
+
+
+#
+# Exports.
+#
+# `python server.py export TABLE [OUTPUT]` and /export/<table> stream a table
+# as CSV, or as Arrow IPC or Parquet with pyarrow installed, filtered by date
+# range (on the table's date column, both ends included), investor and stock.
+#
+# Rows leave Postgres through COPY (SELECT ...) TO STDOUT on a connection of
+# their own, read by a background thread into a queue of at most
+# EXPORT_QUEUE_CHUNKS chunks of EXPORT_CHUNK_BYTES, so exporting the whole price
+# history holds a few megabytes at a time and runs at about the speed Postgres
+# writes CSV. Arrow and Parquet are converted from the same CSV stream by
+# pyarrow's streaming CSV reader, with the column types taken from the table,
+# and written EXPORT_BATCH_ROWS rows (one Parquet row group) at a time. Rows
+# come out in storage order (stock_price: month by month).
+#
+EXPORT_CHUNK_BYTES = 256 * 1024
+EXPORT_QUEUE_CHUNKS = 8
+EXPORT_BATCH_ROWS = 250000
+
+# table: (date column, investor condition, stock condition), None where the filter does not apply
+EXPORT_TABLES = {
+	'transaction': ('transaction_time', "investor_id = %s", "stock_id = %s"),
+	'holdings': (None, "portfolio_id IN (SELECT portfolio_id FROM portfolio WHERE investor_id = %s)", "stock_id = %s"),
+	'stock_price': ('price_date', None, "stock_id = %s"),
+	'esg_score': ('score_date', None, "stock_id = %s"),
+	'daily_macro_data': ('macro_date', None, None),
+	'risk_metrics': ('metric_date', "portfolio_id IN (SELECT portfolio_id FROM portfolio WHERE investor_id = %s)", None),
+}
+EXPORT_FORMATS = {
+	'csv': ('text/csv', '.csv'),
+	'arrow': ('application/vnd.apache.arrow.stream', '.arrows'),
+	'parquet': ('application/vnd.apache.parquet', '.parquet'),
+}
+
+
+class ExportCancelled(Exception):
+	"""
+	Raised inside COPY when the reader of an export has gone away
+	"""
+
+
+def export_query(table, start=None, end=None, investor_id=None, stock_id=None):
+	"""
+	(sql, params) selecting the rows of table that match the filters; raises
+	ValueError for a filter the table does not have
+	"""
+	date_column, investor_condition, stock_condition = EXPORT_TABLES[table]
+	conditions, params = [], []
+	for name, value, condition in (
+		('date range', start, date_column and f"{date_column} >= %s"),
+		('date range', end, date_column and f"{date_column} < %s::date + 1"),
+		('investor', investor_id, investor_condition),
+		('stock', stock_id, stock_condition),
+	):
+		if value is None:
+			continue
+		if condition is None:
+			raise ValueError(f"{table} cannot be filtered by {name}")
+		conditions.append(condition)
+		params.append(value)
+	sql = f"SELECT * FROM {table}"
+	if conditions:
+		sql += " WHERE " + " AND ".join(conditions)
+	return sql, params
+
+
+def copy_chunks_out(sql, params):
+	"""
+	Yield the CSV (with a header) of COPY (sql) TO STDOUT in chunks of about
+	EXPORT_CHUNK_BYTES; closing the generator early cancels the COPY
+	"""
+	chunks = queue.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+	stop = threading.Event()
+
+	def put(item):
+		while not stop.is_set():
+			try:
+				chunks.put(item, timeout=0.5)
+				return
+			except queue.Full:
+				pass
+		raise ExportCancelled()
+
+	class Sink:
+		# psycopg2 writes the COPY data row by row; rows are gathered into chunks
+		def __init__(self):
+			self.buffer = bytearray()
+
+		def write(self, data):
+			self.buffer += data.encode() if isinstance(data, str) else data
+			if len(self.buffer) >= EXPORT_CHUNK_BYTES:
+				put(bytes(self.buffer))
+				self.buffer.clear()
+
+	def copy():
+		raw_conn = get_engine().raw_connection()
+		try:
+			cursor = raw_conn.cursor()
+			sink = Sink()
+			cursor.copy_expert(f"COPY ({cursor.mogrify(sql, params).decode()}) TO STDOUT WITH (FORMAT csv, HEADER)", sink)
+			if sink.buffer:
+				put(bytes(sink.buffer))
+			put(None)
+			raw_conn.rollback()
+		except BaseException as error:
+			# A COPY abandoned half way leaves the connection unusable
+			raw_conn.invalidate()
+			if not isinstance(error, ExportCancelled):
 				try:
-					parts = error_message.split("Available:")
-					available = parts[1].split(",")[0].strip()
-					error_message = f"Insufficient shares to sell. You only have {available} shares available."
-				except:
-					error_message = "Insufficient shares to sell. You don't have enough shares in your portfolio."
-			else:
-				error_message = "Insufficient shares to sell. You don't have enough shares in your portfolio."
+					put(error)
+				except ExportCancelled:
+					pass
+		finally:
+			raw_conn.close()
+
+	thread = threading.Thread(target=copy, name='export', daemon=True)
+	thread.start()
+	try:
+		while True:
+			item = chunks.get()
+			if item is None:
+				return
+			if isinstance(item, BaseException):
+				raise item
+			yield item
+	finally:
+		stop.set()
+		thread.join()
+
+
+class ChunkReader(io.RawIOBase):
+	"""
+	Read-only file over an iterator of byte chunks
+	"""
+	def __init__(self, chunks):
+		self.chunks = chunks
+		self.pending = b''
+
+	def readable(self):
+		return True
+
+	def readinto(self, buffer):
+		while not self.pending:
+			self.pending = next(self.chunks, b'')
+			if not self.pending:
+				return 0
+		size = min(len(buffer), len(self.pending))
+		buffer[:size] = self.pending[:size]
+		self.pending = self.pending[size:]
+		return size
+
+
+class ChunkWriter(io.RawIOBase):
+	"""
+	Write-only file collecting what is written until take() hands it out,
+	counting positions from the start so Parquet's offsets stay right
+	"""
+	def __init__(self):
+		self.pending = []
+		self.position = 0
+
+	def writable(self):
+		return True
+
+	def write(self, data):
+		self.pending.append(bytes(data))
+		self.position += len(data)
+		return len(data)
+
+	def tell(self):
+		return self.position
+
+	def take(self):
+		data = b''.join(self.pending)
+		self.pending = []
+		return data
+
+
+def arrow_column_types(pa, table):
+	"""
+	{column: pyarrow type} for the columns of table
+	"""
+	raw_conn = get_engine().raw_connection()
+	try:
+		cursor = raw_conn.cursor()
+		cursor.execute(f"SELECT * FROM {table} LIMIT 0")
+		description = cursor.description
+		raw_conn.rollback()
+	finally:
+		raw_conn.close()
+
+	# Keyed by Postgres type OID; anything else is exported as text
+	known = {
+		16: pa.bool_(), 20: pa.int64(), 21: pa.int16(), 23: pa.int32(), 700: pa.float32(), 701: pa.float64(),
+		1082: pa.date32(), 1114: pa.timestamp('us'),
+	}
+	types = {}
+	for column in description:
+		if column.type_code == 1700:
+			types[column.name] = pa.decimal128(column.precision, column.scale) if column.precision else pa.float64()
 		else:
-			# For any other database errors, show a generic message with details
-			error_message = f"Transaction failed: {error_message}"
-		
-		return redirect(f'/add_transactions?confirmation=error&message={error_message}')
+			types[column.name] = known.get(column.type_code, pa.string())
+	return types
 
 
-@app.route('/login')
-def login():
-	abort(401)
-	# Your IDE may highlight this as a problem - because no such function exists (intentionally).
-	# This code is never executed because of abort().
-	this_is_never_executed()
+def export_stream(table, fmt, sql, params):
+	"""
+	Yield table's rows selected by (sql, params) encoded as fmt, in chunks
+	"""
+	if fmt == 'csv':
+		yield from copy_chunks_out(sql, params)
+		return
+
+	import pyarrow as pa
+	import pyarrow.csv
+	import pyarrow.ipc
+	import pyarrow.parquet
+	column_types = arrow_column_types(pa, table)
+	chunks = copy_chunks_out(sql, params)
+	try:
+		reader = pyarrow.csv.open_csv(
+			ChunkReader(chunks),
+			read_options=pyarrow.csv.ReadOptions(block_size=EXPORT_CHUNK_BYTES),
+			# COPY writes NULL unquoted and empty strings quoted
+			convert_options=pyarrow.csv.ConvertOptions(column_types=column_types, strings_can_be_null=True,
+				quoted_strings_can_be_null=False),
+		)
+		sink = ChunkWriter()
+		writer = pyarrow.ipc.new_stream(sink, reader.schema) if fmt == 'arrow' else pyarrow.parquet.ParquetWriter(sink, reader.schema)
+		batches, rows = [], 0
+		for batch in itertools.chain(reader, [None]):
+			if batch is not None:
+				batches.append(batch)
+				rows += batch.num_rows
+				if rows < EXPORT_BATCH_ROWS:
+					continue
+			if batches:
+				writer.write_table(pa.Table.from_batches(batches, reader.schema))
+				batches, rows = [], 0
+				yield sink.take()
+		writer.close()
+		yield sink.take()
+	finally:
+		chunks.close()
+
+
+def export_format_error(fmt):
+	"""
+	Why fmt cannot be exported here, or None
+	"""
+	if fmt == 'csv':
+		return None
+	try:
+		import pyarrow
+	except ImportError:
+		return f"{fmt} exports need pyarrow (pip install pyarrow)"
+	return None
 
 
-if __name__ == "__main__":
-	import click
-
-	@click.command()
-	@click.option('--debug', is_flag=True)
-	@click.option('--threaded', is_flag=True)
-	@click.argument('HOST', default='0.0.0.0')
-	@click.argument('PORT', default=8111, type=int)
-	def run(debug, threaded, host, port):
-		"""
-		This function handles command line parameters.
-		Run the server using:
+@app.route('/export/<table>', methods=['GET'])
+def export(table):
+	"""
+	Stream a table as CSV, Arrow IPC or Parquet (?format=), filtered by ?start=
+	and ?end= (ISO dates), ?investor_id= and ?stock_id=
+	"""
+	if table not in EXPORT_TABLES:
+		abort(404)
+	fmt = request.args.get('format', 'csv')
+	if fmt not in EXPORT_FORMATS:
+		abort(400)
+	error = export_format_error(fmt)
+	if error:
+		return {'error': error}, 501
+	try:
+		start = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+		end = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+		sql, params = export_query(table, start, end, request.args.get('investor_id') or None, request.args.get('stock_id') or None)
+	except ValueError as e:
+		return {'error': str(e)}, 400
+
+	mimetype, extension = EXPORT_FORMATS[fmt]
+	response = Response(export_stream(table, fmt, sql, params), mimetype=mimetype)
+	response.headers['Content-Disposition'] = f'attachment; filename="{table}{extension}"'
+	return response
+
+
+@cli.command('export')
+@click.argument('TABLE', type=click.Choice(sorted(EXPORT_TABLES)))
+@click.argument('OUTPUT', default='-', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'file_format', type=click.Choice(sorted(EXPORT_FORMATS)), help='Output format (default: from the OUTPUT extension, csv on stdout)')
+@click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), help='First date to export')
+@click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), help='Last date to export')
+@click.option('--investor', 'investor_id', help='Only rows of this investor')
+@click.option('--stock', 'stock_id', help='Only rows of this stock')
+def export_command(table, output, file_format, start, end, investor_id, stock_id):
+	"""
+	Export a table (or the rows matching the filters) to a CSV, Arrow IPC or Parquet file, or to stdout
+	"""
+	fmt = file_format or next((name for name, (_, extension) in EXPORT_FORMATS.items() if output.endswith(extension)), 'csv')
+	error = export_format_error(fmt)
+	if error:
+		raise click.UsageError(error)
+	try:
+		sql, params = export_query(table, start and start.date(), end and end.date(), investor_id, stock_id)
+	except ValueError as e:
+		raise click.UsageError(str(e))
 
-			python server.py
+	started = time.perf_counter()
+	size = 0
+	with click.open_file(output, 'wb') as f:
+		for chunk in export_stream(table, fmt, sql, params):
+			f.write(chunk)
+			size += len(chunk)
+	elapsed = time.perf_counter() - started
+	click.echo(f"{table}: {size / 1e6:,.1f} MB of {fmt} in {elapsed:.2f}s ({size / 1e6 / max(elapsed, 1e-9):,.0f} MB/s)", err=True)
 
-		Show the help text using:
 
-			python server.py --help
+#
+# Risk metrics.
+#
+# `python server.py compute-risk` fills risk_metrics for every portfolio as of
+# one date. Prices for the lookback window are copied out of stock_price into a
+# dates x stocks NumPy matrix (forward-filled over missing days) and turned into
+# daily returns once. Portfolios are then processed in blocks: each block's
+# value weights form a portfolios x stocks matrix, so the returns of the whole
+# block are a single matrix product and every metric is a column-wise reduction.
+# Blocks run on a thread pool (NumPy releases the GIL in these operations) and
+# the results are merged into risk_metrics with the same COPY upsert as ingest.
+#
+#   volatility    annualized standard deviation of daily returns
+#   sharpe_ratio  annualized mean daily return over the risk-free rate, per unit of volatility
+#   beta          covariance with the benchmark's returns over the benchmark's variance
+#   var           one-day historical value at risk at RISK_VAR_CONFIDENCE, as a fraction of value
+#
+# The benchmark is a stock (--benchmark) or, by default, the equal-weighted
+# average of every stock. daily_macro_data.risk_free_rate is an annual rate.
+#
+TRADING_DAYS = 252
+RISK_VAR_CONFIDENCE = 0.95
 
-		"""
 
-		HOST, PORT = host, port
-		print("running on %s:%d" % (HOST, PORT))
-		app.run(host=HOST, port=PORT, debug=debug, threaded=threaded)
+def load_price_matrix(cursor, np, start, end):
+	"""
+	Return (dates, stock_ids, prices) for stock_price rows in [start, end],
+	prices being a dates x stocks float matrix forward-filled along dates
+	(NaN before a stock's first price in the window)
+	"""
+	cursor.execute("SELECT stock_id FROM stock ORDER BY stock_id -- check-queries: allow-seq-scan")
+	all_stock_ids = [row[0] for row in cursor.fetchall()]
+
+	# One pass over the window: rows as (day offset, position in all_stock_ids, price)
+	buffer = io.StringIO()
+	cursor.copy_expert(cursor.mogrify("""
+		COPY (
+			SELECT p.price_date - %s, s.position, p.daily_price
+			FROM stock_price p
+			JOIN (SELECT stock_id, ROW_NUMBER() OVER (ORDER BY stock_id) - 1 AS position FROM stock) s
+			  ON s.stock_id = p.stock_id
+			WHERE p.price_date BETWEEN %s AND %s
+		) TO STDOUT WITH (FORMAT csv)
+	""", (start, start, end)).decode(), buffer)
+	if not buffer.tell():
+		return [], [], np.full((0, 0), np.nan)
+	buffer.seek(0)
+	rows = np.loadtxt(buffer, delimiter=',', ndmin=2)
+
+	# The axes are the days and stocks that have prices; the inverses place each row
+	days, date_index = np.unique(rows[:, 0].astype(int), return_inverse=True)
+	positions, stock_index = np.unique(rows[:, 1].astype(int), return_inverse=True)
+	dates = [start + timedelta(days=int(day)) for day in days]
+	stock_ids = [all_stock_ids[position] for position in positions]
+	prices = np.full((len(dates), len(stock_ids)), np.nan)
+	prices[date_index, stock_index] = rows[:, 2]
+
+	# Forward fill: each cell takes the value of the last row at or above it that has one
+	last_seen = np.where(np.isnan(prices), 0, np.arange(len(dates))[:, None])
+	np.maximum.accumulate(last_seen, axis=0, out=last_seen)
+	prices = prices[last_seen, np.arange(len(stock_ids))]
+	return dates, stock_ids, prices
+
+
+def daily_risk_free_rates(cursor, np, dates):
+	"""
+	Daily risk-free return for each date, from the latest daily_macro_data on or before it
+	"""
+	cursor.execute("SELECT macro_date, risk_free_rate FROM daily_macro_data WHERE macro_date <= %s ORDER BY macro_date", (dates[-1],))
+	rows = cursor.fetchall()
+	if not rows:
+		return np.zeros(len(dates))
+	macro_dates = [row[0] for row in rows]
+	annual_rates = np.array([float(row[1] or 0) for row in rows] + [0.0])
+	# Index -1 (no rate yet on that date) picks the trailing 0
+	positions = np.array([bisect.bisect_right(macro_dates, d) - 1 for d in dates])
+	return annual_rates[positions] / TRADING_DAYS
+
+
+def portfolio_risk_block(np, returns, benchmark, risk_free, weights):
+	"""
+	Metrics for a block of portfolios given their weights (portfolios x stocks).
+	Returns (volatility, sharpe_ratio, beta, var), one array entry per portfolio.
+	"""
+	portfolio_returns = returns @ weights.T
+	std = portfolio_returns.std(axis=0, ddof=1)
+	with np.errstate(divide='ignore', invalid='ignore'):
+		volatility = std * np.sqrt(TRADING_DAYS)
+		excess = (portfolio_returns - risk_free[:, None]).mean(axis=0)
+		sharpe = np.where(std > 0, excess / std * np.sqrt(TRADING_DAYS), np.nan)
+		centered_benchmark = benchmark - benchmark.mean()
+		benchmark_variance = centered_benchmark @ centered_benchmark
+		centered = portfolio_returns - portfolio_returns.mean(axis=0)
+		beta = centered_benchmark @ centered / benchmark_variance if benchmark_variance > 0 else np.full(len(std), np.nan)
+	var = -np.percentile(portfolio_returns, (1 - RISK_VAR_CONFIDENCE) * 100, axis=0)
+	return volatility, sharpe, beta, var
+
+
+def risk_metric_rows(np, portfolio_ids, metric_date, metrics):
+	"""
+	Yield (columns, buffer, row_count) for copy_chunks from one block's metrics
+	"""
+	buffer = io.StringIO()
+	writer = csv.writer(buffer)
+	for portfolio_id, values in zip(portfolio_ids, zip(*metrics)):
+		volatility, sharpe, beta, var = (None if not np.isfinite(v) else round(float(v), 4) for v in values)
+		writer.writerow([portfolio_id, metric_date, sharpe, beta, volatility, var])
+	buffer.seek(0)
+	yield ('portfolio_id', 'metric_date', 'sharpe_ratio', 'beta', 'volatility', 'var'), buffer, len(portfolio_ids)
+
+
+@cli.command('compute-risk')
+@click.option('--as-of', 'as_of', type=click.DateTime(formats=['%Y-%m-%d']), help='Metric date (default: the latest price date)')
+@click.option('--lookback-days', default=365, show_default=True, help='Calendar days of price history to use')
+@click.option('--benchmark', help='Stock ID to measure beta against (default: equal-weighted average of all stocks)')
+@click.option('--block-size', default=1000, show_default=True, help='Portfolios per vectorized block')
+@click.option('--workers', default=os.cpu_count() or 1, show_default='CPUs', help='Blocks computed in parallel')
+def compute_risk(as_of, lookback_days, benchmark, block_size, workers):
+	"""
+	Compute volatility, Sharpe ratio, beta and VaR for every portfolio into risk_metrics
+	"""
+	try:
+		import numpy as np
+	except ImportError:
+		raise click.UsageError("compute-risk needs numpy (pip install numpy)")
+	from concurrent.futures import ThreadPoolExecutor
+
+	started = time.perf_counter()
+	raw_conn = get_engine().raw_connection()
+	try:
+		cursor = raw_conn.cursor()
+		if as_of is None:
+			# The newest price of any stock, without reading every stock_price partition
+			cursor.execute("SELECT MAX(price_date) FROM latest_stock_price -- check-queries: allow-seq-scan")
+			end = cursor.fetchone()[0]
+			if end is None:
+				raise click.UsageError("stock_price is empty")
+		else:
+			end = as_of.date()
+		dates, stock_ids, prices = load_price_matrix(cursor, np, end - timedelta(days=lookback_days), end)
+		if len(dates) < 3:
+			raise click.UsageError(f"need at least 3 price dates up to {end}, found {len(dates)}")
+		end = dates[-1]
+		click.echo(f"loaded {len(dates):,} dates x {len(stock_ids):,} stocks up to {end} in {time.perf_counter() - started:.2f}s")
+
+		# Daily simple returns; a stock with no price yet counts as flat
+		with np.errstate(divide='ignore', invalid='ignore'):
+			returns = np.nan_to_num(prices[1:] / prices[:-1] - 1, nan=0.0, posinf=0.0, neginf=0.0)
+		if benchmark is None:
+			benchmark_returns = returns.mean(axis=1)
+		elif benchmark in stock_ids:
+			benchmark_returns = returns[:, stock_ids.index(benchmark)]
+		else:
+			raise click.UsageError(f"benchmark {benchmark} has no prices up to {end}")
+		risk_free = daily_risk_free_rates(cursor, np, dates)[1:]
+
+		# Value weights from the latest prices in the window
+		stock_positions = {stock_id: i for i, stock_id in enumerate(stock_ids)}
+		latest_prices = np.nan_to_num(prices[-1])
+		cursor.execute("SELECT portfolio_id, stock_id, holding_count FROM holdings WHERE holding_count > 0 ORDER BY portfolio_id")
+		positions = {}
+		for portfolio_id, stock_id, holding_count in cursor.fetchall():
+			if stock_id in stock_positions:
+				positions.setdefault(portfolio_id, []).append((stock_positions[stock_id], holding_count))
+		portfolio_ids = sorted(positions)
+
+		def compute_block(block_ids):
+			weights = np.zeros((len(block_ids), len(stock_ids)))
+			for row, portfolio_id in enumerate(block_ids):
+				columns, counts = zip(*positions[portfolio_id])
+				weights[row, list(columns)] = np.array(counts, dtype=float) * latest_prices[list(columns)]
+			totals = weights.sum(axis=1, keepdims=True)
+			weights = np.divide(weights, totals, out=np.zeros_like(weights), where=totals > 0)
+			return block_ids, portfolio_risk_block(np, returns, benchmark_returns, risk_free, weights)
+
+		blocks = [portfolio_ids[i:i + block_size] for i in range(0, len(portfolio_ids), block_size)]
+		with ThreadPoolExecutor(max_workers=workers) as pool:
+			results = list(pool.map(compute_block, blocks))
+		computed = time.perf_counter()
+		click.echo(f"computed {len(portfolio_ids):,} portfolios in {computed - started:.2f}s")
+
+		chunks = itertools.chain.from_iterable(risk_metric_rows(np, block_ids, end, metrics) for block_ids, metrics in results)
+		rows = copy_chunks(cursor, 'risk_metrics', chunks, upsert=True)
+		cursor.close()
+		raw_conn.commit()
+	except:
+		raw_conn.rollback()
+		raise
+	finally:
+		raw_conn.close()
+	click.echo(f"risk_metrics: {rows:,} rows for {end} written in {time.perf_counter() - computed:.2f}s")
+	with get_engine().connect() as conn:
+		invalidate_responses(conn, 'risk_metrics')
+
+
+@cli.command('submit-transactions')
+@click.argument('PATH', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']), help='Input format (default: from the file extension)')
+@click.option('--chunk-rows', default=TRANSACTION_BATCH_ROWS, show_default=True, help='Transactions per INSERT statement')
+def submit_transactions(path, file_format, chunk_rows):
+	"""
+	Record a file of transactions (e.g. an end-of-day trade replay) in one transaction
+	"""
+	fmt = file_format or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+	started = time.perf_counter()
+	with get_engine().connect() as conn, open(path, newline='') as lines:
+		try:
+			accepted, errors = process_transaction_batch(conn, read_transaction_records(lines, fmt), chunk_rows)
+		except exc.DBAPIError as e:
+			conn.rollback()
+			raise click.ClickException(str(e.orig).split('\n')[0])
+		if errors:
+			conn.rollback()
+			for error in errors[:20]:
+				click.echo(f"line {error['line']}: {error['message']}", err=True)
+			raise click.ClickException(f"{len(errors)} invalid transactions, nothing was recorded")
+		conn.commit()
+		invalidate_responses(conn, *TRANSACTION_TABLES)
+
+	elapsed = time.perf_counter() - started
+	click.echo(f"{accepted:,} transactions in {elapsed:.2f}s ({accepted / max(elapsed, 1e-9):,.0f} rows/s)")
+
+
+@cli.command('onboard-investors')
+@click.argument('PATH', type=click.Path(exists=True, dir_okay=False))
+@click.option('--block-size', default=1000, show_default=True, help='IDs reserved per round trip')
+def onboard_investors(path, block_size):
+	"""
+	Create an investor and an empty portfolio for each company name in PATH (one per line)
+	"""
+	insert_investors_query = """
+		INSERT INTO investor(investor_id, company_name)
+		SELECT * FROM unnest(CAST(:investor_ids AS TEXT[]), CAST(:company_names AS TEXT[]))
+	"""
+	insert_portfolios_query = """
+		INSERT INTO portfolio(portfolio_id, investor_id, total_value, creation_date)
+		SELECT portfolio_id, investor_id, 0, :creation_date
+		FROM unnest(CAST(:portfolio_ids AS TEXT[]), CAST(:investor_ids AS TEXT[])) AS p(portfolio_id, investor_id)
+	"""
+	created = 0
+	with get_engine().connect() as conn, open(path) as f:
+		names = (line.strip() for line in f)
+		names = (name for name in names if name)
+		while True:
+			block = list(itertools.islice(names, block_size))
+			if not block:
+				break
+			new_investor_ids = investor_ids.allocate(conn, len(block))
+			new_portfolio_ids = portfolio_ids.allocate(conn, len(block))
+			conn.execute(text(insert_investors_query), {
+				"investor_ids": new_investor_ids,
+				"company_names": block
+			})
+			conn.execute(text(insert_portfolios_query), {
+				"portfolio_ids": new_portfolio_ids,
+				"investor_ids": new_investor_ids,
+				"creation_date": date.today()
+			})
+			created += len(block)
+		conn.commit()
+		invalidate_reference_data(conn, 'investors')
+		invalidate_responses(conn, 'investor', 'portfolio')
+	click.echo(f"Created {created:,} investors with portfolios")
+
+
+@cli.command('delete-investors')
+@click.argument('INVESTOR_IDS', nargs=-1, required=True)
+def delete_investors_command(investor_ids):
+	"""
+	Delete investors with all their portfolios, holdings, risk metrics and transactions
+	"""
+	with get_engine().connect() as conn:
+		deleted = delete_investors(conn, investor_ids)
+		conn.commit()
+		invalidate_reference_data(conn, 'investors')
+		invalidate_responses(conn, *INVESTOR_TABLES)
+	click.echo(f"Deleted {deleted:,} investors")
 
-run()
+
+if __name__ == "__main__":
+	cli()
@@ -0,0 +1,74 @@
+-- ESG Portfolio Ranking
+-- Precomputes the /esg-stocks ranking: each portfolio's ESG score weighted by
+-- the market value of its holdings (latest ESG score per stock, latest price,
+-- falling back to the average purchase price), next to its latest risk metrics.
+-- The page reads the first rows of the rank index instead of joining holdings,
+-- ESG scores and risk metrics on every view.
+--
+-- The view is refreshed with REFRESH MATERIALIZED VIEW CONCURRENTLY (readers are
+-- never blocked), by `python server.py refresh-rankings` or any scheduler, and
+-- each refresh is recorded in materialized_view_refresh so the page can show
+-- how old the ranking is.
+--
+-- Run after latest_stock_price.sql. Re-running leaves an existing view (and
+-- its last refresh) alone; to change the definition, add a versioned migration
+-- that drops the view, and the next migrate re-creates it from this script.
+
+-- When each materialized view was last refreshed
+CREATE TABLE IF NOT EXISTS materialized_view_refresh (
+    view_name TEXT PRIMARY KEY,
+    refreshed_at TIMESTAMPTZ NOT NULL,
+    duration_ms NUMERIC
+);
+
+-- A view that is about to be built has not been refreshed yet
+DO $$
+BEGIN
+    IF to_regclass('esg_portfolio_ranking') IS NULL THEN
+        DELETE FROM materialized_view_refresh WHERE view_name = 'esg_portfolio_ranking';
+    END IF;
+END;
+$$;
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS esg_portfolio_ranking AS
+WITH latest_esg AS (
+    SELECT DISTINCT ON (stock_id) stock_id, esg_score
+    FROM esg_score
+    ORDER BY stock_id, score_date DESC
+),
+latest_risk AS (
+    SELECT DISTINCT ON (portfolio_id) portfolio_id, metric_date, sharpe_ratio, beta
+    FROM risk_metrics
+    ORDER BY portfolio_id, metric_date DESC
+),
+scores AS (
+    SELECT h.portfolio_id,
+           ROUND(SUM(e.esg_score * h.holding_count * COALESCE(lp.daily_price, h.average_price))
+                 / NULLIF(SUM(h.holding_count * COALESCE(lp.daily_price, h.average_price)), 0), 2) AS weighted_esg_score,
+           ROUND(AVG(e.esg_score), 2) AS avg_esg_score,
+           COUNT(*) AS scored_holdings
+    FROM holdings h
+    JOIN latest_esg e ON e.stock_id = h.stock_id
+    LEFT JOIN latest_stock_price lp ON lp.stock_id = h.stock_id
+    WHERE h.holding_count > 0
+    GROUP BY h.portfolio_id
+)
+SELECT ROW_NUMBER() OVER (ORDER BY s.weighted_esg_score DESC NULLS LAST, s.portfolio_id) AS esg_rank,
+       s.portfolio_id,
+       s.weighted_esg_score,
+       s.avg_esg_score,
+       s.scored_holdings,
+       r.sharpe_ratio,
+       r.beta,
+       r.metric_date
+FROM scores s
+JOIN latest_risk r ON r.portfolio_id = s.portfolio_id;
+
+-- REFRESH ... CONCURRENTLY needs a unique index
+CREATE UNIQUE INDEX IF NOT EXISTS esg_portfolio_ranking_portfolio_id_idx ON esg_portfolio_ranking (portfolio_id);
+CREATE INDEX IF NOT EXISTS esg_portfolio_ranking_rank_idx ON esg_portfolio_ranking (esg_rank);
+
+-- Record the build of a new view
+INSERT INTO materialized_view_refresh (view_name, refreshed_at)
+VALUES ('esg_portfolio_ranking', now())
+ON CONFLICT (view_name) DO NOTHING;
@@ -0,0 +1,77 @@
+-- Execute Transaction
+-- Records one order from the order entry page in a single round trip: looks up
+-- the stock's latest price and the investor's most recent portfolio, checks that
+-- a SELL is covered by the holding, and inserts the transaction (the holdings
+-- trigger then updates holdings and the portfolio total).
+--
+-- Orders that cannot be executed are reported as a status instead of an error,
+-- so the caller does not have to parse exception text:
+--   'ok'                   recorded at unit_price
+--   'no_price'             the stock has no price
+--   'no_portfolio'         the investor has no portfolio
+--   'not_owned'            SELL of a stock the portfolio does not hold
+--   'insufficient_shares'  SELL of more shares than available
+-- available is the holding's share count for the SELL statuses.
+--
+-- The holding row is locked FOR UPDATE before a SELL is checked, so two
+-- concurrent sells of the same position cannot both pass the check.
+--
+-- Run after transaction_trigger.sql and latest_stock_price.sql.
+
+DROP FUNCTION IF EXISTS execute_transaction(VARCHAR, VARCHAR, VARCHAR, INTEGER, TIMESTAMP);
+
+CREATE OR REPLACE FUNCTION execute_transaction(
+    p_investor_id VARCHAR,
+    p_stock_id VARCHAR,
+    p_transaction_type VARCHAR,
+    p_unit_number INTEGER,
+    p_transaction_time TIMESTAMP
+)
+RETURNS TABLE (status TEXT, unit_price NUMERIC, available INTEGER) AS $$
+DECLARE
+    v_price NUMERIC;
+    v_portfolio_id VARCHAR(10);
+    v_holding_count INTEGER;
+BEGIN
+    SELECT lp.daily_price INTO v_price
+    FROM latest_stock_price lp
+    WHERE lp.stock_id = p_stock_id;
+
+    IF v_price IS NULL THEN
+        RETURN QUERY SELECT 'no_price'::TEXT, NULL::NUMERIC, NULL::INTEGER;
+        RETURN;
+    END IF;
+
+    SELECT p.portfolio_id INTO v_portfolio_id
+    FROM portfolio p
+    WHERE p.investor_id = p_investor_id
+    ORDER BY p.creation_date DESC
+    LIMIT 1;
+
+    IF v_portfolio_id IS NULL THEN
+        RETURN QUERY SELECT 'no_portfolio'::TEXT, v_price, NULL::INTEGER;
+        RETURN;
+    END IF;
+
+    IF p_transaction_type = 'sell' THEN
+        SELECT h.holding_count INTO v_holding_count
+        FROM holdings h
+        WHERE h.stock_id = p_stock_id AND h.portfolio_id = v_portfolio_id
+        FOR UPDATE;
+
+        IF v_holding_count IS NULL THEN
+            RETURN QUERY SELECT 'not_owned'::TEXT, v_price, 0;
+            RETURN;
+        END IF;
+        IF v_holding_count < p_unit_number THEN
+            RETURN QUERY SELECT 'insufficient_shares'::TEXT, v_price, v_holding_count;
+            RETURN;
+        END IF;
+    END IF;
+
+    INSERT INTO transaction (investor_id, stock_id, transaction_time, transaction_type, unit_price, unit_number)
+    VALUES (p_investor_id, p_stock_id, p_transaction_time, p_transaction_type, v_price, p_unit_number);
+
+    RETURN QUERY SELECT 'ok'::TEXT, v_price, v_holding_count;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,25 @@
+-- ID Sequences for Investors and Portfolios
+-- investor_id ('INV###') and portfolio_id ('PORT###') numbers are drawn from
+-- these sequences, so concurrent requests never hand out the same ID and new
+-- IDs do not depend on how the existing ones sort as strings.
+
+CREATE SEQUENCE IF NOT EXISTS investor_id_seq;
+CREATE SEQUENCE IF NOT EXISTS portfolio_id_seq;
+
+-- Move each sequence past the highest number already in use (compared numerically).
+-- Re-running this script never moves a sequence backwards.
+SELECT setval('investor_id_seq', x.max_number)
+FROM (
+    SELECT MAX(CAST(SUBSTRING(investor_id FROM 4) AS INTEGER)) AS max_number
+    FROM investor
+    WHERE investor_id ~ '^INV[0-9]+$'
+) x, investor_id_seq s
+WHERE x.max_number >= CASE WHEN s.is_called THEN s.last_value + 1 ELSE s.last_value END;
+
+SELECT setval('portfolio_id_seq', x.max_number)
+FROM (
+    SELECT MAX(CAST(SUBSTRING(portfolio_id FROM 5) AS INTEGER)) AS max_number
+    FROM portfolio
+    WHERE portfolio_id ~ '^PORT[0-9]+$'
+) x, portfolio_id_seq s
+WHERE x.max_number >= CASE WHEN s.is_called THEN s.last_value + 1 ELSE s.last_value END;
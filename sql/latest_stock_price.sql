@@ -0,0 +1,93 @@
+-- Latest Stock Price
+-- Keeps one row per stock holding its most recent price, so pages that need the
+-- current price read an indexed row instead of re-sorting the whole price history.
+-- The table is maintained incrementally by statement-level triggers on stock_price.
+
+-- Create and backfill the table (column types follow stock_price)
+CREATE TABLE IF NOT EXISTS latest_stock_price AS
+SELECT DISTINCT ON (stock_id) stock_id, price_date, daily_price
+FROM stock_price
+ORDER BY stock_id, price_date DESC;
+
+CREATE UNIQUE INDEX IF NOT EXISTS latest_stock_price_stock_id_idx
+ON latest_stock_price (stock_id);
+
+-- Drop existing triggers and functions if they exist
+DROP TRIGGER IF EXISTS latest_stock_price_on_insert ON stock_price;
+DROP TRIGGER IF EXISTS latest_stock_price_on_update ON stock_price;
+DROP TRIGGER IF EXISTS latest_stock_price_on_delete ON stock_price;
+DROP FUNCTION IF EXISTS advance_latest_stock_price();
+DROP FUNCTION IF EXISTS recompute_latest_stock_price();
+
+-- New prices only ever move a stock's latest price forward
+CREATE OR REPLACE FUNCTION advance_latest_stock_price()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO latest_stock_price (stock_id, price_date, daily_price)
+    SELECT DISTINCT ON (stock_id) stock_id, price_date, daily_price
+    FROM new_prices
+    ORDER BY stock_id, price_date DESC
+    ON CONFLICT (stock_id) DO UPDATE
+    SET price_date = EXCLUDED.price_date,
+        daily_price = EXCLUDED.daily_price
+    WHERE EXCLUDED.price_date >= latest_stock_price.price_date;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Updated or deleted prices may have been the latest one, so the affected
+-- stocks are looked up again (a single index probe per stock)
+CREATE OR REPLACE FUNCTION recompute_latest_stock_price()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_stock_ids TEXT[];
+BEGIN
+    SELECT array_agg(DISTINCT stock_id) INTO v_stock_ids FROM old_prices;
+    IF TG_OP = 'UPDATE' THEN
+        SELECT v_stock_ids || array_agg(DISTINCT stock_id) INTO v_stock_ids FROM new_prices;
+    END IF;
+
+    -- With stock_price partitioned by date, each probe reads the newest
+    -- partitions first and stops at the first one holding a price
+    INSERT INTO latest_stock_price (stock_id, price_date, daily_price)
+    SELECT s.stock_id, sp.price_date, sp.daily_price
+    FROM (SELECT DISTINCT unnest(v_stock_ids) AS stock_id) s
+    CROSS JOIN LATERAL (
+        SELECT p.price_date, p.daily_price
+        FROM stock_price p
+        WHERE p.stock_id = s.stock_id
+        ORDER BY p.price_date DESC
+        LIMIT 1
+    ) sp
+    ON CONFLICT (stock_id) DO UPDATE
+    SET price_date = EXCLUDED.price_date,
+        daily_price = EXCLUDED.daily_price;
+
+    -- Stocks with no prices left have no latest price
+    DELETE FROM latest_stock_price l
+    WHERE l.stock_id = ANY(v_stock_ids)
+      AND NOT EXISTS (SELECT 1 FROM stock_price sp WHERE sp.stock_id = l.stock_id);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create the triggers
+CREATE TRIGGER latest_stock_price_on_insert
+AFTER INSERT ON stock_price
+REFERENCING NEW TABLE AS new_prices
+FOR EACH STATEMENT
+EXECUTE FUNCTION advance_latest_stock_price();
+
+CREATE TRIGGER latest_stock_price_on_update
+AFTER UPDATE ON stock_price
+REFERENCING OLD TABLE AS old_prices NEW TABLE AS new_prices
+FOR EACH STATEMENT
+EXECUTE FUNCTION recompute_latest_stock_price();
+
+CREATE TRIGGER latest_stock_price_on_delete
+AFTER DELETE ON stock_price
+REFERENCING OLD TABLE AS old_prices
+FOR EACH STATEMENT
+EXECUTE FUNCTION recompute_latest_stock_price();
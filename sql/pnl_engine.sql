@@ -0,0 +1,329 @@
+-- Incremental P&L Engine
+-- Keeps the unrealized P&L behind /top_investors and /best_buys up to date as
+-- transactions, holdings and prices change, so the leaderboards read the first
+-- N rows of an index instead of re-joining every holding and buy on each view.
+--
+--   holding_pnl   one row per holding: (latest price - average price) * count
+--   investor_pnl  one row per investor: sum of its holdings' P&L, holding count
+--   buy_pnl       one row per buy transaction: (latest price - unit price) * units
+--
+-- Statement-level triggers recompute only the rows a statement touched:
+--   holdings insert/update/delete   -> those holdings and their investors
+--   latest_stock_price changes      -> holdings and buys of the repriced stocks
+--   transaction insert/update/delete -> those buys
+--   investor insert                 -> a zero row for the new investor
+--
+-- Writers lock the latest_stock_price rows of the stocks they price and the
+-- investor_pnl rows they re-total (in investor_id order) before reading, so a
+-- concurrent trade and price update cannot both compute from stale data.
+-- The tables are backfilled only when they are all empty, i.e. on the first
+-- run; re-running this script leaves their rows alone. `SELECT rebuild_pnl();`
+-- (or `python server.py rebuild-pnl`) recomputes everything from scratch.
+--
+-- Run after latest_stock_price.sql.
+
+-- Create the tables
+CREATE TABLE IF NOT EXISTS holding_pnl (
+    portfolio_id VARCHAR(10) NOT NULL,
+    stock_id VARCHAR(10) NOT NULL,
+    investor_id VARCHAR(10) NOT NULL,
+    unrealized_pnl NUMERIC NOT NULL,
+    PRIMARY KEY (portfolio_id, stock_id)
+);
+
+CREATE INDEX IF NOT EXISTS holding_pnl_investor_id_idx ON holding_pnl (investor_id);
+CREATE INDEX IF NOT EXISTS holding_pnl_stock_id_idx ON holding_pnl (stock_id);
+
+CREATE TABLE IF NOT EXISTS investor_pnl (
+    investor_id VARCHAR(10) PRIMARY KEY REFERENCES investor ON DELETE CASCADE,
+    total_pnl NUMERIC NOT NULL DEFAULT 0,
+    num_holdings INTEGER NOT NULL DEFAULT 0
+);
+
+-- Leaderboard order: reading the top N is an N-row index scan
+CREATE INDEX IF NOT EXISTS investor_pnl_rank_idx ON investor_pnl (total_pnl DESC, investor_id);
+
+CREATE TABLE IF NOT EXISTS buy_pnl (
+    investor_id VARCHAR(10) NOT NULL,
+    stock_id VARCHAR(10) NOT NULL,
+    transaction_time TIMESTAMP NOT NULL,
+    unit_price NUMERIC(10,2) NOT NULL,
+    unit_number INTEGER NOT NULL,
+    current_price NUMERIC(10,2),
+    unrealized_gain NUMERIC GENERATED ALWAYS AS (ROUND((current_price - unit_price) * unit_number, 2)) STORED,
+    PRIMARY KEY (investor_id, stock_id, transaction_time)
+);
+
+CREATE INDEX IF NOT EXISTS buy_pnl_stock_id_idx ON buy_pnl (stock_id);
+CREATE INDEX IF NOT EXISTS buy_pnl_rank_idx ON buy_pnl (unrealized_gain DESC NULLS LAST);
+
+-- Drop existing triggers and functions if they exist
+DROP TRIGGER IF EXISTS pnl_on_holdings_insert ON holdings;
+DROP TRIGGER IF EXISTS pnl_on_holdings_update ON holdings;
+DROP TRIGGER IF EXISTS pnl_on_holdings_delete ON holdings;
+DROP TRIGGER IF EXISTS pnl_on_latest_price_insert ON latest_stock_price;
+DROP TRIGGER IF EXISTS pnl_on_latest_price_update ON latest_stock_price;
+DROP TRIGGER IF EXISTS pnl_on_latest_price_delete ON latest_stock_price;
+DROP TRIGGER IF EXISTS pnl_on_transaction_insert ON transaction;
+DROP TRIGGER IF EXISTS pnl_on_transaction_update ON transaction;
+DROP TRIGGER IF EXISTS pnl_on_transaction_delete ON transaction;
+DROP TRIGGER IF EXISTS pnl_on_investor_insert ON investor;
+DROP FUNCTION IF EXISTS holdings_pnl_changed();
+DROP FUNCTION IF EXISTS latest_price_pnl_changed();
+DROP FUNCTION IF EXISTS transaction_pnl_changed();
+DROP FUNCTION IF EXISTS investor_pnl_added();
+DROP FUNCTION IF EXISTS refresh_holding_pnl(TEXT[], TEXT[]);
+DROP FUNCTION IF EXISTS refresh_investor_pnl(TEXT[]);
+DROP FUNCTION IF EXISTS rebuild_pnl();
+
+-- Re-total the given investors from holding_pnl
+CREATE OR REPLACE FUNCTION refresh_investor_pnl(p_investor_ids TEXT[])
+RETURNS VOID AS $$
+BEGIN
+    PERFORM 1 FROM investor_pnl
+    WHERE investor_id = ANY(p_investor_ids)
+    ORDER BY investor_id
+    FOR UPDATE;
+
+    INSERT INTO investor_pnl (investor_id, total_pnl, num_holdings)
+    SELECT i.investor_id, COALESCE(SUM(hp.unrealized_pnl), 0), COUNT(hp.stock_id)
+    FROM investor i
+    LEFT JOIN holding_pnl hp ON hp.investor_id = i.investor_id
+    WHERE i.investor_id = ANY(p_investor_ids)
+    GROUP BY i.investor_id
+    ON CONFLICT (investor_id) DO UPDATE
+    SET total_pnl = EXCLUDED.total_pnl,
+        num_holdings = EXCLUDED.num_holdings;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recompute the holdings at (p_portfolio_ids[i], p_stock_ids[i]), then their investors
+CREATE OR REPLACE FUNCTION refresh_holding_pnl(p_portfolio_ids TEXT[], p_stock_ids TEXT[])
+RETURNS VOID AS $$
+BEGIN
+    PERFORM 1 FROM latest_stock_price
+    WHERE stock_id = ANY(p_stock_ids)
+    ORDER BY stock_id
+    FOR SHARE;
+
+    DELETE FROM holding_pnl hp
+    USING unnest(p_portfolio_ids, p_stock_ids) AS k(portfolio_id, stock_id)
+    WHERE hp.portfolio_id = k.portfolio_id AND hp.stock_id = k.stock_id;
+
+    INSERT INTO holding_pnl (portfolio_id, stock_id, investor_id, unrealized_pnl)
+    SELECT h.portfolio_id, h.stock_id, p.investor_id,
+           COALESCE((lp.daily_price - h.average_price) * h.holding_count, 0)
+    FROM (SELECT DISTINCT * FROM unnest(p_portfolio_ids, p_stock_ids) AS k(portfolio_id, stock_id)) k
+    JOIN holdings h ON h.portfolio_id = k.portfolio_id AND h.stock_id = k.stock_id
+    JOIN portfolio p ON p.portfolio_id = h.portfolio_id
+    LEFT JOIN latest_stock_price lp ON lp.stock_id = h.stock_id;
+
+    PERFORM refresh_investor_pnl(ARRAY(
+        SELECT DISTINCT investor_id FROM portfolio WHERE portfolio_id = ANY(p_portfolio_ids)
+    ));
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION holdings_pnl_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_portfolio_ids TEXT[];
+    v_stock_ids TEXT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(portfolio_id), array_agg(stock_id) INTO v_portfolio_ids, v_stock_ids
+        FROM new_holdings;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(portfolio_id), array_agg(stock_id) INTO v_portfolio_ids, v_stock_ids
+        FROM old_holdings;
+    ELSE
+        SELECT array_agg(portfolio_id), array_agg(stock_id) INTO v_portfolio_ids, v_stock_ids
+        FROM (
+            SELECT portfolio_id, stock_id FROM old_holdings
+            UNION
+            SELECT portfolio_id, stock_id FROM new_holdings
+        ) k;
+    END IF;
+
+    IF v_portfolio_ids IS NOT NULL THEN
+        PERFORM refresh_holding_pnl(v_portfolio_ids, v_stock_ids);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- A stock's latest price moved: reprice its holdings and buys
+CREATE OR REPLACE FUNCTION latest_price_pnl_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_stock_ids TEXT[];
+    v_investor_ids TEXT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(stock_id) INTO v_stock_ids FROM new_prices;
+    ELSE
+        SELECT array_agg(stock_id) INTO v_stock_ids FROM old_prices;
+    END IF;
+
+    UPDATE holding_pnl hp
+    SET unrealized_pnl = COALESCE((lp.daily_price - h.average_price) * h.holding_count, 0)
+    FROM holdings h
+    LEFT JOIN latest_stock_price lp ON lp.stock_id = h.stock_id
+    WHERE hp.stock_id = ANY(v_stock_ids)
+      AND h.portfolio_id = hp.portfolio_id
+      AND h.stock_id = hp.stock_id;
+
+    SELECT array_agg(DISTINCT investor_id) INTO v_investor_ids
+    FROM holding_pnl
+    WHERE stock_id = ANY(v_stock_ids);
+
+    IF v_investor_ids IS NOT NULL THEN
+        PERFORM refresh_investor_pnl(v_investor_ids);
+    END IF;
+
+    UPDATE buy_pnl b
+    SET current_price = (SELECT lp.daily_price FROM latest_stock_price lp WHERE lp.stock_id = b.stock_id)
+    WHERE b.stock_id = ANY(v_stock_ids);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION transaction_pnl_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        DELETE FROM buy_pnl b
+        USING old_transactions o
+        WHERE b.investor_id = o.investor_id
+          AND b.stock_id = o.stock_id
+          AND b.transaction_time = o.transaction_time;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM 1 FROM latest_stock_price
+        WHERE stock_id IN (SELECT stock_id FROM new_transactions WHERE transaction_type = 'buy')
+        ORDER BY stock_id
+        FOR SHARE;
+
+        INSERT INTO buy_pnl (investor_id, stock_id, transaction_time, unit_price, unit_number, current_price)
+        SELECT n.investor_id, n.stock_id, n.transaction_time, n.unit_price, n.unit_number, lp.daily_price
+        FROM new_transactions n
+        LEFT JOIN latest_stock_price lp ON lp.stock_id = n.stock_id
+        WHERE n.transaction_type = 'buy';
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION investor_pnl_added()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO investor_pnl (investor_id)
+    SELECT investor_id FROM new_investors
+    ON CONFLICT (investor_id) DO NOTHING;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recompute all three tables from holdings, transactions and latest prices
+CREATE OR REPLACE FUNCTION rebuild_pnl()
+RETURNS VOID AS $$
+BEGIN
+    LOCK TABLE holding_pnl, investor_pnl, buy_pnl IN EXCLUSIVE MODE;
+    TRUNCATE holding_pnl, investor_pnl, buy_pnl;
+
+    INSERT INTO holding_pnl (portfolio_id, stock_id, investor_id, unrealized_pnl)
+    SELECT h.portfolio_id, h.stock_id, p.investor_id,
+           COALESCE((lp.daily_price - h.average_price) * h.holding_count, 0)
+    FROM holdings h
+    JOIN portfolio p ON p.portfolio_id = h.portfolio_id
+    LEFT JOIN latest_stock_price lp ON lp.stock_id = h.stock_id;
+
+    INSERT INTO investor_pnl (investor_id, total_pnl, num_holdings)
+    SELECT i.investor_id, COALESCE(SUM(hp.unrealized_pnl), 0), COUNT(hp.stock_id)
+    FROM investor i
+    LEFT JOIN holding_pnl hp ON hp.investor_id = i.investor_id
+    GROUP BY i.investor_id;
+
+    INSERT INTO buy_pnl (investor_id, stock_id, transaction_time, unit_price, unit_number, current_price)
+    SELECT t.investor_id, t.stock_id, t.transaction_time, t.unit_price, t.unit_number, lp.daily_price
+    FROM transaction t
+    LEFT JOIN latest_stock_price lp ON lp.stock_id = t.stock_id
+    WHERE t.transaction_type = 'buy';
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create the triggers
+CREATE TRIGGER pnl_on_holdings_insert
+AFTER INSERT ON holdings
+REFERENCING NEW TABLE AS new_holdings
+FOR EACH STATEMENT
+EXECUTE FUNCTION holdings_pnl_changed();
+
+CREATE TRIGGER pnl_on_holdings_update
+AFTER UPDATE ON holdings
+REFERENCING OLD TABLE AS old_holdings NEW TABLE AS new_holdings
+FOR EACH STATEMENT
+EXECUTE FUNCTION holdings_pnl_changed();
+
+CREATE TRIGGER pnl_on_holdings_delete
+AFTER DELETE ON holdings
+REFERENCING OLD TABLE AS old_holdings
+FOR EACH STATEMENT
+EXECUTE FUNCTION holdings_pnl_changed();
+
+CREATE TRIGGER pnl_on_latest_price_insert
+AFTER INSERT ON latest_stock_price
+REFERENCING NEW TABLE AS new_prices
+FOR EACH STATEMENT
+EXECUTE FUNCTION latest_price_pnl_changed();
+
+CREATE TRIGGER pnl_on_latest_price_update
+AFTER UPDATE ON latest_stock_price
+REFERENCING OLD TABLE AS old_prices NEW TABLE AS new_prices
+FOR EACH STATEMENT
+EXECUTE FUNCTION latest_price_pnl_changed();
+
+CREATE TRIGGER pnl_on_latest_price_delete
+AFTER DELETE ON latest_stock_price
+REFERENCING OLD TABLE AS old_prices
+FOR EACH STATEMENT
+EXECUTE FUNCTION latest_price_pnl_changed();
+
+CREATE TRIGGER pnl_on_transaction_insert
+AFTER INSERT ON transaction
+REFERENCING NEW TABLE AS new_transactions
+FOR EACH STATEMENT
+EXECUTE FUNCTION transaction_pnl_changed();
+
+CREATE TRIGGER pnl_on_transaction_update
+AFTER UPDATE ON transaction
+REFERENCING OLD TABLE AS old_transactions NEW TABLE AS new_transactions
+FOR EACH STATEMENT
+EXECUTE FUNCTION transaction_pnl_changed();
+
+CREATE TRIGGER pnl_on_transaction_delete
+AFTER DELETE ON transaction
+REFERENCING OLD TABLE AS old_transactions
+FOR EACH STATEMENT
+EXECUTE FUNCTION transaction_pnl_changed();
+
+CREATE TRIGGER pnl_on_investor_insert
+AFTER INSERT ON investor
+REFERENCING NEW TABLE AS new_investors
+FOR EACH STATEMENT
+EXECUTE FUNCTION investor_pnl_added();
+
+-- Backfill new (empty) tables; a full recompute is left to rebuild_pnl()
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM holding_pnl)
+       AND NOT EXISTS (SELECT 1 FROM investor_pnl)
+       AND NOT EXISTS (SELECT 1 FROM buy_pnl) THEN
+        PERFORM rebuild_pnl();
+    END IF;
+END;
+$$;
@@ -1,5 +1,25 @@
 -- Transaction Trigger for Automatic Holdings Update
--- This trigger automatically updates the Holdings table when a transaction is recorded
+-- This trigger automatically updates the Holdings table when transactions are recorded
+--
+-- It runs once per INSERT statement (not once per row) and applies the whole
+-- statement's transactions with set-based statements, so batch loads of many
+-- trades cost a handful of statements instead of several per trade.
+--
+-- Within one statement, a position (portfolio, stock) that only buys or only
+-- sells is netted: its buys are averaged into the holding in one step, and its
+-- sells are checked against the holding in one step, which gives the same result
+-- as applying them one by one. A position that both buys and sells is replayed
+-- trade by trade in transaction_time order, since its average price and its
+-- sell checks depend on the order of the trades. Either way the holdings end up
+-- as if the previous per-row trigger had applied the trades in time order.
+--
+-- Concurrent statements on the same positions are serialized by row locks: the
+-- holdings rows are locked FOR UPDATE in (stock_id, portfolio_id) order before
+-- the sell check reads them, and holdings a buy opens are created first (as
+-- empty rows, ON CONFLICT DO NOTHING) so two first buys of one position queue
+-- on the same row instead of racing to insert it. Portfolio rows are locked in
+-- portfolio_id order before their totals change. Every statement takes its
+-- locks in the same order, so concurrent batches do not deadlock each other.
 
 -- Drop existing trigger and function if they exist
 DROP TRIGGER IF EXISTS update_holdings_on_transaction ON transaction;
@@ -9,87 +29,190 @@ DROP FUNCTION IF EXISTS process_transaction_holdings();
 CREATE OR REPLACE FUNCTION process_transaction_holdings()
 RETURNS TRIGGER AS $$
 DECLARE
-    v_portfolio_id VARCHAR(10);
-    v_current_holding_count INTEGER;
-    v_current_average_price NUMERIC(10, 2);
-    v_new_average_price NUMERIC(10, 2);
+    v_investor_id VARCHAR(10);
+    v_problem RECORD;
+    v_trade RECORD;
+    v_holding_count INTEGER;
+    -- Net change per position, one array element per (portfolio, stock)
+    v_portfolio_ids TEXT[];
+    v_stock_ids TEXT[];
+    v_buy_units BIGINT[];
+    v_buy_values NUMERIC[];
+    v_sell_units BIGINT[];
+    v_sell_values NUMERIC[];
+    v_missing INTEGER;
+    v_created INTEGER;
 BEGIN
-    -- Find the investor's portfolio (using the most recent one)
-    SELECT portfolio_id INTO v_portfolio_id
-    FROM portfolio
-    WHERE investor_id = NEW.investor_id
-    ORDER BY creation_date DESC
+    -- If an investor has no portfolio, raise an error
+    SELECT n.investor_id INTO v_investor_id
+    FROM new_transactions n
+    WHERE NOT EXISTS (SELECT 1 FROM portfolio p WHERE p.investor_id = n.investor_id)
     LIMIT 1;
-    
-    -- If no portfolio exists for this investor, raise an error
-    IF v_portfolio_id IS NULL THEN
-        RAISE EXCEPTION 'No portfolio found for investor %', NEW.investor_id;
+
+    IF v_investor_id IS NOT NULL THEN
+        RAISE EXCEPTION 'No portfolio found for investor %', v_investor_id;
     END IF;
-    
-    -- Check if the holding already exists
-    SELECT holding_count, average_price INTO v_current_holding_count, v_current_average_price
-    FROM holdings
-    WHERE stock_id = NEW.stock_id AND portfolio_id = v_portfolio_id;
-    
-    -- Process SELL transaction
-    IF NEW.transaction_type = 'sell' THEN
-        -- Check if holding exists
-        IF v_current_holding_count IS NULL THEN
-            RAISE EXCEPTION 'Cannot sell stock % - no holdings found in portfolio %', NEW.stock_id, v_portfolio_id;
-        END IF;
-        
-        -- Check if there are enough shares to sell
-        IF v_current_holding_count < NEW.unit_number THEN
-            RAISE EXCEPTION 'Insufficient shares to sell. Available: %, Requested: %', v_current_holding_count, NEW.unit_number;
-        END IF;
-        
-        -- Update holding: decrement holding_count
-        UPDATE holdings
-        SET holding_count = holding_count - NEW.unit_number
-        WHERE stock_id = NEW.stock_id AND portfolio_id = v_portfolio_id;
-        
-        -- If holding_count becomes 0, delete the holding
-        DELETE FROM holdings
-        WHERE stock_id = NEW.stock_id 
-          AND portfolio_id = v_portfolio_id 
-          AND holding_count = 0;
-        
-        -- Update portfolio total_value (decrease by sale amount)
-        UPDATE portfolio
-        SET total_value = total_value - (NEW.unit_price * NEW.unit_number)
-        WHERE portfolio_id = v_portfolio_id;
-        
-    -- Process BUY transaction
-    ELSIF NEW.transaction_type = 'buy' THEN
-        -- If holding exists, update it
-        IF v_current_holding_count IS NOT NULL THEN
-            -- Calculate new average price: (old_avg * old_count + new_price * new_count) / (old_count + new_count)
-            v_new_average_price := (v_current_average_price * v_current_holding_count + NEW.unit_price * NEW.unit_number) 
-                                   / (v_current_holding_count + NEW.unit_number);
-            
-            -- Update the holding
-            UPDATE holdings
-            SET holding_count = holding_count + NEW.unit_number,
-                average_price = v_new_average_price
-            WHERE stock_id = NEW.stock_id AND portfolio_id = v_portfolio_id;
-        ELSE
-            -- Create new holding
+
+    -- Aggregate the transactions per position, using each investor's most recent portfolio
+    SELECT array_agg(d.portfolio_id), array_agg(d.stock_id),
+           array_agg(d.buy_units), array_agg(d.buy_value),
+           array_agg(d.sell_units), array_agg(d.sell_value)
+    INTO v_portfolio_ids, v_stock_ids, v_buy_units, v_buy_values, v_sell_units, v_sell_values
+    FROM (
+        SELECT t.portfolio_id, n.stock_id,
+               COALESCE(SUM(n.unit_number) FILTER (WHERE n.transaction_type = 'buy'), 0) AS buy_units,
+               COALESCE(SUM(n.unit_price * n.unit_number) FILTER (WHERE n.transaction_type = 'buy'), 0) AS buy_value,
+               COALESCE(SUM(n.unit_number) FILTER (WHERE n.transaction_type = 'sell'), 0) AS sell_units,
+               COALESCE(SUM(n.unit_price * n.unit_number) FILTER (WHERE n.transaction_type = 'sell'), 0) AS sell_value
+        FROM new_transactions n
+        JOIN (
+            SELECT DISTINCT ON (investor_id) investor_id, portfolio_id
+            FROM portfolio
+            WHERE investor_id IN (SELECT investor_id FROM new_transactions)
+            ORDER BY investor_id, creation_date DESC
+        ) t ON t.investor_id = n.investor_id
+        GROUP BY t.portfolio_id, n.stock_id
+    ) d;
+
+    -- Lock the positions' holdings, and create the holdings that buys open. A row
+    -- we create stays locked by us until commit. If another transaction created
+    -- or deleted one of the rows meanwhile, the insert skips it; lock again.
+    LOOP
+        PERFORM 1
+        FROM holdings h
+        JOIN unnest(v_portfolio_ids, v_stock_ids) AS d(portfolio_id, stock_id)
+          ON h.stock_id = d.stock_id AND h.portfolio_id = d.portfolio_id
+        ORDER BY h.stock_id, h.portfolio_id
+        FOR UPDATE OF h;
+
+        WITH missing AS (
+            SELECT d.stock_id, d.portfolio_id
+            FROM unnest(v_portfolio_ids, v_stock_ids, v_buy_units) AS d(portfolio_id, stock_id, buy_units)
+            WHERE d.buy_units > 0
+              AND NOT EXISTS (
+                  SELECT 1 FROM holdings h
+                  WHERE h.stock_id = d.stock_id AND h.portfolio_id = d.portfolio_id
+              )
+        ),
+        created AS (
             INSERT INTO holdings (stock_id, portfolio_id, average_price, holding_count)
-            VALUES (NEW.stock_id, v_portfolio_id, NEW.unit_price, NEW.unit_number);
+            SELECT stock_id, portfolio_id, 0, 0
+            FROM missing
+            ORDER BY stock_id, portfolio_id
+            ON CONFLICT (stock_id, portfolio_id) DO NOTHING
+            RETURNING 1
+        )
+        SELECT (SELECT COUNT(*) FROM missing), (SELECT COUNT(*) FROM created) INTO v_missing, v_created;
+
+        EXIT WHEN v_created = v_missing;
+    END LOOP;
+
+    -- Check that the SELLs of sell-only positions are covered by the holding
+    SELECT d.portfolio_id, d.stock_id, h.holding_count, d.sell_units INTO v_problem
+    FROM unnest(v_portfolio_ids, v_stock_ids, v_buy_units, v_sell_units)
+         AS d(portfolio_id, stock_id, buy_units, sell_units)
+    LEFT JOIN holdings h ON h.stock_id = d.stock_id AND h.portfolio_id = d.portfolio_id
+    WHERE d.sell_units > 0 AND d.buy_units = 0
+      AND COALESCE(h.holding_count, 0) < d.sell_units
+    LIMIT 1;
+
+    IF FOUND THEN
+        IF v_problem.holding_count IS NULL THEN
+            RAISE EXCEPTION 'Cannot sell stock % - no holdings found in portfolio %', v_problem.stock_id, v_problem.portfolio_id;
         END IF;
-        
-        -- Update portfolio total_value (increase by purchase amount)
-        UPDATE portfolio
-        SET total_value = total_value + (NEW.unit_price * NEW.unit_number)
-        WHERE portfolio_id = v_portfolio_id;
+        RAISE EXCEPTION 'Insufficient shares to sell. Available: %, Requested: %',
+            v_problem.holding_count, v_problem.sell_units;
     END IF;
-    
-    RETURN NEW;
+
+    -- Update the buy-only and sell-only holdings (new ones start from zero shares)
+    -- New average price: (old_avg * old_count + purchase value) / (old_count + purchased units)
+    UPDATE holdings h
+    SET holding_count = h.holding_count + d.buy_units - d.sell_units,
+        average_price = CASE
+            WHEN d.buy_units > 0
+            THEN (h.average_price * h.holding_count + d.buy_value) / (h.holding_count + d.buy_units)
+            ELSE h.average_price
+        END
+    FROM unnest(v_portfolio_ids, v_stock_ids, v_buy_units, v_buy_values, v_sell_units)
+         AS d(portfolio_id, stock_id, buy_units, buy_value, sell_units)
+    WHERE h.stock_id = d.stock_id AND h.portfolio_id = d.portfolio_id
+      AND (d.buy_units = 0 OR d.sell_units = 0);
+
+    -- Replay the positions that both buy and sell, trade by trade in time order.
+    -- Their holdings exist (a buy created them above) and are locked by us. A
+    -- sell that empties the holding leaves it at zero shares, so a later buy
+    -- restarts the average at its own price and a later sell is refused.
+    FOR v_trade IN
+        SELECT d.portfolio_id, n.stock_id, n.transaction_type, n.unit_price, n.unit_number
+        FROM new_transactions n
+        JOIN (
+            SELECT DISTINCT ON (investor_id) investor_id, portfolio_id
+            FROM portfolio
+            WHERE investor_id IN (SELECT investor_id FROM new_transactions)
+            ORDER BY investor_id, creation_date DESC
+        ) t ON t.investor_id = n.investor_id
+        JOIN unnest(v_portfolio_ids, v_stock_ids, v_buy_units, v_sell_units)
+             AS d(portfolio_id, stock_id, buy_units, sell_units)
+          ON d.portfolio_id = t.portfolio_id AND d.stock_id = n.stock_id
+        WHERE d.buy_units > 0 AND d.sell_units > 0
+        ORDER BY n.stock_id, d.portfolio_id, n.transaction_time
+    LOOP
+        IF v_trade.transaction_type = 'buy' THEN
+            UPDATE holdings h
+            SET holding_count = h.holding_count + v_trade.unit_number,
+                average_price = (h.average_price * h.holding_count + v_trade.unit_price * v_trade.unit_number)
+                                / (h.holding_count + v_trade.unit_number)
+            WHERE h.stock_id = v_trade.stock_id AND h.portfolio_id = v_trade.portfolio_id;
+        ELSE
+            SELECT h.holding_count INTO v_holding_count
+            FROM holdings h
+            WHERE h.stock_id = v_trade.stock_id AND h.portfolio_id = v_trade.portfolio_id;
+
+            IF v_holding_count = 0 THEN
+                RAISE EXCEPTION 'Cannot sell stock % - no holdings found in portfolio %', v_trade.stock_id, v_trade.portfolio_id;
+            END IF;
+            IF v_holding_count < v_trade.unit_number THEN
+                RAISE EXCEPTION 'Insufficient shares to sell. Available: %, Requested: %',
+                    v_holding_count, v_trade.unit_number;
+            END IF;
+
+            UPDATE holdings h
+            SET holding_count = h.holding_count - v_trade.unit_number
+            WHERE h.stock_id = v_trade.stock_id AND h.portfolio_id = v_trade.portfolio_id;
+        END IF;
+    END LOOP;
+
+    -- If holding_count becomes 0, delete the holding
+    DELETE FROM holdings h
+    USING unnest(v_portfolio_ids, v_stock_ids) AS d(portfolio_id, stock_id)
+    WHERE h.stock_id = d.stock_id
+      AND h.portfolio_id = d.portfolio_id
+      AND h.holding_count = 0;
+
+    -- Update portfolio total_value (increase by purchases, decrease by sales)
+    PERFORM 1
+    FROM portfolio p
+    WHERE p.portfolio_id = ANY(v_portfolio_ids)
+    ORDER BY p.portfolio_id
+    FOR NO KEY UPDATE;
+
+    UPDATE portfolio p
+    SET total_value = p.total_value + v.delta
+    FROM (
+        SELECT d.portfolio_id, SUM(d.buy_value - d.sell_value) AS delta
+        FROM unnest(v_portfolio_ids, v_buy_values, v_sell_values)
+             AS d(portfolio_id, buy_value, sell_value)
+        GROUP BY d.portfolio_id
+    ) v
+    WHERE p.portfolio_id = v.portfolio_id;
+
+    RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
 -- Create the trigger
 CREATE TRIGGER update_holdings_on_transaction
 AFTER INSERT ON transaction
-FOR EACH ROW
+REFERENCING NEW TABLE AS new_transactions
+FOR EACH STATEMENT
 EXECUTE FUNCTION process_transaction_holdings();